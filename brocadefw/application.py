@@ -1,19 +1,40 @@
 # -*- coding: utf-8 -*-
 """ ベースアプリケーション """
 
+import json
+
 if __name__ == "__main__":
-	from utilities import mimeutils, httputils
+	from utilities import mimeutils, httputils, strutils, timeutils, formparser
 	from state     import cookie, session
-	from output    import template, minify
+	from output    import template, templateindex, minify, assets, compress
+	from db        import kvs
+	import router
 else:
-	from .utilities import mimeutils, httputils
+	from .utilities import mimeutils, httputils, strutils, timeutils, formparser
 	from .state     import cookie, session
-	from .output    import template, minify
+	from .output    import template, templateindex, minify, assets, compress
+	from .db        import kvs
+	from .          import router
 
 
 class BaseApplication(object):
 	""" アプリケーションクラス """
 
+	# ハンドラクラスの読み込み方法
+	# True: アプリケーション生成時に全て読み込む（モジュール名・クラス名の誤りを起動時に検出できる）
+	# False: 初回使用時に読み込んで記憶しておく（ハンドラが多い場合に起動が速い）
+	EAGER_LOADING = True
+
+	# 起動時にエラーページ（デフォルトハンドラの "@http_status/[ステータス].html"）のキャッシュを作成しておくか？
+	WARM_ERROR_PAGES = True
+
+	# ハンドラオブジェクトをスレッドごとにプールして再利用するか？
+	# （生成コストを省ける; 独自の属性を持つハンドラは_clear()で解放すること）
+	HANDLER_POOLING = False
+
+	# スレッド・ハンドラクラスごとにプールしておくハンドラオブジェクトの最大数
+	HANDLER_POOL_SIZE = 4
+
 	def __init__(self, root_dir, default_handler_info, *maps):
 		""" コンストラクタ
 
@@ -21,19 +42,30 @@ class BaseApplication(object):
 		@param default_handler_info: どれにもマッチしなかった場合のデフォルトハンドラ([モジュール名], [クラス名])
 		@param maps: マッピングデータ([正規表現], [モジュール名], [クラス名])
 		"""
-		import re
-		maps_parsed = []
-		for pattern, module_name, class_name in maps:
-			pattern_c   = re.compile(pattern)
-			maps_parsed.append((pattern_c, module_name, class_name))
-
-		self.__maps_parsed          = maps_parsed
-		self.__root_dir             = root_dir
-		self.__default_handler_info = default_handler_info
+		from threading import Lock, local
+		self.__router        = router.Router([pattern for (pattern, module_name, class_name) in maps])
+		self.__root_dir      = root_dir
+		self.__page_cache    = None
+		self.__handler_pools = local()
+
+		# ハンドラクラスの一覧（末尾はデフォルトハンドラ）
+		self.__handler_info  = [(module_name, class_name) for (pattern, module_name, class_name) in maps]
+		self.__handler_info.append(default_handler_info)
+		self.__handlers      = [None] * len(self.__handler_info)
+		self.__handlers_lock = Lock()
+		if self.EAGER_LOADING:
+			for index in range(len(self.__handlers)):
+				self.__get_handler(index)
+
+		# テンプレートの索引を起動時に作成しておく
+		from os import path
+		templateindex.get_index(path.join(root_dir, "templates"))
+		if self.WARM_ERROR_PAGES:
+			self.warm_error_pages()
 
 
 	def test_run(self, host = "", port = 8080):
-		""" テスト用サーバを起動（本番環境で使用しないこと）
+		""" テスト用サーバを起動（本番環境で使用しないこと; 本番環境ではbrocadefw.server.serveを使う）
 
 		@param host: ホスト名
 		@param port: 待機ポート
@@ -41,6 +73,90 @@ class BaseApplication(object):
 		raise NotImplementedError("BaseApplication::test_run")
 
 
+	def warm_error_pages(self):
+		""" エラーページのキャッシュを作成
+		テンプレートがある言語・ステータスごとに、デフォルトハンドラでエラーページを表示しておく
+		"""
+		import re
+		from os import path
+		base_dir = path.join(self.__root_dir, "templates")
+		pages = set()
+		for (searchdir, name) in templateindex.get_index(base_dir).items():
+			match = re.match(r"^@http_status/(\d{3})\.html$", name)
+			if match == None:
+				continue
+
+			(language, template_type, device) = path.relpath(searchdir, base_dir).split(path.sep)
+			if template_type == "html" and device == "default":
+				pages.add((language, int(match.group(1))))
+
+		handler = self.__get_handler(len(self.__handlers) - 1)
+		for (language, status) in sorted(pages):
+			self._create_handler(handler, {"HTTP_ACCEPT_LANGUAGE": language}).status_error(status)
+
+
+	def _create_handler(self, handler, environ):
+		""" リクエスト外でハンドラオブジェクトを作成（キャッシュの作成用）
+
+		@param handler: ハンドラクラス
+		@param environ: 環境変数（ルートへのGETリクエストとして足りないものは補われる）
+		@return: ハンドラオブジェクト
+		"""
+		raise NotImplementedError("BaseApplication::_create_handler")
+
+
+	def _acquire_handler(self, handler, *args):
+		""" リクエストを処理するハンドラオブジェクトを取得（HANDLER_POOLINGならプールから取り出して初期化）
+
+		@param handler: ハンドラクラス
+		@param args: ハンドラのコンストラクタに渡す引数（ルートディレクトリ以降; プールから取り出した場合は_reset()に渡す）
+		@return: ハンドラオブジェクト
+		"""
+		if self.HANDLER_POOLING:
+			pool = self.__get_handler_pool(handler)
+			if len(pool) > 0:
+				handler_instance = pool.pop()
+				handler_instance._reset(*args)
+				handler_instance.use_page_cache(self.__page_cache)
+				return handler_instance
+
+		handler_instance = handler(self.__root_dir, *args)
+		handler_instance.use_page_cache(self.__page_cache)
+		return handler_instance
+
+
+	def _release_handler(self, handler_instance):
+		""" リクエストの処理（レスポンスボディの出力まで）が終わったハンドラオブジェクトをプールに戻す
+		（前のリクエストの状態は_clear()で解放してから戻す）
+
+		@param handler_instance: _acquire_handler()で取得したハンドラオブジェクト
+		"""
+		if not self.HANDLER_POOLING:
+			return
+
+		pool = self.__get_handler_pool(type(handler_instance))
+		if len(pool) < self.HANDLER_POOL_SIZE:
+			handler_instance._clear()
+			pool.append(handler_instance)
+
+
+	def __get_handler_pool(self, handler):
+		""" 現在のスレッドのハンドラプールを取得
+
+		@param handler: ハンドラクラス
+		@return: ハンドラオブジェクトのリスト
+		"""
+		pools = getattr(self.__handler_pools, "pools", None)
+		if pools == None:
+			pools = self.__handler_pools.pools = {}
+
+		pool = pools.get(handler)
+		if pool == None:
+			pool = pools[handler] = []
+
+		return pool
+
+
 	def get_root_dir(self):
 		""" アプリケーションのルートディレクトリを取得
 
@@ -49,20 +165,59 @@ class BaseApplication(object):
 		return self.__root_dir
 
 
+	def set_page_cache(self, cache):
+		""" ページキャッシュを設定
+		ハンドラのPAGE_CACHE_LIFETIMEを設定したページのレスポンスが保存される
+
+		@param cache: レスポンスを保存するキャッシュオブジェクト（brocadefw.db.kvs.Cache; Noneならページキャッシュを使わない）
+		"""
+		if cache != None:
+			cache = kvs.ExpiringCache(cache)
+
+		self.__page_cache = cache
+
+
+	def get_page_cache(self):
+		""" ページキャッシュを取得
+
+		@return: キャッシュオブジェクト（使わないならNone）
+		"""
+		return self.__page_cache
+
+
 	def _get_matched_data(self, uri):
 		""" URLにマッチしたハンドラとキャプチャパターンを取得
 
 		@param uri: リクエストされたURI（クエリストリングなし）
 		@return: ハンドラとキャプチャパターンのタプル
 		"""
-		for pattern_c, module_name, class_name in self.__maps_parsed:
-			m = pattern_c.match(uri)
-			if m != None:
-				# マッチしたら対応ハンドラ
-				return (self.__load_handler(module_name, class_name), m.groups(), m.groupdict())
+		matched = self.__router.match(uri)
+		if matched != None:
+			# マッチしたら対応ハンドラ
+			(index, groups, groupdict) = matched
+			return (self.__get_handler(index), groups, groupdict)
 
 		# マッチしなければデフォルトハンドラ
-		return (self.__load_handler(*self.__default_handler_info), (), {})
+		return (self.__get_handler(len(self.__handlers) - 1), (), {})
+
+
+	def __get_handler(self, index):
+		""" ハンドラクラスを取得（読み込んでいなければ読み込んで記憶しておく）
+
+		@param index: ハンドラのインデックス
+		@return: ハンドラクラス
+		"""
+		handler = self.__handlers[index]
+		if handler != None:
+			return handler
+
+		with self.__handlers_lock:
+			handler = self.__handlers[index]
+			if handler == None:
+				handler = self.__load_handler(*self.__handler_info[index])
+				self.__handlers[index] = handler
+
+			return handler
 
 
 	@staticmethod
@@ -87,69 +242,197 @@ class BaseHandler(object):
 	# テンプレートドライバ
 	TEMPLATE_DRIVER = "mako"
 
+	# HTMLテンプレートのミニファイ方法
+	# True: コンパイル時にテンプレートの静的な部分をミニファイする（リクエストごとのミニファイが不要になるが、変数の中身はミニファイされない）
+	# False: リクエストごとに出力結果全体をミニファイする
+	MINIFY_TEMPLATE_SOURCE = False
+
+	# ページキャッシュの有効期間[sec]（Noneならキャッシュしない）
+	PAGE_CACHE_LIFETIME = None
+
+	# レスポンスボディからETagを自動生成するか？（HEADをヘッダのみモードで処理するには、Falseにするかget_etag()を実装する）
+	AUTO_ETAG = True
+
+	# レスポンスの圧縮に使うContent-Encoding（優先順; 空なら圧縮しない; HEADをヘッダのみモードで処理するには空にする）
+	COMPRESSION_ENCODINGS = compress.ENCODINGS
+
+	# 圧縮するレスポンスの最小サイズ[byte]（小さいものは圧縮しても効果が薄い）
+	COMPRESSION_MIN_SIZE = 1024
+
+	# 圧縮レベル（1-9）
+	COMPRESSION_LEVEL = 6
+
+	# 圧縮するMIMEタイプ
+	COMPRESSION_TYPES = mimeutils.COMPRESSIBLE
+
+	# 静的ファイルのURLのプレフィックス（ベースパスからの相対パス）
+	STATIC_URL_PREFIX = "static/"
+
+	# ビルドされていない静的ファイルのキャッシュ有効期間[sec]（ビルド済みのものは無期限）
+	STATIC_MAX_AGE = 60 * 60
+
+	# リクエストボディの最大サイズ[byte]（超えたら413エラー）
+	MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+
+	# フォームデータのうちファイル以外の値の合計の最大サイズ[byte]（メモリに保持するので）
+	MAX_FORM_MEMORY_SIZE = 1024 * 1024
+
+	# フォームデータ・クエリ文字列の最大項目数（クエリ文字列は超えた分を無視する）
+	MAX_FORM_PARTS = 1000
+
+	# JSONのエンコーダ（独自の型を出力する場合はdefault()を実装したサブクラスを指定する）
+	JSON_ENCODER = json.JSONEncoder
+
+	# render_json()でこの要素数を超えるリスト（とイテレータ）は少しずつエンコードしながら出力する
+	JSON_STREAM_THRESHOLD = 1000
+
+	# ハンドラクラスごとのデバイス識別器
+	__device_matchers = {}
+
+	# ハンドラクラスごとのディスパッチテーブル
+	__dispatch_tables = {}
+
+	# エラーページのキャッシュを作り直す間隔[sec]（Noneならキャッシュしない）
+	ERROR_PAGE_CACHE_INTERVAL = 60
+
+	# エラーページのキャッシュ（ハンドラクラス・ステータス・テンプレート・文字セットごと）
+	__error_pages = kvs.LRUCache(256)
+
+	# リクエストごとの状態（インスタンス辞書を作らない; 派生クラスで独自の属性を持つ場合は派生クラスにも__slots__を定義すると省メモリ）
+	__slots__ = ("__cache", "__status", "__headers", "__root_dir", "__default_language", "__page_cache")
+
 	def __init__(self, root_dir, default_language = "ja"):
 		""" コンストラクタ
 
 		@param root_dir: アプリケーションのルートディレクトリ
 		@param default_language: デフォルト言語
 		"""
-		from wsgiref.headers import Headers
 		self.__cache = {}
-		self.__status = 200
-		self.__headers = Headers([])
 		self.__root_dir = root_dir
 		self.__default_language = default_language
+		self.__reset()
+
+
+	def _clear(self):
+		""" プールに戻す前に、リクエストごとの状態を解放して初期化（BaseApplication.HANDLER_POOLING用）
+		プール中に前のリクエストのセッション・アップロードファイル等を保持し続けないように、戻すときに解放する。
+		派生クラスで独自の属性を持つ場合は、オーバーライドして解放すること
+		"""
+		self.__cache.clear()
+		self.__reset()
+
+
+	def _reset(self):
+		""" プールから取り出したハンドラに、次のリクエストの情報を設定（BaseApplication.HANDLER_POOLING用）
+		引数はコンストラクタのルートディレクトリ以降と同じ（状態は_clear()で初期化済み）
+		"""
+		pass
+
+
+	def __reset(self):
+		""" リクエストごとの状態を初期化 """
+		from wsgiref.headers import Headers
+		self.__status = 200
+		self.__headers = Headers([])
+		self.__page_cache = None
 
 
 	def __call__(self, *args, **kwargs):
 		""" リクエスト処理部 """
-		result = self.__call(*args, **kwargs)
-		self.output_headers()
-		self.post_request()
-		return result
+		result = self._begin_request(*args, **kwargs)
+		if result == None:
+			result = self.__call(*args, **kwargs)
+			result = self._store_response(result)
+
+		return self._finish_request(result)
 
 
 	def __call(self, *args, **kwargs):
 		""" リクエスト処理部の本体 """
 		try:
-			request_method = self.get_request_method()
-			if request_method == "GET":
-				return self.on_get(*args, **kwargs)
+			return self._get_request_handler()(*args, **kwargs)
+
+		except ExitException as e:
+			return e.body()
 
-			if request_method == "POST":
-				return self.on_post(*args, **kwargs)
 
-			if request_method == "PUT":
-				return self.on_put(*args, **kwargs)
+	def _begin_request(self, *args, **kwargs):
+		""" リクエスト処理の前半（ページキャッシュ・条件付きGET）
 
-			if request_method == "PATCH":
-				return self.on_patch(*args, **kwargs)
+		@return: レスポンスボディ（on_xxxを呼ぶ必要がなければ; 呼ぶ必要があればNone）
+		"""
+		result = self.__page_cache_load()
+		if result == None:
+			result = self.__check_precondition(*args, **kwargs)
 
-			if request_method == "DELETE":
-				return self.on_delete(*args, **kwargs)
+		return result
 
-			if request_method == "HEAD":
-				return self.on_head(*args, **kwargs)
 
-			if request_method == "TRACE":
-				return self.on_trace(*args, **kwargs)
+	def _get_request_handler(self):
+		""" リクエストメソッドを処理するメソッドを取得
 
-			if request_method == "OPTIONS":
-				return self.on_options(*args, **kwargs)
+		@return: on_xxx（リクエストメソッドに対応していなければ405エラーを表示するメソッド）
+		"""
+		(table, allow) = self.__get_dispatch_table()
+		name = table.get(self.get_request_method())
+		if name == None:
+			return self.__error405
 
-			if request_method == "CONNECT":
-				return self.on_connect(*args, **kwargs)
+		return getattr(self, name)
 
-			if request_method == "LINK":
-				return self.on_link(*args, **kwargs)
 
-			if request_method == "UNLINK":
-				return self.on_unlink(*args, **kwargs)
+	def _store_response(self, body):
+		""" on_xxxが返したレスポンスを保存（ETagの生成・ページキャッシュへの保存）
 
-			return self.__error405()
+		@param body: レスポンスボディ
+		@return: レスポンスボディ
+		"""
+		self.__set_etag(body)
+		self.__page_cache_save(body)
+		return body
 
-		except ExitException as e:
-			return e.body()
+
+	def _finish_request(self, body):
+		""" リクエスト処理の後半（304・圧縮・ヘッダ出力）
+
+		@param body: レスポンスボディ
+		@return: 最終的なレスポンスボディ
+		"""
+		body = self.__not_modified(body)
+		body = self.__compress(body)
+		if self.get_request_method() == "HEAD":
+			# HEADにボディは不要
+			body = self.__strip_body(body)
+
+		self.output_headers()
+		self.post_request()
+		return body
+
+
+	def __get_dispatch_table(self):
+		""" ハンドラクラスごとのディスパッチテーブルを取得（初回はサブクラスで実装されたon_xxxから作成）
+
+		@return: (リクエストメソッド→メソッド名, Allowヘッダの値)
+		"""
+		tables = BaseHandler.__dispatch_tables
+		cls = type(self)
+		if not cls in tables:
+			table = {}
+			for method in _METHODS:
+				name = "on_" + method.lower()
+				if _get_function(getattr(cls, name)) != _get_function(getattr(BaseHandler, name)):
+					table[method] = name
+
+			# HEADはGETで、OPTIONSはテーブルから自動的に処理できる
+			if "GET" in table and not "HEAD" in table:
+				table["HEAD"] = "on_head"
+			if not "OPTIONS" in table:
+				table["OPTIONS"] = "on_options"
+
+			allow = ", ".join(method for method in _METHODS if method in table)
+			tables[cls] = (table, allow)
+
+		return tables[cls]
 
 
 	def post_request(self):
@@ -157,6 +440,338 @@ class BaseHandler(object):
 		self.__session_save()
 
 
+	def use_page_cache(self, cache):
+		""" ページキャッシュを使う（アプリケーションから呼び出される）
+
+		@param cache: レスポンスを保存するキャッシュオブジェクト（Noneならページキャッシュを使わない）
+		"""
+		self.__page_cache = cache
+
+
+	def disable_page_cache(self):
+		""" このリクエストのレスポンスをページキャッシュに保存しない """
+		self.__cache["page_cache_disabled"] = True
+
+
+	def get_page_cache_key(self):
+		""" ページキャッシュのキーを取得
+		生のリクエストヘッダではなく、ネゴシエーション結果（言語一覧・デバイス・文字セット）をキーに含める
+
+		@return: キー
+		"""
+		from hashlib import md5
+		data = (self.get_env("PATH_INFO"), self.get_env("QUERY_STRING")) + self.__get_variant()
+		return "page:" + md5(repr(data).encode("utf-8")).hexdigest()
+
+
+	def __page_cache_load(self):
+		""" ページキャッシュからレスポンスを復元
+
+		@return: レスポンスボディ（キャッシュを使わない or 保存されていなければNone）
+		"""
+		if self.__page_cache == None or self.PAGE_CACHE_LIFETIME == None:
+			return None
+
+		if not self.get_request_method() in ("GET", "HEAD"):
+			return None
+
+		key = self.get_page_cache_key()
+		self.__cache["page_cache_key"] = key
+
+		entry = self.__page_cache.get(key)
+		if entry == None:
+			return None
+
+		from wsgiref.headers import Headers
+		(status, headers, body, variants) = entry
+		self.__status = status
+		self.__headers = Headers(list(headers))
+		self.__cache["page_cache_variants"] = variants
+		return body
+
+
+	def __uses_user_state(self):
+		""" Cookie・セッションを使った（＝ユーザごとに内容が異なる）か？
+
+		@return: Yes/No
+		"""
+		cache = self.__cache
+		return "cookie" in cache or "session" in cache
+
+
+	def __page_cache_save(self, body):
+		""" レスポンスをページキャッシュに保存
+
+		@param body: レスポンスボディ
+		"""
+		key = "page_cache_key"
+		if not key in self.__cache:
+			return
+
+		cache = self.__cache
+		if "page_cache_disabled" in cache or self.get_request_method() != "GET":
+			return
+
+		# Cookie・セッションを使った（＝ユーザごとに内容が異なる）ページは保存しない
+		if self.__uses_user_state():
+			return
+
+		if self.__status != 200 or not strutils.is_bytes(body):
+			return
+
+		# 圧縮結果も一緒に保存しておき、キャッシュから返すときは圧縮し直さない
+		variants = {}
+		if self.__is_compressible(body):
+			for encoding in self.COMPRESSION_ENCODINGS:
+				variants[encoding] = compress.compress(body, encoding, self.COMPRESSION_LEVEL)
+
+		entry = (self.__status, self.__headers.items(), body, variants)
+		self.__page_cache.set(cache[key], entry, self.PAGE_CACHE_LIFETIME)
+
+
+	def __strip_body(self, body):
+		""" HEAD用にレスポンスボディを取り除く
+		（GETと同じヘッダにするため、Content-Lengthはハンドラが設定したもの以外は追加しない）
+
+		@param body: レスポンスボディ
+		@return: 空のレスポンスボディ
+		"""
+		if not strutils.is_bytes(body) and hasattr(body, "close"):
+			# 読み込み途中のファイル等を閉じる
+			body.close()
+
+		return b""
+
+
+	def is_headers_only(self):
+		""" ヘッダのみモード（HEADリクエストをon_getで処理中）か？
+		Trueの場合、レスポンスボディは捨てられるので生成を省略してよい（テンプレートは自動的にレンダリングを省略する）
+
+		HEADのヘッダはGETと同じでなければならないので、ボディから決まるヘッダがある場合はヘッダのみモードにならず、
+		on_getで普通にレンダリングしてからボディを捨てる。ヘッダのみモードになるのは、以下を両方満たすハンドラだけ:
+		- AUTO_ETAG = False、またはget_etag()でETagを返す（ボディからETagを生成しない）
+		- COMPRESSION_ENCODINGS = ()（ボディのサイズで圧縮・Vary: Accept-Encodingが決まらない）
+		なお、ページキャッシュ（PAGE_CACHE_LIFETIME）にあるページのHEADは、どちらの場合もキャッシュから返す
+
+		@return: Yes/No
+		"""
+		return "headers_only" in self.__cache
+
+
+	def __needs_body_for_headers(self):
+		""" GETと同じヘッダを出力するのにレスポンスボディが必要か？
+
+		@return: Yes/No
+		"""
+		# ETagが条件付きGETで設定済みでなければ、ボディから生成する
+		if self.AUTO_ETAG and not "ETag" in self.__headers:
+			return True
+
+		# 圧縮するかどうか（とVary・Content-Encoding・Content-Length）はボディのサイズで決まる
+		if len(self.COMPRESSION_ENCODINGS) > 0:
+			return True
+
+		return False
+
+
+	def get_etag(self, *args, **kwargs):
+		""" on_getを呼び出す前にETagを取得
+		（内容を安く判定できるならオーバーライドして、リソースのバージョン等を返すこと; 一致すればon_getは呼び出されない）
+
+		@param args: on_getと同じ引数
+		@param kwargs: on_getと同じ引数
+		@return: ETagの元になる値（文字列; 言語・デバイス・文字セットは自動的に加味される）; 使わないならNone
+		"""
+		return None
+
+
+	def get_last_modified(self, *args, **kwargs):
+		""" on_getを呼び出す前に最終更新日時を取得
+		（オーバーライドして最終更新日時を返せば、If-Modified-Sinceが一致した場合にon_getは呼び出されない）
+
+		@param args: on_getと同じ引数
+		@param kwargs: on_getと同じ引数
+		@return: 最終更新日時（Unixタイムスタンプ）; 使わないならNone
+		"""
+		return None
+
+
+	def __check_precondition(self, *args, **kwargs):
+		""" on_getを呼び出す前に条件付きGETを判定
+
+		@return: クライアントのキャッシュが有効ならレスポンスボディ（304）、そうでなければNone
+		"""
+		if not self.get_request_method() in ("GET", "HEAD"):
+			return None
+
+		etag = self.get_etag(*args, **kwargs)
+		if etag != None:
+			# テンプレートと同じくネゴシエーション結果によって内容が変わる
+			self.add_vary("Accept-Language")
+			self.add_vary("User-Agent")
+
+			from hashlib import md5
+			data = (etag, self.__get_variant())
+			etag = 'W/"{hash}"'.format(hash = md5(repr(data).encode("utf-8")).hexdigest()[:16])
+			self.add_header("ETag", etag)
+
+		last_modified = self.get_last_modified(*args, **kwargs)
+		if last_modified != None:
+			self.add_header("Last-Modified", timeutils.format_http_date(last_modified))
+
+		if etag == None and last_modified == None:
+			return None
+
+		if not self.__is_not_modified():
+			return None
+
+		return self.__response_not_modified()
+
+
+	def __set_etag(self, body):
+		""" レスポンスボディからETagを生成
+
+		@param body: レスポンスボディ
+		"""
+		if not self.AUTO_ETAG or self.__status != 200 or not strutils.is_bytes(body):
+			return
+
+		if self.is_headers_only():
+			# ボディを生成していない
+			return
+
+		if not self.get_request_method() in ("GET", "HEAD"):
+			return
+
+		headers = self.__headers
+		if "ETag" in headers:
+			return
+
+		# Cookie・セッションを使ったページはユーザごとに内容が異なるのでプライベートなキャッシュだけになるが、ETag自体は有効
+		headers.add_header("ETag", httputils.make_etag(body))
+
+
+	def __not_modified(self, body):
+		""" クライアントのキャッシュが有効なら304にする
+
+		@param body: レスポンスボディ
+		@return: レスポンスボディ
+		"""
+		if self.__status != 200 or not self.get_request_method() in ("GET", "HEAD"):
+			return body
+
+		if not self.__is_not_modified():
+			return body
+
+		return self.__response_not_modified()
+
+
+	def __is_not_modified(self):
+		""" クライアントのキャッシュ（If-None-Match / If-Modified-Since）が有効か？
+
+		@return: Yes/No
+		"""
+		headers = self.__headers
+		if_none_match = self.get_env("HTTP_IF_NONE_MATCH")
+		if len(if_none_match) > 0:
+			# If-None-Matchがあれば、If-Modified-Sinceは無視する
+			etag = headers.get("ETag")
+			return etag != None and httputils.match_etag(if_none_match, etag)
+
+		if_modified_since = self.get_env("HTTP_IF_MODIFIED_SINCE")
+		last_modified = headers.get("Last-Modified")
+		if len(if_modified_since) == 0 or last_modified == None:
+			return False
+
+		since = timeutils.parse_http_date(if_modified_since)
+		modified = timeutils.parse_http_date(last_modified)
+		return since != None and modified != None and modified <= since
+
+
+	def __response_not_modified(self):
+		""" 304レスポンスを設定
+
+		@return: レスポンスボディ（空）
+		"""
+		self.__status = 304
+
+		# 304には本文に関するヘッダは不要
+		headers = self.__headers
+		for name in ("Content-Type", "Content-Length", "Content-Encoding"):
+			del headers[name]
+
+		return b""
+
+
+	def __get_variant(self):
+		""" ネゴシエーション結果（言語一覧・デバイス・文字セット）を取得
+
+		@return: ネゴシエーション結果
+		"""
+		return (tuple(self.get_template_languages()), self.get_device(), self.charset())
+
+
+	def __compress(self, body):
+		""" クライアントが対応していればレスポンスボディを圧縮
+
+		@param body: レスポンスボディ（バイト列 or バイト列のイテレータ）
+		@return: 圧縮後のレスポンスボディ
+		"""
+		if not self.__is_compressible(body):
+			return body
+
+		self.add_vary("Accept-Encoding")
+		headers = self.__headers
+		encoding = httputils.select_encoding(self.parse_accept_quality("Encoding"), self.COMPRESSION_ENCODINGS)
+		if encoding == None:
+			return body
+
+		headers.add_header("Content-Encoding", encoding)
+		if not strutils.is_bytes(body):
+			# イテレータならストリーミング圧縮（長さは分からない）
+			del headers["Content-Length"]
+			return compress.compress_chunks(body, encoding, self.COMPRESSION_LEVEL)
+
+		variants = self.__cache.get("page_cache_variants")
+		if variants != None and encoding in variants:
+			body = variants[encoding]
+		else:
+			body = compress.compress(body, encoding, self.COMPRESSION_LEVEL)
+
+		if "Content-Length" in headers:
+			headers.replace_header("Content-Length", str(len(body)))
+
+		return body
+
+
+	def __is_compressible(self, body):
+		""" レスポンスボディを圧縮すべきか？
+
+		@param body: レスポンスボディ
+		@return: Yes/No
+		"""
+		if len(self.COMPRESSION_ENCODINGS) == 0:
+			return False
+
+		# 中身のないステータスや、圧縮済み（事前圧縮された静的ファイル等）のものは圧縮しない
+		status = self.__status
+		if status < 200 or status in (204, 304):
+			return False
+
+		headers = self.__headers
+		if "Content-Encoding" in headers:
+			return False
+
+		content_type = headers.get("Content-Type")
+		if content_type == None or not mimeutils.is_compressible(content_type, self.COMPRESSION_TYPES):
+			return False
+
+		if strutils.is_bytes(body) and len(body) < self.COMPRESSION_MIN_SIZE:
+			return False
+
+		return True
+
+
 	########################################
 	# ハンドラ
 	def on_get(self, *args, **kwargs):
@@ -175,13 +790,21 @@ class BaseHandler(object):
 		return self.__error405()
 
 	def on_head(self, *args, **kwargs):
-		return self.__error405()
+		# on_getを呼び出す（ボディがなくてもGETと同じヘッダを出力できるなら、ヘッダのみモードで）
+		if not self.__needs_body_for_headers():
+			self.__cache["headers_only"] = True
+
+		return self.on_get(*args, **kwargs)
 
 	def on_trace(self, *args, **kwargs):
 		return self.__error405()
 
 	def on_options(self, *args, **kwargs):
-		return self.__error405()
+		# 使用可能なメソッドを返す
+		(table, allow) = self.__get_dispatch_table()
+		self.add_header("Allow", allow)
+		self.add_header("Content-Length", "0")
+		return b""
 
 	def on_connect(self, *args, **kwargs):
 		return self.__error405()
@@ -197,12 +820,86 @@ class BaseHandler(object):
 	# 必須実装
 	def _param_get(self):
 		""" GETパラメータを取得 """
-		raise NotImplementedError("BaseHandler::_param_get")
+		return QueryParameters(self.get_env("QUERY_STRING"), self.MAX_FORM_PARTS)
 
 	def _param_post(self):
 		""" POSTパラメータを取得 """
 		raise NotImplementedError("BaseHandler::_param_post")
 
+	def _param_json(self):
+		""" リクエストボディのJSONを取得 """
+		raise NotImplementedError("BaseHandler::_param_json")
+
+	def _parse_form(self, fp, terminated = False):
+		""" リクエストボディのフォームデータを解析（サイズ・項目数が上限を超えたら413エラー）
+
+		@param fp: 入力ストリーム
+		@param terminated: Content-Lengthがない場合に終端まで読み込んでよければTrue
+		@return: パラメータオブジェクト
+		"""
+		try:
+			form = formparser.parse(fp, self.get_env("CONTENT_TYPE"), self.__get_content_length(terminated), self.MAX_CONTENT_LENGTH, self.MAX_FORM_MEMORY_SIZE, self.MAX_FORM_PARTS, self.create_upload_file)
+
+		except formparser.LimitExceeded:
+			raise StatusException(413, self)
+
+		return FormParameters(form)
+
+
+	def _parse_json(self, fp, terminated = False):
+		""" リクエストボディのJSONを解析（サイズが上限を超えたら413エラー、不正なJSONなら400エラー）
+
+		@param fp: 入力ストリーム
+		@param terminated: Content-Lengthがない場合に終端まで読み込んでよければTrue
+		@return: デコード結果（ボディが空ならNone）
+		"""
+		try:
+			body = formparser.read_body(fp, self.__get_content_length(terminated), self.MAX_CONTENT_LENGTH)
+
+		except formparser.LimitExceeded:
+			raise StatusException(413, self)
+
+		if len(body) == 0:
+			return None
+
+		(mime_type, params) = formparser.parse_header(self.get_env("CONTENT_TYPE"))
+		try:
+			return json.loads(body.decode(params.get("charset", "utf-8")))
+
+		except (ValueError, LookupError):
+			raise StatusException(400, self)
+
+
+	def __get_content_length(self, terminated):
+		""" リクエストボディのサイズを取得
+
+		@param terminated: Content-Lengthがない場合に終端まで読み込んでよければTrue
+		@return: サイズ（終端まで読み込む場合はNone）
+		"""
+		try:
+			return int(self.get_env("CONTENT_LENGTH"))
+
+		except ValueError:
+			if terminated:
+				return None
+
+			# 長さが分からなければ読み込まない（ブロックするかもしれない）
+			return 0
+
+
+	def create_upload_file(self, name, filename, content_type):
+		""" アップロードファイルの書き込み先を作成
+		一時ファイル以外に書き込む（ストレージに直接転送する等）場合はオーバーライドする
+
+		@param name: パラメータ名
+		@param filename: クライアントから送られてきたファイル名
+		@param content_type: Content-Type
+		@return: 書き込み可能なファイルオブジェクト
+		"""
+		from tempfile import TemporaryFile
+		return TemporaryFile()
+
+
 	def get_env(self, name, default = ""):
 		""" 環境変数を取得
 
@@ -243,6 +940,18 @@ class BaseHandler(object):
 		return self.__cache[key]
 
 
+	def param_json(self):
+		""" リクエストボディのJSONを取得（param_post()と同時には使えない）
+
+		@return: デコード結果（ボディが空ならNone）
+		"""
+		key = "param_json"
+		if not key in self.__cache:
+			self.__cache[key] = self._param_json()
+
+		return self.__cache[key]
+
+
 	########################################
 	# 状態管理
 	def cookie(self):
@@ -309,6 +1018,15 @@ class BaseHandler(object):
 		return session.Storage()
 
 
+	def fragment_cache(self):
+		""" テンプレートのフラグメントキャッシュ用のキャッシュオブジェクトを取得
+		（フラグメントキャッシュを使うならオーバーライドして適切なキャッシュを返すこと）
+
+		@return: キャッシュオブジェクト（brocadefw.db.kvs.Cache; 使わないならNone）
+		"""
+		return None
+
+
 	def __session_save(self):
 		""" セッション状態を保存 """
 		key = "session"
@@ -492,6 +1210,31 @@ class BaseHandler(object):
 
 	########################################
 	# 解析
+	def get_device(self):
+		""" UAからデバイス名を取得
+
+		@return: デバイス名（識別できなければNone）
+		"""
+		key = "device"
+		if not key in self.__cache:
+			self.__cache[key] = self.__get_device_matcher().parse(self.get_user_agent())
+
+		return self.__cache[key]
+
+
+	def __get_device_matcher(self):
+		""" ハンドラクラスごとのデバイス識別器を取得（初回はget_device_infoからコンパイル）
+
+		@return: デバイス識別器
+		"""
+		matchers = BaseHandler.__device_matchers
+		cls = type(self)
+		if not cls in matchers:
+			matchers[cls] = httputils.DeviceMatcher(self.get_device_info())
+
+		return matchers[cls]
+
+
 	def get_device_info(self):
 		""" UAのデバイス情報を取得 """
 		return (
@@ -515,6 +1258,20 @@ class BaseHandler(object):
 		return self.__cache[key]
 
 
+	def parse_accept_quality(self, name):
+		""" Accept-XXXをq値つきで解析
+
+		@param name: XXXの部分
+		@return: (値（小文字）, q値)のリスト（該当ヘッダがなければNone）
+		"""
+		key = "parse_accept_quality:" + name
+		if not key in self.__cache:
+			accept = self.get_env("HTTP_ACCEPT_" + name.upper())
+			self.__cache[key] = httputils.parse_accept_quality(accept) if len(accept) > 0 else None
+
+		return self.__cache[key]
+
+
 	def charset(self, preferred = "utf-8"):
 		""" Accept-Charsetリクエストヘッダを解析して最適な出力文字セットを取得
 
@@ -564,6 +1321,15 @@ class BaseHandler(object):
 		self.__headers.add_header(name, value, **params)
 
 
+	def add_vary(self, name):
+		""" Varyヘッダを追加（追加済みなら何もしない）
+
+		@param name: リクエストヘッダ名
+		"""
+		if not name in self.__headers.get_all("Vary"):
+			self.__headers.add_header("Vary", name)
+
+
 	def set_content_type(self, content_type):
 		""" Content-Typeヘッダを設定
 
@@ -620,18 +1386,19 @@ class BaseHandler(object):
 
 	########################################
 	# テンプレート
-	def create_template(self, template_type, encoding_input = "utf-8", encoding_output = "utf-8", encoding_error = "replace", filter_output = None, params = {}):
+	def create_template(self, template_type, encoding_input = "utf-8", encoding_output = "utf-8", encoding_error = "replace", filter_output = None, params = {}, filter_source = None):
 		""" テンプレートオブジェクト作成
-		コンパイル結果の保存先ディレクトリを指定する場合はこのメソッドをオーバーライドすること。
+		コンパイル結果の保存先ディレクトリを変更する場合はget_template_compiledirをオーバーライドすること。
 
 		@param template_type: テンプレートタイプ
 		@param encoding_input: 入力エンコーディング
 		@param encoding_output: 出力エンコーディング
 		@param filter_output: 出力結果に適用するフィルタ
 		@param params: テンプレートライブラリに渡すパラメータ
+		@param filter_source: コンパイル時にテンプレートの静的な部分に適用するフィルタ
 		@return: テンプレートオブジェクト
 		"""
-		return self._create_template(template_type, None, encoding_input, encoding_output, encoding_error, filter_output, params)
+		return self._create_template(template_type, self.get_template_compiledir(), encoding_input, encoding_output, encoding_error, filter_output, params, filter_source)
 
 
 	def create_template_html(self, status = 200, params = {}):
@@ -642,7 +1409,10 @@ class BaseHandler(object):
 		@return: テンプレートオブジェクト
 		"""
 		charset = self.charset()
-		template = self.create_template("html", encoding_output = charset, encoding_error = "xmlcharrefreplace", filter_output = minify.html, params = params)
+		if self.MINIFY_TEMPLATE_SOURCE:
+			template = self.create_template("html", encoding_output = charset, encoding_error = "xmlcharrefreplace", params = params, filter_source = minify.html)
+		else:
+			template = self.create_template("html", encoding_output = charset, encoding_error = "xmlcharrefreplace", filter_output = minify.html, params = params)
 		template.set_vars(charset = charset)
 
 		# ヘッダを設定
@@ -651,7 +1421,7 @@ class BaseHandler(object):
 		return template
 
 
-	def _create_template(self, template_type, compile_dir = None, encoding_input = "utf-8", encoding_output = "utf-8", encoding_error = "replace", filter_output = None, params = {}):
+	def _create_template(self, template_type, compile_dir = None, encoding_input = "utf-8", encoding_output = "utf-8", encoding_error = "replace", filter_output = None, params = {}, filter_source = None):
 		""" テンプレートオブジェクト作成の本体
 
 		@param template_type: テンプレートタイプ
@@ -660,24 +1430,45 @@ class BaseHandler(object):
 		@param encoding_output: 出力エンコーディング
 		@param filter_output: 出力結果に適用するフィルタ
 		@param params: テンプレートライブラリに渡すパラメータ
+		@param filter_source: コンパイル時にテンプレートの静的な部分に適用するフィルタ
 		@return: テンプレートオブジェクト
 		"""
+		(base_dir, searchpath, languages, device) = self.__get_searchpath(template_type)
+		index = templateindex.get_index(base_dir)
+		template_ = template.factory(self.TEMPLATE_DRIVER, searchpath, compile_dir, encoding_input, encoding_output, encoding_error, filter_output, params, index, filter_source)
+		template_.set_vars(static = self.static_url)
+		if self.is_headers_only():
+			template_.set_headers_only()
+
+		# フラグメントキャッシュは言語・デバイス・文字セットごとに分ける
+		fragment_cache = self.fragment_cache()
+		if fragment_cache != None:
+			template_.set_fragment_cache(fragment_cache, (tuple(languages), device, encoding_output))
+
+		return template_
+
+
+	def __get_searchpath(self, template_type):
+		""" テンプレートの検索パスを取得
+
+		@param template_type: テンプレートタイプ
+		@return: (ベースディレクトリ, 検索パスのリスト, 言語一覧, デバイス)
+		"""
 		base_dir = self.get_template_basedir()
 
 		# 言語一覧
-		self.add_header("Vary", "Accept-Language")
+		self.add_vary("Accept-Language")
 		languages = self.get_template_languages()
 
 		# デバイス一覧
-		self.add_header("Vary", "User-Agent")
+		self.add_vary("User-Agent")
 		devices = ["default"]
-		user_agent = httputils.UserAgent(self.get_user_agent())
-		device = user_agent.parse_device(self.get_device_info())
+		device = self.get_device()
 		if device != None:
 			devices.insert(0, device)
 
 		searchpath = template.get_searchpath_list(base_dir, languages, template_type, devices)
-		return template.factory(self.TEMPLATE_DRIVER, searchpath, compile_dir, encoding_input, encoding_output, encoding_error, filter_output, params)
+		return (base_dir, searchpath, languages, device)
 
 
 	def get_template_basedir(self):
@@ -689,6 +1480,15 @@ class BaseHandler(object):
 		return path.join(self.get_root_dir(), "templates")
 
 
+	def get_template_compiledir(self):
+		""" テンプレートのコンパイル結果の保存先ディレクトリを取得
+		（デフォルトはプロジェクトの "tmp/templates/[ドライバ名]"）
+
+		@return: 保存先ディレクトリ（保存しない場合はNone）
+		"""
+		return template.get_compile_dir(self.get_root_dir(), self.TEMPLATE_DRIVER)
+
+
 	def get_template_languages(self):
 		""" テンプレート対応言語一覧を取得
 
@@ -698,27 +1498,201 @@ class BaseHandler(object):
 		if languages == None:
 			languages = []
 
+		# 解析結果はキャッシュされているのでコピーしてから追加
+		languages = list(languages)
 		languages.append(self.__default_language)
 		return languages
 
 
+	########################################
+	# 静的ファイル
+	def static_url(self, name):
+		""" 静的ファイルのURLを取得（テンプレートからは static("css/style.css") の形式で使える）
+		ビルド済みならハッシュ値つきのファイル名に変換する
+
+		@param name: ファイル名（静的ファイルのディレクトリからの相対パス）
+		@return: URL
+		"""
+		manifest = assets.get_manifest(self.get_static_builddir())
+		return self.get_basepath() + self.STATIC_URL_PREFIX + manifest.url(name)
+
+
+	def render_static(self, name):
+		""" 静的ファイルを出力
+		ビルド済みのファイルは無期限にキャッシュさせ、クライアントが対応していれば事前圧縮版を出力する
+
+		@param name: ファイル名（STATIC_URL_PREFIX以降のパス）
+		@return: レスポンスボディ
+		"""
+		import mimetypes
+		resolved = assets.get_manifest(self.get_static_builddir()).resolve(name)
+		if resolved != None:
+			(filename, size, variants) = resolved
+			cache_control = "public, max-age=31536000, immutable"
+
+		else:
+			# ビルドされていなければ元のファイル
+			filename = self.__get_static_source(name)
+			if filename == None:
+				return self.status_error(404)
+
+			from os.path import getsize
+			size = getsize(filename)
+			variants = []
+			cache_control = "public, max-age={max_age}".format(max_age = self.STATIC_MAX_AGE)
+
+		(content_type, encoding) = mimetypes.guess_type(filename)
+		if content_type == None:
+			content_type = "application/octet-stream"
+
+		self.set_content_type(content_type)
+		self.add_header("Cache-Control", cache_control)
+		if len(variants) > 0:
+			self.add_vary("Accept-Encoding")
+			content_encoding = httputils.select_encoding(self.parse_accept_quality("Encoding"), [encoding for (encoding, variant) in variants])
+			variants = dict(variants)
+			if content_encoding != None:
+				self.add_header("Content-Encoding", content_encoding)
+				filename = variants[content_encoding]
+				from os.path import getsize
+				size = getsize(filename)
+
+		self.add_header("Content-Length", str(size))
+		return _read_file(filename)
+
+
+	def get_static_dir(self):
+		""" 静的ファイルのディレクトリを取得
+
+		@return: ディレクトリ
+		"""
+		from os import path
+		return path.join(self.get_root_dir(), "static")
+
+
+	def get_static_builddir(self):
+		""" 静的ファイルのビルド結果のディレクトリを取得
+		（デフォルトはプロジェクトの "tmp/static"）
+
+		@return: ディレクトリ
+		"""
+		return assets.get_output_dir(self.get_root_dir())
+
+
+	def __get_static_source(self, name):
+		""" ビルドされていない静的ファイルのパスを取得
+
+		@param name: ファイル名
+		@return: ファイルパス（静的ファイルのディレクトリ外を指している or 存在しなければNone）
+		"""
+		from os import path
+		static_dir = path.abspath(self.get_static_dir())
+		filename = path.abspath(path.join(static_dir, name))
+		if not filename.startswith(static_dir + path.sep) or not path.isfile(filename):
+			return None
+
+		return filename
+
+
+	def render_json(self, obj, status = 200):
+		""" JSONを出力（テンプレートを使わないので、言語・デバイスによる切り替えもしない）
+		要素数がJSON_STREAM_THRESHOLDを超えるリスト・タプルと、イテレータ（ジェネレータ）は少しずつエンコードしながら出力する
+
+		@param obj: 出力するオブジェクト
+		@param status: ステータスコード
+		@return: レスポンスボディ
+		"""
+		self.set_status(status)
+		self.set_content_type(mimeutils.JSON)
+		encoder = self.JSON_ENCODER(ensure_ascii = False, separators = (",", ":"))
+		if _is_json_stream(obj, self.JSON_STREAM_THRESHOLD):
+			return _encode_json_stream(encoder, obj)
+
+		return encoder.encode(obj).encode("utf-8")
+
+
 	def status_error(self, status):
 		""" HTTPステータスエラー表示
+		表示結果はキャッシュしておき、ERROR_PAGE_CACHE_INTERVALごとに作り直す
 
 		@param status: ステータスコード
 		"""
+		key = self.__get_error_page_key(status)
+		if key != None:
+			body = self.__error_page_load(key)
+			if body != None:
+				return body
+
+		count = len(self.__headers)
 		template = self.create_template_html(status)
 		template.set_vars(
 			status_code = status,
 			status_name = httputils.get_status_value(status),
 		)
 		filename = "@http_status/{status}.html".format(status = status)
-		return template.render(filename)
+		body = template.render(filename)
+		if key != None and not self.is_headers_only() and strutils.is_bytes(body) and not self.__uses_user_state():
+			# テンプレートが追加したヘッダも一緒に保存（Cookie・セッションを使った場合はユーザごとに内容が異なるので保存しない）
+			expires = timeutils.unixtime(True) + self.ERROR_PAGE_CACHE_INTERVAL
+			BaseHandler.__error_pages.set(key, (expires, status, self.__headers.items()[count:], body))
+
+		return body
+
+
+	def __get_error_page_key(self, status):
+		""" エラーページのキャッシュキーを取得
+		エラーページのテンプレートが共通でも、継承元（@base.html等）は言語・デバイスごとに違う場合があるので、
+		検索パス全体（言語一覧・デバイス）ごとにキャッシュする
+		テンプレートの索引・静的ファイルのマニフェストが更新されたら（static_url()の結果が変わるので）別のキーになる
+
+		@param status: ステータスコード
+		@return: キャッシュキー（キャッシュしないならNone）
+		"""
+		if self.ERROR_PAGE_CACHE_INTERVAL == None:
+			return None
+
+		(base_dir, searchpath, languages, device) = self.__get_searchpath("html")
+		index = templateindex.get_index(base_dir)
+		manifest = assets.get_manifest(self.get_static_builddir())
+		return (type(self), status, tuple(searchpath), self.charset(), self.get_basepath(), index.generation(), manifest.generation())
+
+
+	def __error_page_load(self, key):
+		""" キャッシュからエラーページを取得
+
+		@param key: キャッシュキー
+		@return: レスポンスボディ（キャッシュされていない or 作り直す場合はNone）
+		"""
+		error_pages = BaseHandler.__error_pages
+		entry = error_pages.get(key)
+		if entry == None:
+			return None
+
+		(expires, status, headers, body) = entry
+		now = timeutils.unixtime(True)
+		if now >= expires:
+			# 期限切れなら先に期限を延ばしてから作り直す（作り直している間、他のリクエストには古い内容を返す）
+			error_pages.set(key, (now + self.ERROR_PAGE_CACHE_INTERVAL, status, headers, body))
+			return None
+
+		self.set_status(status)
+		for (name, value) in headers:
+			if name == "Vary":
+				self.add_vary(value)
+			else:
+				self.add_header(name, value)
+
+		return body
 
 
 	def __error405(self):
-		""" 405エラーを表示 """
-		return self.status_error(405)
+		""" 405エラーを表示（リクエストメソッドを手当たり次第に試すスキャナも多いので、テンプレートは使わずに固定の内容を返す） """
+		(table, allow) = self.__get_dispatch_table()
+		self.set_status(405)
+		self.add_header("Allow", allow)
+		self.add_header("Content-Type", mimeutils.TEXT)
+		self.add_header("Content-Length", str(len(_ERROR405_BODY)))
+		return _ERROR405_BODY
 
 
 	########################################
@@ -745,7 +1719,7 @@ class BaseHandler(object):
 		@param preferred: デフォルトの文字セット
 		@return: 出力文字セット
 		"""
-		self.add_header("Vary", "Accept-Charset")
+		self.add_vary("Accept-Charset")
 		parse_result = self.parse_accept("Charset")
 		if parse_result == None:
 			# リクエストヘッダがない＝全ての文字コードを受け入れる＝デフォルトの文字コードを使用する
@@ -767,6 +1741,85 @@ class BaseHandler(object):
 		return charset
 
 
+# リクエストメソッド一覧（Allowヘッダの順）
+_METHODS = ("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "TRACE", "CONNECT", "LINK", "UNLINK")
+
+# 405エラーのレスポンスボディ
+_ERROR405_BODY = b"405 Method Not Allowed\n"
+
+def _get_function(method):
+	""" メソッドの実体の関数を取得（Python2の非束縛メソッド対策）
+
+	@param method: メソッド
+	@return: 関数
+	"""
+	return getattr(method, "__func__", method)
+
+
+def _is_json_stream(obj, threshold):
+	""" 少しずつエンコードしながら出力するか？
+
+	@param obj: 出力するオブジェクト
+	@param threshold: リスト・タプルの要素数の閾値
+	@return: Yes/No
+	"""
+	if isinstance(obj, (list, tuple)):
+		return len(obj) > threshold
+
+	# イテレータ（iter()が自分自身を返す）
+	return hasattr(obj, "__iter__") and not isinstance(obj, (dict, str, bytes)) and iter(obj) is obj
+
+
+def _encode_json_stream(encoder, items, chunk_size = 64 * 1024):
+	""" 配列を要素ごとにエンコードしながら出力
+
+	@param encoder: JSONエンコーダ
+	@param items: 要素のイテラブル
+	@param chunk_size: 出力する単位[文字]
+	@return: エンコード結果（バイト列）のジェネレータ
+	"""
+	encode = encoder.encode
+	chunk = ["["]
+	size = 1
+	separator = ""
+	for item in items:
+		data = separator + encode(item)
+		separator = ","
+		chunk.append(data)
+		size += len(data)
+		if size >= chunk_size:
+			yield "".join(chunk).encode("utf-8")
+			chunk = []
+			size = 0
+
+	chunk.append("]")
+	yield "".join(chunk).encode("utf-8")
+
+
+def _read_file(filename, chunk_size = 64 * 1024):
+	""" ファイルを読み込む（大きいファイルは少しずつ読み込むイテレータを返す）
+
+	@param filename: ファイル名
+	@param chunk_size: 一度に読み込むサイズ
+	@return: 内容（バイト列 or バイト列のイテレータ）
+	"""
+	from os.path import getsize
+	if getsize(filename) <= chunk_size:
+		with open(filename, "rb") as f:
+			return f.read()
+
+	def _chunks():
+		with open(filename, "rb") as f:
+			while True:
+				chunk = f.read(chunk_size)
+				if len(chunk) == 0:
+					break
+
+				yield chunk
+
+	return _chunks()
+
+
 class BaseParameters(object):
 	""" パラメータ処理クラス """
 
@@ -807,6 +1860,101 @@ class BaseParameters(object):
 		raise NotImplementedError("BaseParameters::files")
 
 
+class QueryParameters(BaseParameters):
+	""" パラメータ（クエリ文字列）
+	初めてアクセスされた時に分割し、値は取得されたものだけデコードする
+	"""
+
+	def __init__(self, query_string, max_parts = None, encoding = "utf-8"):
+		""" コンストラクタ
+
+		@param query_string: クエリ文字列
+		@param max_parts: 最大項目数（超えた分は無視する）
+		@param encoding: 文字コード
+		"""
+		self.__query_string = query_string
+		self.__max_parts = max_parts
+		self.__encoding = encoding
+		self.__pairs = None
+
+
+	def value(self, name, default = None):
+		entry = self.__get(name)
+		if entry == None:
+			return default
+
+		if isinstance(entry, list):
+			entry = entry[0]
+
+		return formparser.decode_query(entry, self.__encoding)
+
+
+	def values(self, name):
+		entry = self.__get(name)
+		if entry == None:
+			return []
+
+		if not isinstance(entry, list):
+			entry = [entry]
+
+		return [formparser.decode_query(value, self.__encoding) for value in entry]
+
+
+	def file(self, name):
+		return None
+
+
+	def files(self, name):
+		return []
+
+
+	def __get(self, name):
+		""" デコード前の値を取得（初回は分割する）
+
+		@param name: パラメータ名
+		@return: 値 or 値のリスト（なければNone）
+		"""
+		if self.__pairs == None:
+			self.__pairs = formparser.split_query(self.__query_string, self.__max_parts)
+
+		return self.__pairs.get(name)
+
+
+class FormParameters(BaseParameters):
+	""" パラメータ（フォームデータ） """
+
+	def __init__(self, form):
+		""" コンストラクタ
+
+		@param form: 解析結果（brocadefw.utilities.formparser.FormData）
+		"""
+		self.__form = form
+
+
+	def value(self, name, default = None):
+		values = self.__form.fields.get(name)
+		if not values:
+			return default
+
+		return values[0]
+
+
+	def values(self, name):
+		return list(self.__form.fields.get(name, ()))
+
+
+	def file(self, name):
+		files = self.__form.files.get(name)
+		if not files:
+			return None
+
+		return files[0]
+
+
+	def files(self, name):
+		return list(self.__form.files.get(name, ()))
+
+
 class ExitException(Exception):
 	""" アプリケーションを終了する際に投げる例外 """
 	def body(self):
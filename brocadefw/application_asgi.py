@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+""" ASGIユーティリティ（Python 3.7以降）
+
+ASGIサーバ（uvicorn, hypercorn等）にASGI_Applicationのオブジェクトを渡して使う。
+
+ASGI_Handlerでは on_get 等を async def で実装でき、実行中はスレッドを占有しない。
+同期的なon_xxxや、WSGI_Handlerから派生したハンドラは、上限つきのスレッドプールで実行する
+（ページキャッシュ・セッションの保存等、ブロックする可能性のある処理もスレッドプールで実行する）
+
+リクエストボディは先に受信せず、ハンドラが読み込んだ分だけreceiveから受け取る
+（スレッドプールで実行するハンドラはそのまま読み込み、async defのon_xxxの前にはMAX_CONTENT_LENGTHまで受信しておく）
+"""
+
+import asyncio
+
+if __name__ == "__main__":
+	import application, application_wsgi
+else:
+	from . import application, application_wsgi
+
+
+class ASGI_Application(application.BaseApplication):
+	""" アプリケーション（ASGI版） """
+
+	# 同期処理を実行するスレッド数（同時に処理できる同期ハンドラの数）
+	THREADS = 16
+
+	# async defのon_xxxの前に受信したリクエストボディをメモリに保持する上限[byte]（超えたら一時ファイルに書き出す）
+	BODY_MEMORY_SIZE = 1024 * 1024
+
+	def __init__(self, root_dir, default_handler_info, *maps):
+		""" コンストラクタ
+
+		@param root_dir: アプリケーションのルートディレクトリ
+		@param default_handler_info: どれにもマッチしなかった場合のデフォルトハンドラ([モジュール名], [クラス名])
+		@param maps: マッピングデータ([正規表現], [モジュール名], [クラス名])
+		"""
+		from concurrent.futures import ThreadPoolExecutor
+		super(ASGI_Application, self).__init__(root_dir, default_handler_info, *maps)
+		self.__executor = ThreadPoolExecutor(self.THREADS)
+
+
+	async def __call__(self, scope, receive, send):
+		""" リクエスト処理 """
+		if scope["type"] == "lifespan":
+			await self.__lifespan(receive, send)
+			return
+
+		if scope["type"] != "http":
+			raise ValueError("unsupported ASGI scope type: {type}".format(type = scope["type"]))
+
+		body = _ReceiveStream(receive, asyncio.get_running_loop(), self.__executor, self.BODY_MEMORY_SIZE)
+		try:
+			environ = _build_environ(scope, body)
+			(handler, args, kwargs) = self._get_matched_data(environ["PATH_INFO"])
+
+			response = {}
+			def start_response(status, headers, exc_info = None):
+				response["status"] = int(status.split(" ", 1)[0])
+				response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for (name, value) in headers]
+
+			handler_instance = self._acquire_handler(handler, environ, start_response)
+			try:
+				if isinstance(handler_instance, ASGI_Handler):
+					handler_instance.use_executor(self.__executor)
+					result = await handler_instance(*args, **kwargs)
+
+				else:
+					# WSGI用のハンドラはそのままスレッドプールで実行
+					result = await _run_sync(self.__executor, handler_instance, *args, **kwargs)
+
+				await send({
+					"type"   : "http.response.start",
+					"status" : response["status"],
+					"headers": response["headers"],
+				})
+				await self.__send_body(result, send)
+
+			finally:
+				self._release_handler(handler_instance)
+
+		finally:
+			body.close()
+
+
+	def _create_handler(self, handler, environ):
+		""" リクエスト外でハンドラオブジェクトを作成（キャッシュの作成用）
+
+		@param handler: ハンドラクラス
+		@param environ: 環境変数（ルートへのGETリクエストとして足りないものは補われる）
+		@return: ハンドラオブジェクト
+		"""
+		from wsgiref.util import setup_testing_defaults
+		environ = dict(environ)
+		setup_testing_defaults(environ)
+		return handler(self.get_root_dir(), environ, lambda status, headers: None)
+
+
+	def get_executor(self):
+		""" 同期処理を実行するスレッドプールを取得
+
+		@return: concurrent.futures.ThreadPoolExecutor
+		"""
+		return self.__executor
+
+
+	async def __lifespan(self, receive, send):
+		""" ライフスパンイベントを処理 """
+		while True:
+			message = await receive()
+			if message["type"] == "lifespan.startup":
+				await send({"type": "lifespan.startup.complete"})
+
+			elif message["type"] == "lifespan.shutdown":
+				self.__executor.shutdown(wait = False)
+				await send({"type": "lifespan.shutdown.complete"})
+				return
+
+
+	async def __send_body(self, body, send):
+		""" レスポンスボディを送信
+
+		@param body: レスポンスボディ（バイト列 or バイト列の(非同期)イテレータ）
+		@param send: ASGIのsend
+		"""
+		if isinstance(body, bytes):
+			await send({"type": "http.response.body", "body": body})
+			return
+
+		try:
+			if hasattr(body, "__aiter__"):
+				async for chunk in body:
+					await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+			else:
+				# テンプレートのストリーム出力やファイルの読み込みはブロックするのでスレッドプールで
+				iterator = iter(body)
+				while True:
+					chunk = await _run_sync(self.__executor, next, iterator, None)
+					if chunk == None:
+						break
+
+					await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+			await send({"type": "http.response.body", "body": b""})
+
+		finally:
+			if hasattr(body, "close"):
+				body.close()
+
+
+class ASGI_Handler(application_wsgi.WSGI_Handler):
+	""" リクエストハンドラ（ASGI版）
+	ASGIのスコープをWSGIの環境変数に変換して処理するので、WSGI_Handlerの機能はそのまま使える。
+	on_xxxを async def で実装すれば、イベントループ上で実行される
+	"""
+
+	__slots__ = ("__executor",)
+
+	def __init__(self, root_dir, environ, start_response, default_language = "ja"):
+		super(ASGI_Handler, self).__init__(root_dir, environ, start_response, default_language)
+		self.__executor = None
+
+
+	def use_executor(self, executor):
+		""" 同期処理を実行するスレッドプールを設定
+
+		@param executor: concurrent.futures.Executor
+		"""
+		self.__executor = executor
+
+
+	async def __call__(self, *args, **kwargs):
+		""" リクエスト処理部 """
+		method = self._get_request_handler()
+		if not self.__is_async(method):
+			# 同期的なon_xxxは全体をスレッドプールで（リクエストボディもそのまま読み込める）
+			return await self.run_sync(super(ASGI_Handler, self).__call__, *args, **kwargs)
+
+		# イベントループ上ではリクエストボディを受信しながら読み込めないので、先に受信しておく
+		body = self.get_env("wsgi.input", None)
+		if isinstance(body, _ReceiveStream):
+			await body.receive_all(self.MAX_CONTENT_LENGTH, self.__get_content_length())
+
+		result = await self.run_sync(self._begin_request, *args, **kwargs)
+		if result == None:
+			try:
+				result = method(*args, **kwargs)
+				if asyncio.iscoroutine(result):
+					result = await result
+
+			except application.ExitException as e:
+				result = e.body()
+
+			result = await self.run_sync(self._store_response, result)
+
+		return await self.run_sync(self._finish_request, result)
+
+
+	def __get_content_length(self):
+		""" Content-Lengthを取得
+
+		@return: Content-Length（ないか不正ならNone）
+		"""
+		try:
+			return int(self.get_env("CONTENT_LENGTH"))
+
+		except ValueError:
+			return None
+
+
+	async def run_sync(self, func, *args, **kwargs):
+		""" ブロックする処理をスレッドプールで実行
+
+		@param func: 関数
+		@param args: 引数
+		@param kwargs: キーワード引数
+		@return: 関数の戻り値
+		"""
+		return await _run_sync(self.__executor, func, *args, **kwargs)
+
+
+	async def session_async(self, session_name = "session", lifetime = 24 * 60 * 60, path = "/", domain = None):
+		""" セッションオブジェクトを取得（セッションストレージへのアクセスをスレッドプールで実行）
+
+		@param session_name: セッション名
+		@param lifetime: 有効期間[sec]
+		@param path: 有効パス
+		@param domain: 有効ドメイン
+		@return: セッションオブジェクト
+		"""
+		return await self.run_sync(self.session, session_name, lifetime, path, domain)
+
+
+	def cache_async(self, cache):
+		""" キャッシュオブジェクトを非同期で使えるようにする
+
+		@param cache: キャッシュオブジェクト（brocadefw.db.kvs.Cache）
+		@return: AsyncCache
+		"""
+		return AsyncCache(cache, self.__executor)
+
+
+	def __is_async(self, method):
+		""" on_xxxをイベントループ上で実行するか？
+
+		@param method: on_xxx
+		@return: Yes/No
+		"""
+		if asyncio.iscoroutinefunction(method):
+			return True
+
+		# 既定のon_headはon_getを呼ぶだけなので、on_getに従う
+		if getattr(method, "__func__", None) is application.BaseHandler.on_head:
+			return asyncio.iscoroutinefunction(self.on_get)
+
+		return False
+
+
+class AsyncCache(object):
+	""" キャッシュオブジェクトの非同期版（アクセスをスレッドプールで実行） """
+
+	def __init__(self, cache, executor = None):
+		""" コンストラクタ
+
+		@param cache: キャッシュオブジェクト（brocadefw.db.kvs.Cache）
+		@param executor: スレッドプール（Noneならイベントループの既定のもの）
+		"""
+		self.__cache = cache
+		self.__executor = executor
+
+
+	async def get(self, key, default = None):
+		""" 値を取得
+
+		@param key: キー
+		@param default: キーが存在しない場合のデフォルト値
+		@return: 値
+		"""
+		return await _run_sync(self.__executor, self.__cache.get, key, default)
+
+
+	async def set(self, key, value, lifetime = None):
+		""" 値を設定
+
+		@param key: キー
+		@param value: 値
+		@param lifetime: 有効期間[sec]
+		@return: キャッシュオブジェクト
+		"""
+		await _run_sync(self.__executor, self.__cache.set, key, value, lifetime)
+		return self
+
+
+	async def delete(self, key):
+		""" 値を削除
+
+		@param key: キー
+		@return: キャッシュオブジェクト
+		"""
+		await _run_sync(self.__executor, self.__cache.delete, key)
+		return self
+
+
+class _ReceiveStream(object):
+	""" ASGIのreceiveから読み込むwsgi.input
+	スレッドプールから読み込むと、必要な分だけイベントループ上でreceiveする（一時ファイルを経由しない）
+	"""
+
+	def __init__(self, receive, loop, executor, memory_size):
+		""" コンストラクタ
+
+		@param receive: ASGIのreceive
+		@param loop: イベントループ
+		@param executor: 一時ファイルへの書き出しを実行するスレッドプール
+		@param memory_size: receive_all()で受信したボディをメモリに保持する上限[byte]
+		"""
+		self.__receive = receive
+		self.__loop = loop
+		self.__executor = executor
+		self.__memory_size = memory_size
+		self.__buffer = bytearray()
+		self.__file = None
+		self.__done = False
+
+
+	async def receive_all(self, max_size, length = None):
+		""" 残りのボディを受信しておく（以降はイベントループ上でも読み込める）
+		max_sizeを超えたところで受信をやめる（超えたことは読み込む側がサイズで判断する）
+
+		@param max_size: 受信する最大サイズ[byte]（Noneなら無制限）
+		@param length: Content-Length（max_sizeを超えていれば受信しない）
+		"""
+		from tempfile import SpooledTemporaryFile
+		if self.__file != None:
+			return
+
+		body = SpooledTemporaryFile(self.__memory_size)
+		body.write(self.__buffer)
+		del self.__buffer[:]
+		self.__file = body
+		if max_size != None and length != None and length > max_size:
+			return
+
+		while not self.__done and (max_size == None or body.tell() <= max_size):
+			chunk = await self.__receive_async()
+			if body.tell() + len(chunk) <= self.__memory_size:
+				body.write(chunk)
+			else:
+				# 一時ファイルへの書き出しはブロックするのでスレッドプールで
+				await _run_sync(self.__executor, body.write, chunk)
+
+		body.seek(0)
+
+
+	def read(self, size = -1):
+		""" 読み込む
+
+		@param size: 最大サイズ（負なら終端まで）
+		@return: バイト列
+		"""
+		if self.__file != None:
+			return self.__file.read(size)
+
+		buf = self.__buffer
+		while (size < 0 or len(buf) < size) and not self.__done:
+			buf += self.__receive_sync()
+
+		if size < 0 or size > len(buf):
+			size = len(buf)
+
+		data = bytes(buf[:size])
+		del buf[:size]
+		return data
+
+
+	def readinto(self, b):
+		""" バッファに読み込む
+
+		@param b: バッファ
+		@return: 読み込んだサイズ
+		"""
+		data = self.read(len(b))
+		b[:len(data)] = data
+		return len(data)
+
+
+	def readline(self, size = -1):
+		""" 1行読み込む
+
+		@param size: 最大サイズ（負なら無制限）
+		@return: バイト列（改行を含む）
+		"""
+		if self.__file != None:
+			return self.__file.readline(size)
+
+		buf = self.__buffer
+		while buf.find(b"\n") < 0 and (size < 0 or len(buf) < size) and not self.__done:
+			buf += self.__receive_sync()
+
+		end = buf.find(b"\n") + 1
+		if end == 0:
+			end = len(buf)
+		if size >= 0:
+			end = min(end, size)
+
+		data = bytes(buf[:end])
+		del buf[:end]
+		return data
+
+
+	def readlines(self, hint = -1):
+		""" 全ての行を読み込む """
+		return list(self)
+
+
+	def __iter__(self):
+		while True:
+			line = self.readline()
+			if len(line) == 0:
+				return
+
+			yield line
+
+
+	def close(self):
+		""" 受信したボディを破棄 """
+		if self.__file != None:
+			self.__file.close()
+
+
+	async def __receive_async(self):
+		""" 次のボディを受信
+
+		@return: バイト列（終端・切断ならb""）
+		"""
+		message = await self.__receive()
+		if message["type"] == "http.disconnect" or not message.get("more_body", False):
+			self.__done = True
+
+		return message.get("body", b"")
+
+
+	def __receive_sync(self):
+		""" 次のボディをスレッドプールから受信
+
+		@return: バイト列
+		"""
+		try:
+			running = asyncio.get_running_loop()
+		except RuntimeError:
+			running = None
+
+		if running is self.__loop:
+			raise RuntimeError("cannot read the request body on the event loop without receive_all()")
+
+		return asyncio.run_coroutine_threadsafe(self.__receive_async(), self.__loop).result()
+
+
+async def _run_sync(executor, func, *args, **kwargs):
+	""" 関数をスレッドプールで実行
+
+	@param executor: スレッドプール（Noneならイベントループの既定のもの）
+	@param func: 関数
+	@param args: 引数
+	@param kwargs: キーワード引数
+	@return: 関数の戻り値
+	"""
+	from functools import partial
+	loop = asyncio.get_running_loop()
+	return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+def _build_environ(scope, body):
+	""" ASGIのスコープからWSGIの環境変数を作成
+
+	@param scope: ASGIのスコープ
+	@param body: リクエストボディ（ファイルオブジェクト）
+	@return: 環境変数
+	"""
+	import sys
+	scheme = scope.get("scheme", "http")
+	environ = {
+		"REQUEST_METHOD"       : scope["method"],
+		"SCRIPT_NAME"          : _to_native(scope.get("root_path", "")),
+		"PATH_INFO"            : _to_native(scope["path"]),
+		"QUERY_STRING"         : scope.get("query_string", b"").decode("latin-1"),
+		"SERVER_PROTOCOL"      : "HTTP/" + scope.get("http_version", "1.1"),
+		"SERVER_NAME"          : "localhost",
+		"SERVER_PORT"          : "80",
+		"wsgi.version"         : (1, 0),
+		"wsgi.url_scheme"      : scheme,
+		"wsgi.input"           : body,
+		"wsgi.input_terminated": True,
+		"wsgi.errors"          : sys.stderr,
+		"wsgi.multithread"     : True,
+		"wsgi.multiprocess"    : True,
+		"wsgi.run_once"        : False,
+	}
+	if scheme == "https":
+		environ["HTTPS"] = "on"
+
+	server = scope.get("server")
+	if server != None:
+		(environ["SERVER_NAME"], environ["SERVER_PORT"]) = (server[0], str(server[1]))
+
+	client = scope.get("client")
+	if client != None:
+		(environ["REMOTE_ADDR"], environ["REMOTE_PORT"]) = (client[0], str(client[1]))
+
+	for (name, value) in scope.get("headers", []):
+		name = name.decode("latin-1").upper().replace("-", "_")
+		value = value.decode("latin-1")
+		if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+			name = "HTTP_" + name
+
+		if name in environ:
+			# 同名のヘッダは連結
+			value = environ[name] + "," + value
+
+		environ[name] = value
+
+	return environ
+
+
+def _to_native(path):
+	""" ASGIのパス（UTF-8でデコード済み）をWSGIの形式（latin-1でデコードしたもの）に変換
+
+	@param path: パス
+	@return: WSGI形式のパス
+	"""
+	return path.encode("utf-8").decode("latin-1")
@@ -3,8 +3,10 @@
 
 if __name__ == "__main__":
 	import application
+	from utilities import strutils
 else:
 	from . import application
+	from .utilities import strutils
 
 
 class WSGI_Application(application.BaseApplication):
@@ -18,12 +20,37 @@ class WSGI_Application(application.BaseApplication):
 		uri = environ.get("PATH_INFO", "")
 
 		(handler, args, kwargs) = self._get_matched_data(uri)
-		handler_instance = handler(self.get_root_dir(), environ, start_response)
-		yield handler_instance(*args, **kwargs)
+		handler_instance = self._acquire_handler(handler, environ, start_response)
+		try:
+			body = handler_instance(*args, **kwargs)
+			if strutils.is_bytes(body):
+				yield body
+				return
+
+			# ストリーミング出力
+			for chunk in body:
+				yield chunk
+
+		finally:
+			# ストリーミング出力がハンドラを参照している場合があるので、出力し終わってから戻す
+			self._release_handler(handler_instance)
+
+
+	def _create_handler(self, handler, environ):
+		""" リクエスト外でハンドラオブジェクトを作成（キャッシュの作成用）
+
+		@param handler: ハンドラクラス
+		@param environ: 環境変数（ルートへのGETリクエストとして足りないものは補われる）
+		@return: ハンドラオブジェクト
+		"""
+		from wsgiref.util import setup_testing_defaults
+		environ = dict(environ)
+		setup_testing_defaults(environ)
+		return handler(self.get_root_dir(), environ, lambda status, headers: None)
 
 
 	def test_run(self, host = "", port = 8080):
-		""" テスト用サーバを起動（本番環境で使用しないこと）
+		""" テスト用サーバを起動（本番環境で使用しないこと; 本番環境ではbrocadefw.server.serveを使う）
 
 		@param host: ホスト名
 		@param port: 待機ポート
@@ -37,45 +64,43 @@ class WSGI_Application(application.BaseApplication):
 class WSGI_Handler(application.BaseHandler):
 	""" リクエストハンドラ（WSGI版） """
 
+	__slots__ = ("__environ", "__start_response")
+
 	def __init__(self, root_dir, environ, start_response, default_language = "ja"):
 		super(WSGI_Handler, self).__init__(root_dir, default_language)
 
-		# 引数
-		self.__environ        = environ.copy()
+		# 引数（environはリクエストごとにサーバが作るものなので、コピーせずに参照する）
+		self.__environ        = environ
 		self.__start_response = start_response
 
 
-	def _param_get(self):
-		""" GETパラメータを取得 """
-		return self.__param(False)
-
-
-	def _param_post(self):
-		""" POSTパラメータを取得 """
-		return self.__param(True)
+	def _clear(self):
+		""" リクエストごとの状態を解放（BaseApplication.HANDLER_POOLING用; wsgi.input等を保持し続けないように） """
+		super(WSGI_Handler, self)._clear()
+		self.__environ        = None
+		self.__start_response = None
 
 
-	def __param(self, post = False):
-		""" パラメータを取得
+	def _reset(self, environ, start_response):
+		""" 次のリクエストの情報を設定（BaseApplication.HANDLER_POOLING用）
 
-		@param post: GETデータを取得するならFalse, POSTデータを取得するならTrue
-		@return: FieldStorage
+		@param environ: 環境変数
+		@param start_response: レスポンス開始関数
 		"""
-		import cgi
+		self.__environ        = environ
+		self.__start_response = start_response
+
 
-		fp = None
+	def _param_post(self):
+		""" POSTパラメータを取得 """
 		environ = self.__environ
-		keep_blank_values = True
+		return self._parse_form(environ.get("wsgi.input"), environ.get("wsgi.input_terminated", False))
 
-		if post:
-			# POSTならクエリ文字列をクリア
-			environ = environ.copy()
-			environ["QUERY_STRING"] = ""
-			if "wsgi.input" in environ:
-				fp = environ["wsgi.input"]
 
-		field_storage = cgi.FieldStorage(fp = fp, environ = environ, keep_blank_values = keep_blank_values)
-		return WSGI_Parameters(field_storage)
+	def _param_json(self):
+		""" リクエストボディのJSONを取得 """
+		environ = self.__environ
+		return self._parse_json(environ.get("wsgi.input"), environ.get("wsgi.input_terminated", False))
 
 
 	def get_env(self, name, default = ""):
@@ -110,85 +135,14 @@ class WSGI_Handler(application.BaseHandler):
 		return util.guess_scheme(self.__environ)
 
 
-class WSGI_Parameters(application.BaseParameters):
-	""" パラメータ（WSGI版） """
-
-	def __init__(self, field_storage):
-		self.__field_storage = field_storage
-
-
-	def value(self, name, default = None):
-		""" 単一のパラメータ値を取得
-
-		@param name: パラメータ名
-		@param default: デフォルトパラメータ
-		@return: パラメータ値
-		"""
-		return self.__field_storage.getfirst(name, default)
-
-
-	def values(self, name):
-		""" パラメータ値のリストを取得
-
-		@param name: パラメータ名
-		@return: パラメータ値のリスト（値がない場合は空のリスト）
-		"""
-		return self.__field_storage.getlist(name)
-
-
-	def file(self, name):
-		""" アップロードファイルを取得
-
-		@param name: パラメータ名
-		@return: filename, fileを属性に持つオブジェクト
-		"""
-		field_storage = self.__field_storage
-		if not name in field_storage:
-			return None
-
-		f = field_storage[name]
-		if isinstance(f, list):
-			f = f[0]
-
-		if not self.__is_file(f):
-			return None
-
-		return f
-
+class WSGI_StaticHandler(WSGI_Handler):
+	""" 静的ファイルのリクエストハンドラ（WSGI版）
+	マッピングの例: (r"^/static/(.+)$", "brocadefw.application_wsgi", "WSGI_StaticHandler")
+	"""
 
-	def files(self, name):
-		""" アップロードファイルのリストを取得
+	__slots__ = ()
 
-		@param name: パラメータ名
-		@return: filename, fileを属性に持つオブジェクトのリスト
-		"""
-		field_storage = self.__field_storage
-		if not name in field_storage:
-			return []
-
-		files = field_storage[name]
-		if not isinstance(files, list):
-			files = [files]
-
-		if not self.__is_file(files[0]):
-			return []
-
-		return files
-
-
-	@staticmethod
-	def __is_file(f):
-		""" 引数がファイルか？
-
-		@param f: チェックする引数
-		@return: Yes/No
-		"""
-		if not hasattr(f, "filename"):
-			return False
-		if not hasattr(f, "file"):
-			return False
-
-		if f.file == None:
-			return False
+	def on_get(self, name):
+		""" リクエスト処理 """
+		return self.render_static(name)
 
-		return True
@@ -129,6 +129,130 @@ class ChainCache(Cache):
 			cache.delete(key)
 
 
+class ExpiringCache(Cache):
+	""" 有効期間を厳密に守るキャッシュ（他のキャッシュオブジェクトのラッパ）
+
+	値と一緒に有効期限を保存し、期限切れの値は取得時に削除する。lifetimeを無視するDictCache等と組み合わせて使う
+	"""
+
+	def __init__(self, cache):
+		""" コンストラクタ
+
+		@param cache: 実際に値を保存するキャッシュオブジェクト
+		"""
+		self.__cache = cache
+
+	def get(self, key, default = None):
+		entry = self.__cache.get(key)
+		if entry == None:
+			return default
+
+		(expires, value) = entry
+		if expires != None and expires <= _now():
+			# 期限切れ
+			self.__cache.delete(key)
+			return default
+
+		return value
+
+	def set(self, key, value, lifetime = None):
+		expires = None
+		if lifetime != None:
+			expires = _now() + lifetime
+
+		self.__cache.set(key, (expires, value), lifetime)
+		return self
+
+	def delete(self, key):
+		self.__cache.delete(key)
+		return self
+
+
+class LRUCache(Cache):
+	""" 件数上限つきのインメモリキャッシュ
+
+	上限を超えたら最も長い間使われていないものから削除する（LRU）。スレッドセーフで、ヒット数・ミス数を記録している
+	"""
+
+	def __init__(self, maxsize = 128):
+		""" コンストラクタ
+
+		@param maxsize: 保持する最大件数
+		"""
+		from collections import OrderedDict
+		from threading import Lock
+		self.__cache = OrderedDict()
+		self.__lock = Lock()
+		self.__maxsize = maxsize
+		self.__hits = 0
+		self.__misses = 0
+
+	def get(self, key, default = None):
+		with self.__lock:
+			if not key in self.__cache:
+				self.__misses += 1
+				return default
+
+			# 一旦取り出して末尾に入れ直す（＝最近使ったものとする）
+			value = self.__cache.pop(key)
+			self.__cache[key] = value
+			self.__hits += 1
+			return value
+
+	def set(self, key, value, lifetime = None):
+		with self.__lock:
+			if key in self.__cache:
+				del self.__cache[key]
+
+			self.__cache[key] = value
+			while len(self.__cache) > self.__maxsize:
+				# 先頭＝最も長い間使われていないもの
+				self.__cache.popitem(last = False)
+
+		return self
+
+	def delete(self, key):
+		with self.__lock:
+			if key in self.__cache:
+				del self.__cache[key]
+
+		return self
+
+	def clear(self):
+		""" 全てのキーを削除（統計情報もリセット）
+
+		@return: キャッシュオブジェクト
+		"""
+		with self.__lock:
+			self.__cache.clear()
+			self.__hits = 0
+			self.__misses = 0
+
+		return self
+
+	def stats(self):
+		""" 統計情報を取得
+
+		@return: hits/misses/size/maxsizeをキーに持つ辞書
+		"""
+		with self.__lock:
+			return {
+				"hits"   : self.__hits,
+				"misses" : self.__misses,
+				"size"   : len(self.__cache),
+				"maxsize": self.__maxsize,
+			}
+
+
+def _now():
+	""" 現在時刻を取得
+
+	@return: Unixタイムスタンプ（浮動小数点数）
+	"""
+	from time import time
+	return time()
+
+
 def _test():
 	""" テスト """
 	########################################
@@ -159,6 +283,27 @@ def _test():
 	assert dict_cache1.get("b") == None
 	assert dict_cache2.get("b") == None
 
+	########################################
+	# LRUキャッシュのテスト
+	lru_cache = LRUCache(2)
+	lru_cache.set("a", 1).set("b", 2)
+	assert lru_cache.get("a") == 1
+
+	# 上限を超えたら最も長い間使われていない"b"が追い出される
+	lru_cache.set("c", 3)
+	assert lru_cache.get("b") == None
+	assert lru_cache.get("a") == 1
+	assert lru_cache.get("c") == 3
+	assert lru_cache.stats() == {"hits": 3, "misses": 1, "size": 2, "maxsize": 2}
+
+	########################################
+	# 有効期間つきキャッシュのテスト
+	expiring_cache = ExpiringCache(DictCache())
+	expiring_cache.set("a", 1, 60)
+	expiring_cache.set("b", 2, -1)
+	assert expiring_cache.get("a") == 1
+	assert expiring_cache.get("b") == None
+
 	print("OK")
 
 
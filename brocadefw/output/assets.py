@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+""" 静的ファイルのビルドとマニフェスト
+
+デプロイ時に静的ファイルをミニファイし、内容のハッシュ値をファイル名に含めたコピーと
+事前圧縮版（gzip, brotli）を作成しておく。
+ファイル名が内容ごとに変わるので、ブラウザやCDNに無期限にキャッシュさせても古い内容が残ることはない
+
+@author: shimataro
+"""
+
+from . import minify
+
+# マニフェストのファイル名
+MANIFEST_NAME = "manifest.json"
+
+# 拡張子→ミニファイ関数
+_MINIFIERS = {
+	".css": minify.css,
+	".js" : minify.js,
+}
+
+# 事前圧縮する拡張子（画像等の圧縮済みの形式は圧縮しても小さくならない）
+_COMPRESSIBLE = frozenset((".css", ".js", ".json", ".svg", ".txt", ".xml", ".html", ".ico", ".map"))
+
+# 事前圧縮版の拡張子（Content-Encoding→拡張子）
+_SUFFIXES = {
+	"br"  : ".br",
+	"gzip": ".gz",
+}
+
+
+def build(source_dir, output_dir, use_brotli = True, encoding = "utf-8"):
+	""" 静的ファイルをビルドしてマニフェストを作成
+
+	@param source_dir: 静的ファイルのディレクトリ
+	@param output_dir: 出力先ディレクトリ
+	@param use_brotli: brotli版も作成するならTrue（brotliモジュールがなければ作成しない）
+	@param encoding: CSS/JSの文字コード
+	@return: (ファイル名, 出力ファイル名, 元のサイズ, 出力サイズ, 事前圧縮版のContent-Encodingのリスト)のジェネレータ
+	"""
+	import os
+	# 圧縮率の高い順
+	compressors = [("gzip", _gzip)]
+	if use_brotli:
+		brotli = _brotli()
+		if brotli != None:
+			compressors.insert(0, ("br", brotli))
+
+	files = {}
+	for (name, path) in _listfiles(source_dir):
+		with open(path, "rb") as f:
+			data = f.read()
+
+		size = len(data)
+		(base, ext) = os.path.splitext(name)
+		ext = ext.lower()
+		if ext in _MINIFIERS:
+			data = _MINIFIERS[ext](data.decode(encoding)).encode(encoding)
+
+		hashed_name = "{base}.{hash}{ext}".format(base = base, hash = _hash(data), ext = ext)
+		output_path = os.path.join(output_dir, hashed_name)
+		_write(output_path, data)
+
+		# 事前圧縮（元より小さくならなければ作らない）
+		encodings = []
+		if ext in _COMPRESSIBLE:
+			for (content_encoding, compress) in compressors:
+				compressed = compress(data)
+				if len(compressed) < len(data):
+					_write(output_path + _SUFFIXES[content_encoding], compressed)
+					encodings.append(content_encoding)
+
+		files[name] = {
+			"path"     : hashed_name,
+			"size"     : len(data),
+			"encodings": encodings,
+		}
+		yield (name, hashed_name, size, len(data), encodings)
+
+	_write(os.path.join(output_dir, MANIFEST_NAME), _dump_manifest(files))
+
+
+class Manifest(object):
+	""" マニフェスト（元のファイル名とハッシュ値つきファイル名の対応表） """
+
+	def __init__(self, output_dir, interval = 2):
+		""" コンストラクタ
+
+		@param output_dir: ビルド結果のディレクトリ
+		@param interval: マニフェストの更新をチェックする間隔[sec]
+		"""
+		from threading import Lock
+		self.__output_dir = output_dir
+		self.__interval = interval
+		self.__lock = Lock()
+		self.__checked = 0
+		self.__mtime = None
+		self.__generation = 0
+		self.__files = {}
+		self.__paths = {}
+		self.load()
+
+
+	def load(self):
+		""" マニフェストを読み込み直す """
+		import json
+		from os.path import join
+		from time import time
+
+		path = join(self.__output_dir, MANIFEST_NAME)
+		mtime = _getmtime(path)
+		files = {}
+		if mtime != None:
+			with open(path, "rb") as f:
+				files = json.loads(f.read().decode("utf-8"))["files"]
+
+		with self.__lock:
+			self.__mtime = mtime
+			self.__generation += 1
+			self.__files = files
+			self.__paths = dict((entry["path"], entry) for entry in files.values())
+			self.__checked = time()
+
+
+	def generation(self):
+		""" マニフェストの世代番号を取得（読み込み直すたびに増える）
+
+		@return: 世代番号
+		"""
+		self.__poll()
+		return self.__generation
+
+
+	def url(self, name):
+		""" ファイル名をハッシュ値つきのファイル名に変換
+
+		@param name: 元のファイル名（静的ファイルのディレクトリからの相対パス）
+		@return: ハッシュ値つきのファイル名（マニフェストになければ元のファイル名）
+		"""
+		self.__poll()
+		entry = self.__files.get(name.lstrip("/"))
+		if entry == None:
+			return name
+
+		return entry["path"]
+
+
+	def resolve(self, path):
+		""" ハッシュ値つきのファイル名から実ファイルの情報を取得
+
+		@param path: ハッシュ値つきのファイル名
+		@return: (ファイルパス, サイズ, 事前圧縮版の(Content-Encoding, ファイルパス)のリスト（圧縮率の高い順）)（マニフェストになければNone）
+		"""
+		from os.path import join
+		self.__poll()
+		entry = self.__paths.get(path)
+		if entry == None:
+			return None
+
+		filename = join(self.__output_dir, entry["path"])
+		return (filename, entry["size"], [(encoding, filename + _SUFFIXES[encoding]) for encoding in entry["encodings"]])
+
+
+	def __poll(self):
+		""" 前回のチェックから一定時間経過していれば、マニフェストの更新をチェック """
+		from os.path import join
+		from time import time
+		now = time()
+		if now - self.__checked < self.__interval:
+			return
+
+		with self.__lock:
+			if now - self.__checked < self.__interval:
+				# 他のスレッドがチェック済み
+				return
+
+			self.__checked = now
+
+		if _getmtime(join(self.__output_dir, MANIFEST_NAME)) != self.__mtime:
+			self.load()
+
+
+# ディレクトリごとのマニフェスト
+_manifests = {}
+
+def get_manifest(output_dir):
+	""" マニフェストを取得（なければ読み込む）
+
+	@param output_dir: ビルド結果のディレクトリ
+	@return: マニフェスト
+	"""
+	if not output_dir in _manifests:
+		_manifests[output_dir] = Manifest(output_dir)
+
+	return _manifests[output_dir]
+
+
+def get_output_dir(root_dir):
+	""" ビルド結果の保存先ディレクトリを取得
+
+	@param root_dir: アプリケーションのルートディレクトリ
+	@return: "[ルートディレクトリ]/tmp/static"
+	"""
+	from os.path import join
+	return join(root_dir, "tmp", "static")
+
+
+def _listfiles(source_dir):
+	""" ファイルを列挙（ドットで始まるものは除く）
+
+	@param source_dir: ディレクトリ
+	@return: (相対パス, ファイルパス)のリスト
+	"""
+	import os
+	result = []
+	for dirpath, dirnames, filenames in os.walk(source_dir):
+		dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+		for filename in sorted(filenames):
+			if filename.startswith("."):
+				continue
+
+			path = os.path.join(dirpath, filename)
+			result.append((os.path.relpath(path, source_dir).replace(os.sep, "/"), path))
+
+	return result
+
+
+def _hash(data):
+	""" 内容のハッシュ値を取得
+
+	@param data: 内容
+	@return: ハッシュ値（16進数12桁）
+	"""
+	from hashlib import md5
+	return md5(data).hexdigest()[:12]
+
+
+def _gzip(data):
+	""" gzip圧縮（最大圧縮率、ヘッダの更新日時は0にして同じ内容なら同じ結果にする）
+
+	@param data: 内容
+	@return: 圧縮結果
+	"""
+	import gzip
+	from io import BytesIO
+	buf = BytesIO()
+	with gzip.GzipFile(filename = "", mode = "wb", compresslevel = 9, fileobj = buf, mtime = 0) as f:
+		f.write(data)
+
+	return buf.getvalue()
+
+
+def _brotli():
+	""" brotli圧縮関数を取得
+
+	@return: 圧縮関数（brotliモジュールがなければNone）
+	"""
+	try:
+		import brotli
+
+	except ImportError:
+		return None
+
+	return lambda data: brotli.compress(data, quality = 11)
+
+
+def _dump_manifest(files):
+	""" マニフェストをシリアライズ
+
+	@param files: 元のファイル名→情報
+	@return: JSON（バイト列）
+	"""
+	import json
+	manifest = {
+		"version": 1,
+		"files"  : files,
+	}
+	return json.dumps(manifest, indent = 1, sort_keys = True).encode("utf-8")
+
+
+def _write(path, data):
+	""" ファイルに書き込む（一時ファイルに書いてから置き換える）
+
+	@param path: ファイルパス
+	@param data: 内容
+	"""
+	import os
+	from tempfile import mkstemp
+	directory = os.path.dirname(path)
+	if not os.path.isdir(directory):
+		os.makedirs(directory)
+
+	(fd, temp) = mkstemp(dir = directory)
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(data)
+
+		os.chmod(temp, 0o644)
+		os.rename(temp, path)
+
+	except:
+		os.remove(temp)
+		raise
+
+
+def _getmtime(path):
+	""" 更新日時を取得
+
+	@param path: パス
+	@return: 更新日時（取得できなければNone）
+	"""
+	from os.path import getmtime
+	try:
+		return getmtime(path)
+
+	except OSError:
+		return None
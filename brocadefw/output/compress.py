@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+""" レスポンスの圧縮
+
+@author: shimataro
+"""
+
+# 対応しているContent-Encoding（優先順）
+ENCODINGS = ("gzip", "deflate")
+
+# Content-Encoding→zlibのwbits（gzip: gzipヘッダつき, deflate: zlibヘッダつき（HTTPの "deflate" はzlib形式））
+_WBITS = {
+	"gzip"   : 16 + 15,
+	"deflate": 15,
+}
+
+
+def compress(data, encoding, level = 6):
+	""" バイト列を圧縮
+
+	@param data: バイト列
+	@param encoding: Content-Encoding（"gzip" or "deflate"）
+	@param level: 圧縮レベル（1-9）
+	@return: 圧縮結果
+	"""
+	compressor = _compressobj(encoding, level)
+	return compressor.compress(data) + compressor.flush()
+
+
+def compress_chunks(chunks, encoding, level = 6):
+	""" バイト列のイテレータを少しずつ圧縮（ストリーミング出力用）
+	各チャンクごとにフラッシュするので、クライアントは受信したところまで展開できる
+
+	@param chunks: バイト列のイテレータ
+	@param encoding: Content-Encoding（"gzip" or "deflate"）
+	@param level: 圧縮レベル（1-9）
+	@return: 圧縮結果のイテレータ
+	"""
+	import zlib
+	compressor = _compressobj(encoding, level)
+	for chunk in chunks:
+		if len(chunk) == 0:
+			continue
+
+		data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+		if len(data) > 0:
+			yield data
+
+	yield compressor.flush()
+
+
+def _compressobj(encoding, level):
+	""" 圧縮オブジェクトを生成
+
+	@param encoding: Content-Encoding
+	@param level: 圧縮レベル
+	@return: 圧縮オブジェクト
+	"""
+	import zlib
+	return zlib.compressobj(level, zlib.DEFLATED, _WBITS[encoding])
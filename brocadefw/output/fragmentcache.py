@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+""" フラグメントキャッシュ
+
+テンプレートの一部（Makoのcached="True"を指定したブロック、Jinja2の{% cache %}タグ）の出力をkvsキャッシュに保存する。
+キーは言語・デバイス・文字セットごとに別になる。
+
+@author: shimataro
+"""
+
+from ..db import kvs
+
+# FragmentCacheオブジェクトを入れておくテンプレート変数名
+VARIABLE_NAME = "_fragment_cache"
+
+
+class FragmentCache(object):
+	""" フラグメントキャッシュ """
+
+	def __init__(self, cache, vary):
+		""" コンストラクタ
+
+		@param cache: 出力を保存するキャッシュオブジェクト（brocadefw.db.kvs.Cache）
+		@param vary: キーに含める情報（言語・デバイス・文字セット等）
+		"""
+		self.__cache = kvs.ExpiringCache(cache)
+		self.__vary = vary
+
+
+	def get_or_create(self, key, creator, lifetime = None):
+		""" 保存済みの出力を取得（なければ生成して保存）
+
+		@param key: キー
+		@param creator: 出力を生成する関数
+		@param lifetime: 有効期間[sec]
+		@return: 出力
+		"""
+		key = self.__key(key)
+		value = self.__cache.get(key)
+		if value == None:
+			value = creator()
+			self.__cache.set(key, value, lifetime)
+
+		return value
+
+
+	def get(self, key, default = None):
+		""" 保存済みの出力を取得
+
+		@param key: キー
+		@param default: 取得できない場合のデフォルト値
+		@return: 出力
+		"""
+		return self.__cache.get(self.__key(key), default)
+
+
+	def set(self, key, value, lifetime = None):
+		""" 出力を保存
+
+		@param key: キー
+		@param value: 出力
+		@param lifetime: 有効期間[sec]
+		"""
+		self.__cache.set(self.__key(key), value, lifetime)
+
+
+	def delete(self, key):
+		""" 保存済みの出力を削除
+
+		@param key: キー
+		"""
+		self.__cache.delete(self.__key(key))
+
+
+	def __key(self, key):
+		""" キャッシュオブジェクトのキーを生成
+		（memcached等でも使えるよう、空白や長さを気にしなくていいハッシュ値にする）
+
+		@param key: キー
+		@return: キャッシュオブジェクトのキー
+		"""
+		from hashlib import md5
+		data = repr((self.__vary, key)).encode("utf-8")
+		return "fragment:" + md5(data).hexdigest()
+
+
+def get_or_create(fragment_cache, key, creator, lifetime = None):
+	""" 保存済みの出力を取得（なければ生成して保存）
+
+	@param fragment_cache: フラグメントキャッシュ（Noneならキャッシュせずに毎回生成）
+	@param key: キー
+	@param creator: 出力を生成する関数
+	@param lifetime: 有効期間[sec]
+	@return: 出力
+	"""
+	if not isinstance(fragment_cache, FragmentCache):
+		return creator()
+
+	return fragment_cache.get_or_create(key, creator, lifetime)
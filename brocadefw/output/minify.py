@@ -13,18 +13,48 @@ class _cre:
 	# 共通・それ以外の空白文字
 	common_space = re.compile(r"\s+")
 
-	# HTML・特殊タグ
-	html_special = re.compile(r"(.*?)<(script|style|pre|textarea)\b([^>]*)>([^<]*)</\2>", re.I | re.S)
+	# HTML・特殊タグの開始タグ（中身は対応する閉じタグまでで、閉じタグはhtml_special_endで別に探す;
+	# 1つの正規表現で閉じタグまでマッチさせると、閉じタグがない場合に開始タグごとに末尾まで走査し直すことになる）
+	html_special = re.compile(r"<(script|style|pre|textarea)\b([^>]*)>", re.I)
+	# HTML・特殊タグの閉じタグ（タグ名→正規表現）
+	html_special_end = {
+		"script"  : re.compile(r"</script\s*>", re.I),
+		"style"   : re.compile(r"</style\s*>", re.I),
+		"pre"     : re.compile(r"</pre\s*>", re.I),
+		"textarea": re.compile(r"</textarea\s*>", re.I),
+	}
+	# HTML・type属性
+	html_type = re.compile(r"""\btype\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.I)
 	# HTML・コメント
 	html_comment = re.compile(r"<!--.*?-->", re.S)
 
-	# CSS・コメント
-	css_comment   = re.compile(r"/\*.*?\*/", re.S)
-	# CSS・コロンおよび両脇の空白
-	css_colon     = re.compile(r"\s*:\s*")
-	# CSS・閉じカッコの前のセミコロン
-	css_semicolon = re.compile(r"\s*\;\s*\}")
-
+	# CSS・トークン（コメント、文字列、url()、空白、記号、それ以外）
+	css_token = re.compile(r"""
+		(?P<comment>/\*.*?(?:\*/|$))
+		| (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+		| (?P<url>url\((?:\\.|[^()"'\\])*\))
+		| (?P<space>\s+)
+		| (?P<punct>[{};:,>+~()\[\]=!/])
+		| (?P<word>[^\s{};:,>+~()\[\]=!/"']+|.)
+	""", re.S | re.X | re.I)
+
+	# JS・トークン（スラッシュは正規表現リテラルか除算かを文脈で判断するので別扱い、テンプレート文字列は入れ子になるので別扱い）
+	js_token = re.compile(r"""
+		(?P<space>[^\S\n]+)
+		| (?P<newline>\s*\n\s*)
+		| (?P<comment>//[^\n]*|/\*.*?(?:\*/|$))
+		| (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+		| (?P<word>[\w$\\\x00#]+)
+		| (?P<slash>/)
+		| (?P<template>`)
+		| (?P<punct>\+\+|--|.)
+	""", re.S | re.X)
+	# JS・テンプレート文字列の中の区切り（終わり、${、エスケープ）
+	js_template = re.compile(r"`|\$\{|\\.", re.S)
+	# JS・テンプレート文字列の中の式の区切り（カッコ、文字列、テンプレート文字列）
+	js_template_expr = re.compile(r"""[{}`]|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'""", re.S)
+	# JS・正規表現リテラル
+	js_regex = re.compile(r"/(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/[\w$]*")
 
 def html(data):
 	""" HTMLをミニファイ """
@@ -34,18 +64,286 @@ def html(data):
 
 
 def css(data):
-	""" CSSをミニファイ """
-	data = _cre.css_comment  .sub("" , data)
-	data = _common(data, False)
-	data = _cre.css_colon    .sub(":", data)
-	data = _cre.css_semicolon.sub("}", data)
-	return data
+	""" CSSをミニファイ
+	トークンに分割しながら先頭から1回だけ走査し、文脈（セレクタ／宣言ブロック）に応じて不要な空白とコメントを削除する
+	"""
+	pieces = []
+	append = pieces.append
+
+	stack = []            # ブロックの種類（True: 宣言ブロック, False: ルールを含むブロック）
+	declaration = False   # 宣言ブロック内か？
+	prelude_at = False    # アットルールのプレリュード内か？
+	prelude_start = True  # プレリュードの先頭か？
+	prelude = ""          # プレリュード先頭のトークン
+	space = False         # 直前に空白（コメント）があったか？
+	prev = ""             # 直前に出力したトークン
+
+	for match in _cre.css_token.finditer(data):
+		kind = match.lastgroup
+		token = match.group()
+		if kind == "space":
+			space = True
+			continue
+
+		if kind == "comment":
+			if not token.startswith("/*!"):
+				# 通常のコメントは空白とみなす
+				space = True
+				continue
+
+			# /*! 〜 */ は残す
+			kind = "word"
+
+		if kind == "punct":
+			if token == ";" and prev in (";", "{", ""):
+				# 空の宣言
+				space = False
+				continue
+
+			if token == "}" and prev == ";":
+				# 閉じカッコの前のセミコロン
+				pieces.pop()
+
+		if space and prev != "" and not _css_strip_space(prev, token, declaration or prelude_at):
+			append(" ")
+
+		append(token)
+		prev = token
+		space = False
+
+		# 文脈を更新
+		if not declaration and prelude_start:
+			prelude = token.lower()
+			prelude_at = prelude.startswith("@")
+			prelude_start = False
+
+		if token == "{":
+			stack.append(declaration)
+			if not declaration and prelude_at and prelude.lstrip("@-").split("-")[-1] not in _CSS_DECLARATION_AT_RULES:
+				# @mediaや@keyframes等はルールを含む
+				declaration = False
+			else:
+				declaration = True
+
+			prelude_at = False
+			prelude_start = True
+
+		elif token == "}":
+			declaration = stack.pop() if len(stack) > 0 else False
+			prelude_at = False
+			prelude_start = True
+
+		elif token == ";" and not declaration:
+			# @import等
+			prelude_at = False
+			prelude_start = True
+
+	return "".join(pieces)
+
+
+# 宣言ブロックを持つアットルール（ベンダープレフィックスは除く）
+_CSS_DECLARATION_AT_RULES = frozenset(("font", "face", "page", "viewport", "property", "counter-style", "style"))
+
+# 両脇の空白を削除できるCSSの記号
+_CSS_PUNCT_BOTH = frozenset(("{", "}", ";", ",", "=", "/"))
+# セレクタ中で両脇の空白を削除できるCSSの記号
+_CSS_PUNCT_SELECTOR = frozenset((">", "+", "~"))
+
+def _css_strip_space(prev, token, declaration):
+	""" CSSのトークン間の空白を削除できるか？
+
+	@param prev: 直前のトークン
+	@param token: 次のトークン
+	@param declaration: 宣言ブロックまたはアットルールのプレリュード内か？
+	@return: Yes/No
+	"""
+	for (t, after) in ((prev, True), (token, False)):
+		if t in _CSS_PUNCT_BOTH:
+			return True
+
+		if declaration:
+			# 宣言内の + や > はcalc()等の演算子なので空白を残す
+			if t in (":", "!"):
+				return True
+
+		elif t in _CSS_PUNCT_SELECTOR:
+			return True
+
+	# 開きカッコの後、閉じカッコの前（開きカッコの前はメディアクエリの "and (" 等で必要）
+	if prev in ("(", "[") or token in (")", "]"):
+		return True
+
+	return False
 
 
 def js(data):
-	""" JSをミニファイ """
-	# 今のところは何もしない
-	return data
+	""" JSをミニファイ
+	文字列・テンプレート文字列・正規表現リテラルはそのまま残し、コメントと不要な空白を削除する
+	改行は自動セミコロン挿入に影響する箇所だけ残す
+	"""
+	pieces = []
+	append = pieces.append
+
+	prev = ""        # 直前に出力したトークン
+	prev_kind = ""   # 直前に出力したトークンの種類
+	space = ""       # 直前の空白（"", " ", "\n"）
+
+	pos = 0
+	length = len(data)
+	while pos < length:
+		match = _cre.js_token.match(data, pos)
+		kind = match.lastgroup
+		token = match.group()
+
+		if kind == "slash":
+			regex = None
+			if _js_regex_allowed(prev, prev_kind):
+				regex = _cre.js_regex.match(data, pos)
+
+			if regex != None:
+				kind = "regex"
+				token = regex.group()
+			else:
+				kind = "punct"
+
+		elif kind == "template":
+			kind = "string"
+			token = data[pos:_js_template_end(data, pos + 1)]
+
+		pos += len(token)
+
+		if kind == "space":
+			space = space or " "
+			continue
+
+		if kind == "newline":
+			space = "\n"
+			continue
+
+		if kind == "comment":
+			if token.startswith("/*!"):
+				# /*! 〜 */ は残す
+				append(token)
+				space = "\n"
+				continue
+
+			# コメントは空白とみなす（改行を含んでいれば改行）
+			if token.startswith("//") or "\n" in token:
+				space = "\n"
+			else:
+				space = space or " "
+			continue
+
+		if space != "" and prev != "":
+			append(_js_space(prev, prev_kind, token, kind, space))
+
+		append(token)
+		prev = token
+		prev_kind = kind
+		space = ""
+
+	return "".join(pieces)
+
+
+# 直後に正規表現リテラルが来うるキーワード
+_JS_REGEX_KEYWORDS = frozenset(("return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do", "else", "yield", "await"))
+# 直前の改行を残す必要があるトークン（行の先頭に来ると前の行に続いてしまう可能性があるもの）
+_JS_NEWLINE_BEFORE = frozenset(("(", "[", "{", "+", "-", "++", "--", "!", "~", "/", "`"))
+# 直後の改行を残す必要がある記号（文の終わりになりうるもの）
+_JS_NEWLINE_AFTER = frozenset((")", "]", "}", "++", "--"))
+
+def _js_regex_allowed(prev, prev_kind):
+	""" 次のスラッシュは正規表現リテラルの開始か？
+
+	@param prev: 直前のトークン
+	@param prev_kind: 直前のトークンの種類
+	@return: Yes/No
+	"""
+	if prev_kind == "":
+		return True
+
+	if prev_kind == "word":
+		return prev in _JS_REGEX_KEYWORDS
+
+	if prev_kind == "punct":
+		return prev not in (")", "]", "}", "++", "--")
+
+	# 文字列や正規表現リテラルの後は除算
+	return False
+
+
+def _js_template_end(data, pos):
+	""" テンプレート文字列の終わりを探す（${ 〜 } の中の入れ子のテンプレート文字列にも対応）
+
+	@param data: JSのソース
+	@param pos: 開始位置（` の直後）
+	@return: 終了位置（` の直後; 閉じていなければ末尾）
+	"""
+	length = len(data)
+	while pos < length:
+		match = _cre.js_template.search(data, pos)
+		if match == None:
+			break
+
+		pos = match.end()
+		token = match.group()
+		if token == "`":
+			return pos
+
+		if token == "${":
+			# 対応する閉じカッコまで読み飛ばす
+			depth = 1
+			while depth > 0:
+				match = _cre.js_template_expr.search(data, pos)
+				if match == None:
+					return length
+
+				pos = match.end()
+				token = match.group()
+				if token == "{":
+					depth += 1
+				elif token == "}":
+					depth -= 1
+				elif token == "`":
+					pos = _js_template_end(data, pos)
+
+	return length
+
+
+def _js_space(prev, prev_kind, token, kind, space):
+	""" JSのトークン間に残す空白を取得
+
+	@param prev: 直前のトークン
+	@param prev_kind: 直前のトークンの種類
+	@param token: 次のトークン
+	@param kind: 次のトークンの種類
+	@param space: 元の空白（" " または "\n"）
+	@return: 残す空白（不要なら空文字列）
+	"""
+	if space == "\n":
+		# 自動セミコロン挿入の対象になりうる改行は残す
+		ends = prev_kind in ("word", "string", "regex") or prev in _JS_NEWLINE_AFTER
+		begins = kind in ("word", "string", "regex") or token in _JS_NEWLINE_BEFORE
+		if ends and begins:
+			return "\n"
+
+	if prev_kind == "word" and kind == "word":
+		# 識別子・数値・キーワードが連結してしまう
+		return " "
+
+	if prev[-1:] in ("+", "-") and token[:1] == prev[-1:]:
+		# "a + +b" や "a - -b" が "a++b" になってしまう
+		return " "
+
+	if prev_kind == "word" and prev[:1].isdigit() and token == ".":
+		# "1 .toString()" が "1.toString()" になってしまう
+		return " "
+
+	if prev == "/" and kind == "regex":
+		# 除算の後に正規表現リテラルは来ないが、念のため
+		return " "
+
+	return ""
 
 
 def _common(data, remove_lf = False):
@@ -60,29 +358,54 @@ def _common(data, remove_lf = False):
 
 
 def _html(data):
-	""" コメントを除いたHTMLをミニファイ """
-	result = ""
+	""" コメントを除いたHTMLをミニファイ
+	特殊タグとそれ以外のテキストに分けながら先頭から1回だけ走査し、結果はリストに溜めて最後に連結する
+	"""
+	pieces = []
+	append = pieces.append
 	offset = 0
-	for match in _cre.html_special.finditer(data):
-		before   = match.group(1)
-		tag      = match.group(2)
-		attr     = match.group(3)
-		contents = match.group(4)
-
-		result += "%s<%s%s>%s</%s>" % (_common(before, True), tag, _common(attr, True), _html_special(tag, contents), tag)
-
-		offset = match.end()
+	position = 0
+	unclosed = set()   # 閉じタグが以降にない特殊タグ（同じタグの閉じタグを探し直さない）
+	while True:
+		match = _cre.html_special.search(data, position)
+		if match == None:
+			break
+
+		(tag, attr) = match.groups()
+		name = tag.lower()
+		position = match.end()
+		if name in unclosed:
+			continue
+
+		end = _cre.html_special_end[name].search(data, position)
+		if end == None:
+			# 閉じタグがなければ普通のテキストとして扱う
+			unclosed.add(name)
+			continue
+
+		# 特殊タグの前のテキストは普通にミニファイ
+		append(_common(data[offset:match.start()], True))
+		append("<%s%s>%s</%s>" % (tag, _common(attr, True), _html_special(name, attr, data[position:end.start()]), tag))
+
+		offset = position = end.end()
 
 	# 残りは普通にミニファイ
-	remains = data[offset:]
-	result += _common(remains, True)
-	return result
+	append(_common(data[offset:], True))
+	return "".join(pieces)
+
 
+def _html_special(tag, attr, data):
+	""" 特殊タグの中身をミニファイ
 
-def _html_special(tag, data):
-	""" 特殊タグの中身をミニファイ """
-	tag = tag.lower()
+	@param tag: タグ名（小文字）
+	@param attr: 属性
+	@param data: 中身
+	"""
 	if tag == "script":
+		if not _is_javascript(attr):
+			# クライアントサイドのテンプレートやJSONのデータブロック等はそのまま
+			return data
+
 		return js(data)
 
 	if tag == "style":
@@ -98,6 +421,23 @@ def _html_special(tag, data):
 	return data
 
 
+# JavaScriptとして扱うscriptのtype（小文字）
+_JAVASCRIPT_TYPES = ("", "module", "text/javascript", "application/javascript", "application/x-javascript", "text/ecmascript", "application/ecmascript")
+
+def _is_javascript(attr):
+	""" scriptタグの中身がJavaScriptか？（type属性がないか、JavaScriptのMIMEタイプ・moduleならYes）
+
+	@param attr: scriptタグの属性
+	@return: Yes/No
+	"""
+	match = _cre.html_type.search(attr)
+	if match == None:
+		return True
+
+	value = next(group for group in match.groups() if group != None)
+	return value.split(";", 1)[0].strip().lower() in _JAVASCRIPT_TYPES
+
+
 def _html_comment(data):
 	""" HTMLコメントをミニファイ """
 	def _html_comment_cond(match):
@@ -124,3 +464,114 @@ def _html_pre(data):
 def _html_textarea(data):
 	""" textareaの中身をミニファイ """
 	return data
+
+
+def _test():
+	""" テスト """
+	# 改行・タブは削除、連続する空白は1つに
+	assert html("<p>\n\t<b>a</b>  b\n</p>") == "<p><b>a</b> b</p>"
+
+	# 通常のコメントは削除、条件付きコメントは残す
+	assert html("a<!-- comment -->b") == "ab"
+	assert html("<!--[if IE]><p>IE</p><![endif]-->") == "<!--[if IE]><p>IE</p><![endif]-->"
+
+	# pre/textareaの中身はそのまま
+	assert html("<div>\n<pre class=\"x\">a\n  b</pre>\n</div>") == "<div><pre class=\"x\">a\n  b</pre></div>"
+	assert html("<TEXTAREA>a\n  b</textarea>") == "<TEXTAREA>a\n  b</TEXTAREA>"
+	assert html("<pre>a\n  <b>b</b>\n</pre>") == "<pre>a\n  <b>b</b>\n</pre>"
+
+	# script/styleの中身はJS/CSSとしてミニファイ
+	assert html("<style>\na { color : red ; }\n</style>") == "<style>a{color:red}</style>"
+	assert html("<script>\nvar a = 1 < 2;\n// comment\nb()\n</script>") == "<script>var a=1<2;b()</script>"
+
+	# 閉じタグがない特殊タグは普通のテキストとしてミニファイ（長くても線形時間で終わること）
+	from time import time
+	start = time()
+	assert html("<p><script>var a = 1;" + "x" * 10000 + "</p>") == "<p><script>var a = 1;" + "x" * 10000 + "</p>"
+	assert html("<pre>a <b>" * 1000) == "<pre>a <b>" * 1000
+	assert time() - start < 1
+
+	# 閉じタグのない特殊タグがたくさんあっても末尾まで走査し直さない（100KB程度）
+	start = time()
+	assert html("<pre>x " * 16000) == "<pre>x " * 16000
+	assert html("<script>a</p>" * 8000) == "<script>a</p>" * 8000
+	assert html("<script>a</p>" * 8000 + "<pre> b </pre>") == "<script>a</p>" * 8000 + "<pre> b </pre>"
+	assert time() - start < 1
+
+	# JavaScript以外のscriptの中身はそのまま
+	assert html("<script type=\"text/template\">Hello , <b>world</b> !</script>") == "<script type=\"text/template\">Hello , <b>world</b> !</script>"
+	assert html("<script type='text/x-template'>a / b</script>") == "<script type='text/x-template'>a / b</script>"
+	assert html("<script type=application/json>{ \"a\" : 1 }</script>") == "<script type=application/json>{ \"a\" : 1 }</script>"
+	assert html("<script type=\"module\">\nvar a = 1 ;\n</script>") == "<script type=\"module\">var a=1;</script>"
+	assert html("<script TYPE=\"Text/JavaScript; charset=utf-8\">a = 1 ;</script>") == "<script TYPE=\"Text/JavaScript; charset=utf-8\">a=1;</script>"
+
+	# CSS: セレクタ中の空白は意味があるので残す
+	assert css("a :hover , b > c + d { margin : 0 auto ; }") == "a :hover,b>c+d{margin:0 auto}"
+	assert css("@media screen and (max-width : 100px) { a { color : red } }") == "@media screen and (max-width:100px){a{color:red}}"
+	assert css("a { width : calc(100% - 2px) ; font : 12px / 1.5 \"A  B\" ; }") == "a{width:calc(100% - 2px);font:12px/1.5 \"A  B\"}"
+	assert css("a /* comment */ b { background : url( \"x y.png\" ) }") == "a b{background:url(\"x y.png\")}"
+	assert css("/*! license */\na{}") == "/*! license */ a{}"
+
+	# JS: 文字列・正規表現リテラルは残す
+	assert js("var s = \"a  // b\" ; var r = /a\\/ b[/]/g ;") == "var s=\"a  // b\";var r=/a\\/ b[/]/g;"
+	assert js("x = a / b / c") == "x=a/b/c"
+	assert js("return /x/.test(s)") == "return/x/.test(s)"
+	assert js("a = b + +c; d = e - -f; g = 1 .toString()") == "a=b+ +c;d=e- -f;g=1 .toString()"
+
+	# JS: 自動セミコロン挿入に関わる改行は残す
+	assert js("a = b\n(c)") == "a=b\n(c)"
+	assert js("a = b\nc = d") == "a=b\nc=d"
+	assert js("return\nx") == "return\nx"
+	assert js("i++\nj") == "i++\nj"
+	assert js("if (a) {\n  b();\n}\nc()") == "if(a){b();}\nc()"
+
+	# JS: テンプレート文字列（入れ子も含む）はそのまま
+	assert js("s = `a  ${ f(`b  ${c}`) }  // d` ;") == "s=`a  ${ f(`b  ${c}`) }  // d`;"
+
+	print("OK")
+
+
+def _benchmark(filename = None):
+	""" ベンチマーク（10KB/100KB/1MBのページ）
+
+	@param filename: ページの元にするHTMLファイル（Noneなら特殊タグを含む合成したHTML）
+	"""
+	from timeit import timeit
+	fragment = (
+		"<div class=\"item\">\n"
+		"\t<!-- item -->\n"
+		"\t<h2>  title  </h2>\n"
+		"\t<p>\n\t\tlorem ipsum dolor sit amet,\n\t\tconsectetur adipiscing elit\n\t</p>\n"
+		"\t<pre>\n  keep\n  this\n</pre>\n"
+		"\t<script>\n\tvar a = 1 < 2;\n\t</script>\n"
+		"\t<style>\n\t.item { color : red ; }\n\t</style>\n"
+		"</div>\n"
+	)
+	if filename != None:
+		import io
+		with io.open(filename, encoding = "utf-8") as f:
+			fragment = f.read()
+
+	print(filename if filename != None else "(synthetic)")
+	for size in (10 * 1024, 100 * 1024, 1024 * 1024):
+		data = fragment * (size // len(fragment.encode("utf-8")) + 1)
+		number = max(1, (1024 * 1024) // size)
+		elapsed = timeit(lambda: html(data), number = number) / number
+		print("{size:>8}B: {elapsed:8.2f}ms".format(size = len(data.encode("utf-8")), elapsed = elapsed * 1000))
+
+	# CSS/JS単体（100KB）
+	stylesheet = ".item > h2 , .item p {\n\tcolor : red ; /* comment */\n\tmargin : 0 auto ;\n}\n"
+	script = "function f(a, b) {\n\t// comment\n\treturn a / b + /x/.test(\"s\") ;\n}\n"
+	for (name, function, fragment) in (("css", css, stylesheet), ("js", js, script)):
+		data = fragment * (100 * 1024 // len(fragment) + 1)
+		elapsed = timeit(lambda: function(data), number = 10) / 10
+		print("{name:>4} {size:>8}B: {elapsed:8.2f}ms ({ratio:.0%})".format(name = name, size = len(data), elapsed = elapsed * 1000, ratio = len(function(data)) / len(data)))
+
+
+if __name__ == "__main__":
+	import sys
+	if sys.argv[1:2] == ["benchmark"]:
+		# python minify.py benchmark [HTMLファイル]
+		_benchmark(*sys.argv[2:3])
+	else:
+		_test()
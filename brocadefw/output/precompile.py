@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+""" テンプレートの事前コンパイル
+
+デプロイ時に全テンプレートをコンパイルしてディスク上のキャッシュに保存しておくことで、
+起動直後のワーカーで最初のリクエストだけ遅くなるのを防ぐ
+
+@author: shimataro
+"""
+
+from . import template, templateindex
+
+def find_templates(base_dir):
+	""" テンプレートファイルを列挙
+	get_searchpath_listが検索する "[言語]/[テンプレートタイプ]/[デバイス]/" 以下を探す
+
+	@param base_dir: テンプレートのベースディレクトリ
+	@return: (検索パス, テンプレート名)のリスト
+	"""
+	return templateindex.TemplateIndex(base_dir).items()
+
+
+def precompile(base_dir, compile_dir, driver = "mako", processes = None, encoding_input = "utf-8", filters_source = {}):
+	""" 全テンプレートをコンパイル（複数プロセスで並列実行）
+
+	@param base_dir: テンプレートのベースディレクトリ
+	@param compile_dir: コンパイル結果の保存先ディレクトリ
+	@param driver: ドライバ名
+	@param processes: プロセス数（省略時はCPU数）
+	@param encoding_input: 入力エンコーディング
+	@param filters_source: テンプレートタイプ→コンパイル時にテンプレートの静的な部分に適用するフィルタ（実行時と同じものを指定すること）
+	@return: (テンプレートファイル, 所要時間[sec], エラーメッセージまたはNone)のジェネレータ
+	"""
+	from os.path import basename, dirname
+	from multiprocessing import Pool
+	tasks = []
+	for (searchdir, name) in find_templates(base_dir):
+		# 検索パスは "[言語]/[テンプレートタイプ]/[デバイス]/"
+		filter_source = filters_source.get(basename(dirname(searchdir)))
+		tasks.append((driver, searchdir, name, compile_dir, encoding_input, filter_source))
+
+	pool = Pool(processes)
+	try:
+		for result in pool.imap_unordered(_compile, tasks):
+			yield result
+
+	finally:
+		pool.close()
+		pool.join()
+
+
+def _compile(task):
+	""" テンプレートを1つコンパイル（ワーカープロセスで実行）
+
+	@param task: (ドライバ名, 検索パス, テンプレート名, 保存先ディレクトリ, 入力エンコーディング, フィルタ)
+	@return: (テンプレートファイル, 所要時間[sec], エラーメッセージまたはNone)
+	"""
+	from os.path import join
+	from time import time
+
+	(driver, searchdir, name, compile_dir, encoding_input, filter_source) = task
+	start = time()
+	error = None
+	try:
+		# 実行時と同じ方法で検索オブジェクトを生成し、テンプレートを読み込む（＝コンパイル結果が保存される）
+		module = template.load_driver(driver)
+		lookup = module.create_lookup([searchdir], compile_dir, encoding_input, "utf-8", "replace", {}, None, filter_source)
+		module.compile_template(lookup, name)
+
+	except Exception as e:
+		error = "{name}: {message}".format(name = type(e).__name__, message = e)
+
+	return (join(searchdir, name), time() - start, error)
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 """ テンプレートユーティリティ """
 
+from ..db import kvs
+
 def _import_relative_module(module_name):
 	""" ここから相対位置にあるモジュールをインポート
 
@@ -14,7 +16,99 @@ def _import_relative_module(module_name):
 	return import_module(".".join(module_path))
 
 
-def factory(driver, searchpath, compile_dir = None, encoding_input = "utf-8", encoding_output = "utf-8", encoding_error = "replace", filter_output = None, params = {}):
+def _freeze(value):
+	""" 辞書やリストを含む値をハッシュ可能な形に変換
+
+	@param value: 変換する値
+	@return: 変換後の値
+	"""
+	if isinstance(value, dict):
+		return tuple(sorted((key, _freeze(value[key])) for key in value))
+
+	if isinstance(value, (list, tuple)):
+		return tuple(_freeze(element) for element in value)
+
+	if isinstance(value, (set, frozenset)):
+		return frozenset(_freeze(element) for element in value)
+
+	return value
+
+
+class LookupRegistry(object):
+	""" テンプレート検索オブジェクトのレジストリ
+
+	ドライバ・検索パス・エンコーディング・パラメータが同じ検索オブジェクトをプロセス内で共有し、
+	コンパイル結果をリクエスト間で再利用する。件数には上限があり、超えたらLRU方式で破棄する。
+	"""
+
+	def __init__(self, maxsize = 64):
+		""" コンストラクタ
+
+		@param maxsize: 保持する検索オブジェクトの最大数
+		"""
+		from threading import Lock
+		self.__cache = kvs.LRUCache(maxsize)
+		self.__lock = Lock()
+
+
+	def get(self, key, creator):
+		""" 検索オブジェクトを取得（なければ生成して登録）
+
+		@param key: キー（ハッシュ可能でなければ登録せずに毎回生成）
+		@param creator: 検索オブジェクトを生成する関数
+		@return: 検索オブジェクト
+		"""
+		try:
+			hash(key)
+		except TypeError:
+			return creator()
+
+		# 同じキーの検索オブジェクトを同時に複数生成しないよう、生成・登録までをロックする
+		with self.__lock:
+			lookup = self.__cache.get(key)
+			if lookup == None:
+				lookup = creator()
+				self.__cache.set(key, lookup)
+
+			return lookup
+
+
+	def clear(self):
+		""" 登録済みの検索オブジェクトを全て破棄 """
+		self.__cache.clear()
+
+
+	def stats(self):
+		""" 統計情報を取得
+
+		@return: hits/misses/size/maxsizeをキーに持つ辞書
+		"""
+		return self.__cache.stats()
+
+
+# プロセス全体で共有するレジストリ
+_registry = LookupRegistry()
+
+def get_registry():
+	""" プロセス全体で共有するレジストリを取得
+
+	@return: レジストリ
+	"""
+	return _registry
+
+
+def load_driver(driver):
+	""" ドライバモジュールをロード
+
+	@param driver: ドライバ名
+	@return: ドライバモジュール
+	"""
+	# "templatedrivers"以下のモジュールをロード
+	module_name = "templatedrivers._{driver}".format(driver = driver)
+	return _import_relative_module(module_name)
+
+
+def factory(driver, searchpath, compile_dir = None, encoding_input = "utf-8", encoding_output = "utf-8", encoding_error = "replace", filter_output = None, params = {}, index = None, filter_source = None):
 	""" ファクトリメソッド
 
 	@param driver: ドライバ名
@@ -24,12 +118,57 @@ def factory(driver, searchpath, compile_dir = None, encoding_input = "utf-8", en
 	@param encoding_output: 出力エンコーディング
 	@param filter_output: 出力結果に適用するフィルタ
 	@param param: テンプレートエンジンに渡す引数
+	@param index: テンプレートの索引（templateindex.TemplateIndex）
+	@param filter_source: コンパイル時にテンプレートの静的な部分に適用するフィルタ
 	@return: テンプレートオブジェクト
 	"""
-	# "templatedrivers"以下のモジュールをロード
-	module_name = "templatedrivers._{driver}".format(driver = driver)
-	module = _import_relative_module(module_name)
-	return module.Template(searchpath, compile_dir, encoding_input, encoding_output, encoding_error, filter_output, params)
+	module = load_driver(driver)
+
+	# 検索オブジェクトはレジストリから取得（なければ生成）
+	key = (driver, tuple(searchpath), compile_dir, encoding_input, encoding_output, encoding_error, _freeze(params), index, filter_source)
+	lookup = _registry.get(key, lambda: module.create_lookup(searchpath, compile_dir, encoding_input, encoding_output, encoding_error, params, index, filter_source))
+	return module.Template(lookup, encoding_output, encoding_error, filter_output)
+
+
+# 書き込み可否を確認済みのコンパイル結果保存先
+_compile_dirs = {}
+
+def get_compile_dir(root_dir, driver):
+	""" コンパイル結果の保存先ディレクトリを取得
+	プロジェクトの "tmp/templates/[ドライバ名]" を使用する（なければ作成）
+
+	@param root_dir: アプリケーションのルートディレクトリ
+	@param driver: ドライバ名
+	@return: 保存先ディレクトリ（書き込めない環境ではNone）
+	"""
+	key = (root_dir, driver)
+	if not key in _compile_dirs:
+		_compile_dirs[key] = _prepare_compile_dir(root_dir, driver)
+
+	return _compile_dirs[key]
+
+
+def _prepare_compile_dir(root_dir, driver):
+	""" コンパイル結果の保存先ディレクトリを用意（キャッシュ不使用版）
+
+	@param root_dir: アプリケーションのルートディレクトリ
+	@param driver: ドライバ名
+	@return: 保存先ディレクトリ（書き込めない環境ではNone）
+	"""
+	import os
+	compile_dir = os.path.join(root_dir, "tmp", "templates", driver)
+	try:
+		os.makedirs(compile_dir)
+
+	except OSError:
+		# 他のプロセスが先に作成した場合も含む
+		pass
+
+	if not os.access(compile_dir, os.W_OK):
+		# Google App Engine等、ファイルシステムに書き込めない環境
+		return None
+
+	return compile_dir
 
 
 def get_searchpath_list(base_dir, languages = ["ja"], template_type = "html", devices = ["default"]):
@@ -2,13 +2,17 @@
 
 
 class BaseTemplate(object):
-	""" テンプレートのベースクラス（renderを実装すること） """
+	""" テンプレートのベースクラス（_render/_generateを実装すること） """
+
+	# ストリーミング時に一度に出力する大きさの目安[文字]
+	CHUNK_SIZE = 16 * 1024
 
 	def __init__(self, encoding_output, encoding_error, filter_output):
 		self._vars = {}
 		self.__encoding_output = encoding_output
 		self.__encoding_error  = encoding_error
 		self.__filter_output = filter_output
+		self.__headers_only = False
 
 
 	def set_vars(self, **kwargs):
@@ -20,6 +24,26 @@ class BaseTemplate(object):
 		return self
 
 
+	def set_fragment_cache(self, cache, vary):
+		""" フラグメントキャッシュを設定
+
+		@param cache: 出力を保存するキャッシュオブジェクト（brocadefw.db.kvs.Cache）
+		@param vary: キーに含める情報（言語・デバイス・文字セット等）
+		"""
+		from ..fragmentcache import FragmentCache, VARIABLE_NAME
+		self._vars[VARIABLE_NAME] = FragmentCache(cache, vary)
+		return self
+
+
+	def set_headers_only(self, headers_only = True):
+		""" ヘッダのみモードを設定（HEADリクエスト用; 出力が不要なのでレンダリングしない）
+
+		@param headers_only: ヘッダのみモードならTrue
+		"""
+		self.__headers_only = headers_only
+		return self
+
+
 	def render(self, _filename, **kwargs):
 		""" テンプレートファイルの中身を出力（本体）
 
@@ -27,10 +51,55 @@ class BaseTemplate(object):
 		@param kwargs: 変数
 		@return: 出力
 		"""
+		if self.__headers_only:
+			return self.__empty()
+
 		self.set_vars(**kwargs)
 		return self._render(_filename)
 
 
+	def stream(self, _filename, **kwargs):
+		""" テンプレートファイルの中身を少しずつ出力
+		出力結果に適用するフィルタは文書全体を対象としたものなので、ストリーミング時には適用しない
+
+		@param _filename: テンプレートファイル
+		@param kwargs: 変数
+		@return: 出力のイテレータ
+		"""
+		if self.__headers_only:
+			return iter(())
+
+		self.set_vars(**kwargs)
+		return self._output_chunks(self._generate(_filename))
+
+
+	def _output_chunks(self, chunks):
+		""" 入力データを少しずつ出力エンコーディングに変換
+
+		@param chunks: 入力データのイテレータ
+		@return: 出力結果のジェネレータ
+		"""
+		encoding_output = self.__encoding_output
+		if encoding_output == None:
+			for chunk in chunks:
+				if len(chunk) > 0:
+					yield chunk
+
+			return
+
+		# ステートフルなエンコーディング（ISO-2022-JP等）があるので、インクリメンタルエンコーダを使う
+		from codecs import getincrementalencoder
+		encoder = getincrementalencoder(encoding_output)(self.__encoding_error)
+		for chunk in chunks:
+			data = encoder.encode(chunk)
+			if len(data) > 0:
+				yield data
+
+		data = encoder.encode("", True)
+		if len(data) > 0:
+			yield data
+
+
 	def _output(self, data):
 		""" 入力データにフィルタを適用し、出力エンコーディングに変換
 
@@ -46,6 +115,17 @@ class BaseTemplate(object):
 		return data
 
 
+	def __empty(self):
+		""" 空の出力を取得
+
+		@return: 空の出力（出力エンコーディングがあればバイト列、なければUnicode文字列）
+		"""
+		if self.__encoding_output == None:
+			return u""
+
+		return b""
+
+
 	def _render(self, filename):
 		""" テンプレートファイルの中身を出力（本体）
 
@@ -53,3 +133,69 @@ class BaseTemplate(object):
 		@return: 出力
 		"""
 		raise NotImplementedError("BaseTemplate._render")
+
+
+	def _generate(self, filename):
+		""" テンプレートファイルの中身を少しずつ出力（本体）
+
+		@param filename: テンプレートファイル
+		@return: 出力（Unicode文字列）のイテレータ
+		"""
+		raise NotImplementedError("BaseTemplate._generate")
+
+
+def _filter_static(text, code_regex, filter_source):
+	""" テンプレートの静的な部分だけにフィルタを適用
+	コード部分は一旦プレースホルダに置き換えておき、フィルタ適用後に元に戻す
+
+	@param text: テンプレートのソース
+	@param code_regex: コード部分にマッチする正規表現
+	@param filter_source: フィルタ
+	@return: フィルタ適用後のソース（コード部分が失われる場合は元のソース）
+	"""
+	import re
+	codes = []
+	def _stash(match):
+		codes.append(match.group(0))
+		return "\x00{index}\x00".format(index = len(codes) - 1)
+
+	filtered = filter_source(code_regex.sub(_stash, text))
+
+	# コメント内の制御文等、フィルタでコードが消えてしまったら適用しない
+	indexes = re.findall("\x00([0-9]+)\x00", filtered)
+	if indexes != [str(index) for index in range(len(codes))]:
+		return text
+
+	return re.sub("\x00([0-9]+)\x00", lambda match: codes[int(match.group(1))], filtered)
+
+
+def _filter_id(filter_source):
+	""" フィルタの識別子を取得（コンパイル結果の保存先を分けるために使う）
+
+	@param filter_source: フィルタ
+	@return: 識別子
+	"""
+	from hashlib import md5
+	name = "{module}.{name}".format(module = filter_source.__module__, name = filter_source.__name__)
+	return md5(name.encode("utf-8")).hexdigest()[:8]
+
+
+def _join_chunks(pieces, chunk_size):
+	""" 細切れの文字列をある程度の大きさにまとめる
+
+	@param pieces: 文字列のイテレータ
+	@param chunk_size: まとめる大きさの目安[文字]
+	@return: まとめた文字列のジェネレータ
+	"""
+	buffer = []
+	size = 0
+	for piece in pieces:
+		buffer.append(piece)
+		size += len(piece)
+		if size >= chunk_size:
+			yield "".join(buffer)
+			buffer = []
+			size = 0
+
+	if len(buffer) > 0:
+		yield "".join(buffer)
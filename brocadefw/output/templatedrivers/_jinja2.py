@@ -5,32 +5,211 @@
 @see: https://pypi.python.org/pypi/Jinja2
 """
 
-from . import BaseTemplate
+from . import BaseTemplate, _join_chunks, _filter_static, _filter_id
+from .. import fragmentcache
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+class _cre:
+	""" コンパイル済み正規表現 """
+	import re
+
+	# コード部分（式・文・コメント）
+	code = re.compile(r"\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}", re.S)
+
+
+def create_lookup(searchpath, compile_dir, encoding_input, encoding_output, encoding_error, params, index = None, filter_source = None):
+	""" テンプレート検索オブジェクト（Environment）を生成
+
+	@param searchpath: 検索パスリスト
+	@param compile_dir: コンパイル結果の保存先ディレクトリ
+	@param encoding_input: 入力エンコード（ファイル）
+	@param encoding_output: 出力エンコード
+	@param encoding_error: 出力エンコードエラー時の対処法
+	@param params: テンプレートエンジンに渡すパラメータ
+	@param index: テンプレートの索引（省略時は検索パスを順にstatして探す）
+	@param filter_source: コンパイル時にテンプレートの静的な部分に適用するフィルタ
+	@return: テンプレート検索オブジェクト
+	"""
+	from jinja2.environment import Environment
+	from jinja2.loaders import FileSystemLoader
+
+	if index != None:
+		loader = _create_indexed_loader(index, searchpath, encoding_input)
+	else:
+		loader = FileSystemLoader(searchpath, encoding = encoding_input)
+
+	params_ = {
+		"loader"    : loader,
+		"extensions": [FragmentCacheExtension],
+	}
+
+	if filter_source != None:
+		params_["extensions"] = params_["extensions"] + [_create_source_filter_extension(filter_source)]
+
+	if compile_dir != None:
+		params_["bytecode_cache"] = _create_bytecode_cache(compile_dir, filter_source)
+
+	params_.update(params)
+
+	return Environment(**params_)
+
+
+class FragmentCacheExtension(Extension):
+	""" 囲んだ部分の出力をフラグメントキャッシュに保存するタグ
+
+	{% cache "sidebar", 60 %}...{% endcache %}
+	（第1引数はキー、第2引数は有効期間[sec]で省略可能）
+	"""
+
+	tags = set(["cache"])
+
+	def parse(self, parser):
+		lineno = next(parser.stream).lineno
+
+		args = [nodes.ContextReference(), parser.parse_expression()]
+		if parser.stream.skip_if("comma"):
+			args.append(parser.parse_expression())
+		else:
+			args.append(nodes.Const(None))
+
+		body = parser.parse_statements(["name:endcache"], drop_needle = True)
+		return nodes.CallBlock(self.call_method("_cache_support", args), [], [], body).set_lineno(lineno)
+
+
+	def _cache_support(self, context, key, lifetime, caller):
+		""" フラグメントキャッシュから出力を取得（なければ生成して保存） """
+		fragment_cache = context.get(fragmentcache.VARIABLE_NAME)
+		return fragmentcache.get_or_create(fragment_cache, ("jinja2", key), caller, lifetime)
+
+
+def _create_indexed_loader(index, searchpath, encoding_input):
+	""" 索引を使ってテンプレートを探すローダを生成
+
+	@param index: テンプレートの索引
+	@param searchpath: 検索パスリスト
+	@param encoding_input: 入力エンコード（ファイル）
+	@return: ローダ
+	"""
+	from os import path
+	from jinja2.exceptions import TemplateNotFound
+	from jinja2.loaders import FileSystemLoader
+
+	class IndexedFileSystemLoader(FileSystemLoader):
+		""" 索引を使ってテンプレートを探すローダ """
+
+		def get_source(self, environment, template):
+			searchpath = tuple(self.searchpath)
+			filename = index.resolve(searchpath, template)
+			if filename == None:
+				raise TemplateNotFound(template)
+
+			with open(filename, "rb") as f:
+				contents = f.read().decode(self.encoding)
+
+			generation = index.generation()
+			mtime = path.getmtime(filename)
+			def uptodate():
+				# ファイルの追加・削除があれば、より優先度の高いテンプレートができたかもしれないので読み直す
+				try:
+					return index.generation() == generation and path.getmtime(filename) == mtime
+
+				except OSError:
+					return False
+
+			return (contents, filename, uptodate)
+
+	return IndexedFileSystemLoader(searchpath, encoding = encoding_input)
+
+
+def _create_source_filter_extension(filter_source):
+	""" コンパイル時にテンプレートの静的な部分にフィルタを適用する拡張を生成
+
+	@param filter_source: フィルタ
+	@return: 拡張クラス
+	"""
+	class SourceFilterExtension(Extension):
+		""" コンパイル時にテンプレートの静的な部分にフィルタを適用する拡張 """
+
+		def preprocess(self, source, name, filename = None):
+			return _filter_static(source, _cre.code, filter_source)
+
+	return SourceFilterExtension
+
+
+def _create_bytecode_cache(compile_dir, filter_source = None):
+	""" コンパイル結果をファイルに保存するバイトコードキャッシュを生成
+
+	@param compile_dir: コンパイル結果の保存先ディレクトリ
+	@param filter_source: コンパイル時にテンプレートの静的な部分に適用するフィルタ
+	@return: バイトコードキャッシュ
+	"""
+	import os, sys, tempfile
+	from jinja2.bccache import FileSystemBytecodeCache
+
+	class AtomicFileSystemBytecodeCache(FileSystemBytecodeCache):
+		""" 一時ファイル経由でアトミックに書き込むバイトコードキャッシュ
+		（複数のワーカープロセスが同時に書き込んでも、書きかけのファイルを読み込むことがない）
+		"""
+
+		def dump_bytecode(self, bucket):
+			filename = self._get_cache_filename(bucket)
+			(fd, tmpname) = tempfile.mkstemp(dir = self.directory)
+			try:
+				with os.fdopen(fd, "wb") as f:
+					bucket.write_bytecode(f)
+
+				# mkstempで作ったファイルは0600なので、デプロイ時に別ユーザで作ってもワーカーが読めるようにする
+				os.chmod(tmpname, 0o644)
+				if hasattr(os, "replace"):
+					os.replace(tmpname, filename)
+				else:
+					os.rename(tmpname, filename)
+
+			except:
+				os.remove(tmpname)
+				raise
+
+	# バイトコードはPythonのバージョンごとに互換性がないので、ファイル名にバージョンを含める
+	# （キャッシュはテンプレートのチェックサムと照合され、テンプレートが更新されていれば無効となる）
+	pattern = "%s.py{major}{minor}.cache".format(major = sys.version_info[0], minor = sys.version_info[1])
+	if filter_source != None:
+		# チェックサムはフィルタ適用前のテンプレートで計算されるので、フィルタを適用したものは別ファイルにする
+		pattern = "%s." + _filter_id(filter_source) + pattern[2:]
+	return AtomicFileSystemBytecodeCache(compile_dir, pattern)
+
+
+def compile_template(lookup, filename):
+	""" テンプレートをコンパイル（レンダリングはしない）
+
+	@param lookup: テンプレート検索オブジェクト（create_lookupで生成したもの）
+	@param filename: テンプレートファイル
+	"""
+	lookup.get_template(filename)
+
 
 class Template(BaseTemplate):
 	""" テンプレートクラス """
 
-	def __init__(self, searchpath, compile_dir, encoding_input, encoding_output, encoding_error, filter_output, params):
+	def __init__(self, lookup, encoding_output, encoding_error, filter_output):
 		""" コンストラクタ
 
-		@param searchpath: 検索パスリスト
-		@param compile_dir: コンパイル結果の保存先ディレクトリ
-		@param encoding_input: 入力エンコード（ファイル）
+		@param lookup: テンプレート検索オブジェクト（create_lookupで生成したもの）
 		@param encoding_output: 出力エンコード
 		@param encoding_error: 出力エンコードエラー時の対処法
 		@param filter_output: 出力結果に適用するフィルタ
-		@param params: テンプレートエンジンに渡すパラメータ
-		@return: テンプレート検索オブジェクト
 		"""
-		from jinja2.environment import Environment
-		from jinja2.loaders import FileSystemLoader
-
 		super(Template, self).__init__(encoding_output, encoding_error, filter_output)
 
-		self._env = Environment(loader = FileSystemLoader(searchpath, encoding = encoding_input))
+		self._env = lookup
 
 
 	def _render(self, filename):
 		template = self._env.get_template(filename)
 		data = template.render(self._vars)
 		return self._output(data)
+
+
+	def _generate(self, filename):
+		template = self._env.get_template(filename)
+		return _join_chunks(template.generate(self._vars), self.CHUNK_SIZE)
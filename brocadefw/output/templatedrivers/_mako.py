@@ -5,45 +5,260 @@
 @see: https://pypi.python.org/pypi/Mako
 """
 
-from . import BaseTemplate
+from . import BaseTemplate, _filter_static, _filter_id
+from .. import fragmentcache
+from mako.cache import CacheImpl, register_plugin
+from mako.lookup import TemplateLookup
+
+class _cre:
+	""" コンパイル済み正規表現 """
+	import re
+
+	# コード部分（doc/textタグ、Pythonブロック、その他のタグ、式、制御行・コメント行、行継続）
+	# 制御行は前後の改行も含める（ミニファイで改行が消えると制御行として認識されなくなるため）
+	code = re.compile(r"""
+		<%(doc|text)\b.*?</%\1>
+		| <%(?![\w/]).*?%>
+		| </?%[\w.:]+(?:"[^"]*"|'[^']*'|[^>"'])*>
+		| \$\{(?:[^{}]|\{[^{}]*\})*\}
+		| \n?^[ \t]*(?:%(?!%)|\#\#)[^\n]*(?:\n|$)
+		| \\\n
+	""", re.S | re.M | re.X)
+
+
+def create_lookup(searchpath, compile_dir, encoding_input, encoding_output, encoding_error, params, index = None, filter_source = None):
+	""" テンプレート検索オブジェクトを生成
+
+	@param searchpath: 検索パスリスト
+	@param compile_dir: コンパイル結果の保存先ディレクトリ
+	@param encoding_input: 入力エンコード（ファイル）
+	@param encoding_output: 出力エンコード
+	@param encoding_error: 出力エンコードエラー時の対処法
+	@param params: テンプレートエンジンに渡すパラメータ
+	@param index: テンプレートの索引（省略時は検索パスを順にstatして探す）
+	@param filter_source: コンパイル時にテンプレートの静的な部分に適用するフィルタ
+	@return: テンプレート検索オブジェクト
+	"""
+	params_ = {
+		"directories"    : searchpath,
+		"input_encoding" : encoding_input,
+		"output_encoding": encoding_output,
+		"encoding_errors": encoding_error,
+		"cache_impl"     : "brocadefw",
+	}
+
+	if compile_dir != None:
+		# 言語・デバイスが違えばURIが同じでも別ファイルなので、ファイルのフルパスからモジュール名を決める
+		# （モジュールファイルは一時ファイル経由でアトミックに書き込まれ、テンプレートの更新日時が新しければ再コンパイルされる）
+		from hashlib import md5
+		from os.path import join
+		prefix = ""
+		if filter_source != None:
+			# フィルタを適用したものは別ファイルにする
+			prefix = _filter_id(filter_source) + "|"
+
+		params_["modulename_callable"] = lambda filename, uri: join(compile_dir, md5((prefix + filename).encode()).hexdigest() + ".py")
+		params_["module_writer"] = _write_module
+
+	if filter_source != None:
+		params_["preprocessor"] = lambda text: _filter_static(text, _cre.code, filter_source)
+
+	params_.update(params)
+
+	if index != None:
+		return _IndexedTemplateLookup(index, **params_)
+
+	return TemplateLookup(**params_)
+
+
+def _write_module(source, outputpath):
+	""" コンパイル結果のモジュールファイルを一時ファイル経由でアトミックに書き込む
+	（Makoの既定の書き込み方法ではパーミッションが0600になり、デプロイ時に別ユーザでコンパイルしたものをワーカーが読めない）
+
+	@param source: モジュールのソース（バイト列）
+	@param outputpath: 保存先のファイルパス
+	"""
+	import os, tempfile
+	(fd, tmpname) = tempfile.mkstemp(dir = os.path.dirname(outputpath))
+	try:
+		with os.fdopen(fd, "wb") as f:
+			f.write(source)
+
+		os.chmod(tmpname, 0o644)
+		if hasattr(os, "replace"):
+			os.replace(tmpname, outputpath)
+		else:
+			os.rename(tmpname, outputpath)
+
+	except:
+		os.remove(tmpname)
+		raise
+
+
+class _FragmentCacheImpl(CacheImpl):
+	""" cached="True"を指定したブロックの出力をフラグメントキャッシュに保存する
+	（cache_timeoutで有効期間[sec]を指定できる）
+	"""
+
+	# テンプレート変数からフラグメントキャッシュを取得するため、コンテキストを受け取る
+	pass_context = True
+
+	def get_or_create(self, key, creation_function, **kw):
+		return fragmentcache.get_or_create(self.__fragment_cache(kw), self.__key(key), creation_function, kw.get("timeout"))
+
+	def set(self, key, value, **kw):
+		fragment_cache = self.__fragment_cache(kw)
+		if fragment_cache != None:
+			fragment_cache.set(self.__key(key), value, kw.get("timeout"))
+
+	def get(self, key, **kw):
+		fragment_cache = self.__fragment_cache(kw)
+		if fragment_cache == None:
+			return None
+
+		return fragment_cache.get(self.__key(key))
+
+	def invalidate(self, key, **kw):
+		fragment_cache = self.__fragment_cache(kw)
+		if fragment_cache != None:
+			fragment_cache.delete(self.__key(key))
+
+	def __key(self, key):
+		""" テンプレートごとに別のキーにする """
+		return (self.cache.id, self.cache.starttime, key)
+
+	@staticmethod
+	def __fragment_cache(kw):
+		""" テンプレート変数からフラグメントキャッシュを取得 """
+		context = kw.get("context")
+		if context == None:
+			return None
+
+		return context.get(fragmentcache.VARIABLE_NAME)
+
+
+register_plugin("brocadefw", __name__, "_FragmentCacheImpl")
+
+
+class _IndexedTemplateLookup(TemplateLookup):
+	""" 索引を使ってテンプレートを探す検索オブジェクト """
+
+	def __init__(self, index, **kwargs):
+		""" コンストラクタ
+
+		@param index: テンプレートの索引
+		@param kwargs: TemplateLookupに渡すパラメータ
+		"""
+		super(_IndexedTemplateLookup, self).__init__(**kwargs)
+		self.__index = index
+		self.__searchpath = tuple(kwargs["directories"])
+		self.__generation = index.generation()
+
+
+	def get_template(self, uri):
+		index = self.__index
+		generation = index.generation()
+		if generation != self.__generation:
+			# ファイルの追加・削除があれば、より優先度の高いテンプレートができたかもしれないので読み直す
+			self._collection.clear()
+			self.__generation = generation
+
+		if uri in self._collection:
+			return super(_IndexedTemplateLookup, self).get_template(uri)
+
+		srcfile = index.resolve(self.__searchpath, uri)
+		if srcfile == None:
+			from mako import exceptions
+			raise exceptions.TopLevelLookupException("Cant locate template for uri %r" % uri)
+
+		return self._load(srcfile, uri)
+
+
+def compile_template(lookup, filename):
+	""" テンプレートをコンパイル（レンダリングはしない）
+
+	@param lookup: テンプレート検索オブジェクト（create_lookupで生成したもの）
+	@param filename: テンプレートファイル
+	"""
+	lookup.get_template(filename)
+
 
 class Template(BaseTemplate):
 	""" テンプレートクラス """
 
-	def __init__(self, searchpath, compile_dir, encoding_input, encoding_output, encoding_error, filter_output, params):
+	def __init__(self, lookup, encoding_output, encoding_error, filter_output):
 		""" コンストラクタ
 
-		@param searchpath: 検索パスリスト
-		@param compile_dir: コンパイル結果の保存先ディレクトリ
-		@param encoding_input: 入力エンコード（ファイル）
+		@param lookup: テンプレート検索オブジェクト（create_lookupで生成したもの）
 		@param encoding_output: 出力エンコード
 		@param encoding_error: 出力エンコードエラー時の対処法
 		@param filter_output: 出力結果に適用するフィルタ
-		@param params: テンプレートエンジンに渡すパラメータ
-		@return: テンプレート検索オブジェクト
 		"""
-		from mako.lookup import TemplateLookup
-
 		super(Template, self).__init__(encoding_output, encoding_error, filter_output)
 
-		params_ = {
-			"directories"    : searchpath,
-			"input_encoding" : encoding_input,
-			"output_encoding": encoding_output,
-			"encoding_errors": encoding_error,
-		}
-
-		if compile_dir != None:
-			from hashlib import md5
-			from os.path import join
-			params_["modulename_callable"] = lambda filename, uri: join(compile_dir, md5(filename.encode()).hexdigest() + ".py")
-
-		params_.update(params)
-
-		self.__lookup = TemplateLookup(**params_)
+		self.__lookup = lookup
 
 
 	def _render(self, filename):
 		template = self.__lookup.get_template(filename)
 		data = template.render_unicode(**self._vars)
 		return self._output(data)
+
+
+	def _generate(self, filename):
+		from mako.runtime import Context
+
+		# Makoはテンプレート全体を一度に出力するので、一定サイズごとに区切って保持しておく
+		template = self.__lookup.get_template(filename)
+		writer = _ChunkWriter(self.CHUNK_SIZE)
+		context = Context(writer, **self._vars)
+		context._outputting_as_unicode = True
+		template.render_context(context)
+		return writer.chunks()
+
+
+class _ChunkWriter(object):
+	""" 書き込まれた文字列を一定サイズごとに区切って保持するバッファ """
+
+	def __init__(self, chunk_size):
+		""" コンストラクタ
+
+		@param chunk_size: 区切る大きさの目安[文字]
+		"""
+		from collections import deque
+		self.__chunk_size = chunk_size
+		self.__chunks = deque()
+		self.__pieces = []
+		self.__size = 0
+
+
+	def write(self, text):
+		""" 文字列を書き込む
+
+		@param text: 文字列
+		"""
+		self.__pieces.append(text)
+		self.__size += len(text)
+		if self.__size >= self.__chunk_size:
+			self.__flush()
+
+
+	def chunks(self):
+		""" 区切った文字列を取り出す（取り出したものはバッファから削除）
+
+		@return: 文字列のジェネレータ
+		"""
+		self.__flush()
+		chunks = self.__chunks
+		while len(chunks) > 0:
+			yield chunks.popleft()
+
+
+	def __flush(self):
+		""" 書き込まれた文字列を1つにまとめる """
+		if len(self.__pieces) == 0:
+			return
+
+		self.__chunks.append("".join(self.__pieces))
+		self.__pieces = []
+		self.__size = 0
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+""" テンプレートの索引
+
+"[言語]/[テンプレートタイプ]/[デバイス]/" 以下のファイル一覧をあらかじめ作成しておき、
+テンプレートを探す際に検索パスのディレクトリを1つずつstatする代わりに辞書を引くだけで済ませる
+
+@author: shimataro
+"""
+
+from ..db import kvs
+
+# 検索結果を記憶しておく最大件数（検索パスはクライアントのAccept-Languageで変わるので上限を設ける）
+RESOLVED_CACHE_SIZE = 1024
+
+# 検索結果のキャッシュにない場合の値（見つからなかった結果のNoneと区別する）
+_NOT_CACHED = object()
+
+
+class TemplateIndex(object):
+	""" テンプレートの索引 """
+
+	def __init__(self, base_dir, interval = 2):
+		""" コンストラクタ（索引を作成）
+
+		@param base_dir: テンプレートのベースディレクトリ
+		@param interval: ディレクトリの更新をチェックする間隔[sec]
+		"""
+		from threading import Lock
+		self.__base_dir = base_dir
+		self.__interval = interval
+		self.__lock = Lock()
+		self.__generation = 0
+		self.__checked = 0
+		self.__mtimes = {}
+		self.__files = {}
+		self.__resolved = kvs.LRUCache(RESOLVED_CACHE_SIZE)
+		self.build()
+
+
+	def build(self):
+		""" 索引を作成し直す """
+		import os
+		from time import time
+
+		mtimes = {}
+		files = {}
+		for searchdir in _listdirs(self.__base_dir, 3):
+			names = {}
+			for dirpath, dirnames, filenames in os.walk(searchdir):
+				dirnames[:] = [name for name in dirnames if not name.startswith(".")]
+				mtimes[dirpath] = _getmtime(dirpath)
+				for filename in filenames:
+					if filename.startswith("."):
+						continue
+
+					path = os.path.join(dirpath, filename)
+					names[os.path.relpath(path, searchdir).replace(os.sep, "/")] = path
+
+			files[searchdir] = names
+
+		with self.__lock:
+			self.__mtimes = mtimes
+			self.__files = files
+			self.__resolved = kvs.LRUCache(RESOLVED_CACHE_SIZE)
+			self.__generation += 1
+			self.__checked = time()
+
+
+	def generation(self):
+		""" 索引の世代番号を取得（作成し直すたびに増える）
+
+		@return: 世代番号
+		"""
+		self.__poll()
+		return self.__generation
+
+
+	def items(self):
+		""" 索引に含まれる全テンプレートを取得
+
+		@return: (検索パス, テンプレート名)のリスト
+		"""
+		files = self.__files
+		return [(searchdir, name) for searchdir in sorted(files) for name in sorted(files[searchdir])]
+
+
+	def resolve(self, searchpath, name):
+		""" テンプレートのファイルパスを取得
+
+		@param searchpath: 検索パス（タプル）
+		@param name: テンプレート名
+		@return: ファイルパス（見つからなければNone）
+		"""
+		self.__poll()
+
+		key = (searchpath, name)
+		resolved = self.__resolved
+		path = resolved.get(key, _NOT_CACHED)
+		if path is not _NOT_CACHED:
+			return path
+
+		name_ = name.lstrip("/")
+		path = None
+		for directory in searchpath:
+			names = self.__files.get(directory)
+			if names != None and name_ in names:
+				path = names[name_]
+				break
+
+		resolved.set(key, path)
+		return path
+
+
+	def __poll(self):
+		""" 前回のチェックから一定時間経過していれば、ディレクトリの更新をチェック """
+		from time import time
+		now = time()
+		if now - self.__checked < self.__interval:
+			return
+
+		with self.__lock:
+			if now - self.__checked < self.__interval:
+				# 他のスレッドがチェック済み
+				return
+
+			self.__checked = now
+			mtimes = self.__mtimes
+
+		# ファイルの追加・削除があればディレクトリの更新日時が変わる
+		for directory in mtimes:
+			if _getmtime(directory) != mtimes[directory]:
+				self.build()
+				return
+
+
+# ベースディレクトリごとの索引
+_indexes = {}
+
+def get_index(base_dir):
+	""" 索引を取得（なければ作成）
+
+	@param base_dir: テンプレートのベースディレクトリ
+	@return: 索引
+	"""
+	if not base_dir in _indexes:
+		_indexes[base_dir] = TemplateIndex(base_dir)
+
+	return _indexes[base_dir]
+
+
+def _getmtime(path):
+	""" 更新日時を取得
+
+	@param path: パス
+	@return: 更新日時（取得できなければNone）
+	"""
+	from os.path import getmtime
+	try:
+		return getmtime(path)
+
+	except OSError:
+		return None
+
+
+def _listdirs(base_dir, depth):
+	""" 指定の深さにあるディレクトリを列挙
+
+	@param base_dir: ベースディレクトリ
+	@param depth: 深さ
+	@return: ディレクトリのリスト
+	"""
+	import os
+	if depth == 0:
+		return [base_dir]
+
+	result = []
+	if not os.path.isdir(base_dir):
+		return result
+
+	for name in sorted(os.listdir(base_dir)):
+		path = os.path.join(base_dir, name)
+		if name.startswith(".") or not os.path.isdir(path):
+			continue
+
+		result += _listdirs(path, depth - 1)
+
+	return result
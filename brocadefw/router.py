@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+""" URLルータ
+
+マッピングの正規表現を1つずつ順に試す代わりに、以下の方法でまとめて照合する
+* 正規表現を含まないパターン（"^/$"等）は辞書を引く
+* それ以外は全パターンを1つの正規表現にまとめて1回で照合する
+* 最近照合したパスの結果はLRU方式で記憶しておく
+どの方法でも、先に指定したパターンが優先されるという挙動は変わらない
+
+@author: shimataro
+"""
+
+if __name__ == "__main__":
+	from db import kvs
+else:
+	from .db import kvs
+
+
+class _cre:
+	""" コンパイル済み正規表現 """
+	import re
+
+	# 正規表現を含まないパターン
+	literal = re.compile(r"^\^((?:[^\\.^$*+?{}\[\]|()]|\\[^A-Za-z0-9])*)\$$")
+	# エスケープされた文字
+	escaped = re.compile(r"\\(.)")
+	# 1つにまとめられないパターン（後方参照・条件・パターン全体へのフラグ）
+	unsafe  = re.compile(r"\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)")
+
+
+class Router(object):
+	""" URLルータ """
+
+	def __init__(self, patterns, cache_size = 1024):
+		""" コンストラクタ
+
+		@param patterns: 正規表現のリスト（先に指定したものを優先）
+		@param cache_size: 照合結果を記憶しておくパスの最大数
+		"""
+		import re
+		compiled = [re.compile(pattern) for pattern in patterns]
+
+		# 正規表現を含まないパターンは辞書で引く（ただし、前に正規表現のパターンがあれば、そちらが優先されるかもしれないので対象外）
+		literals = {}
+		for index, pattern in enumerate(patterns):
+			match = _cre.literal.match(pattern)
+			if match == None:
+				break
+
+			path = _cre.escaped.sub(r"\1", match.group(1))
+			if not path in literals:
+				literals[path] = index
+
+		self.__compiled = compiled
+		self.__literals = literals
+		self.__combined = self.__combine(patterns, compiled)
+		self.__cache = kvs.LRUCache(cache_size)
+
+
+	def match(self, uri):
+		""" URIにマッチしたパターンを取得
+
+		@param uri: リクエストされたURI（クエリストリングなし）
+		@return: (パターンのインデックス, キャプチャパターン, 名前付きキャプチャパターン)（マッチしなければNone）
+		"""
+		cached = self.__cache.get(uri)
+		if cached != None:
+			return cached[0]
+
+		result = self.__match(uri)
+		self.__cache.set(uri, (result, ))
+		return result
+
+
+	def __match(self, uri):
+		""" URIにマッチしたパターンを取得（キャッシュ不使用版）
+
+		@param uri: リクエストされたURI（クエリストリングなし）
+		@return: (パターンのインデックス, キャプチャパターン, 名前付きキャプチャパターン)（マッチしなければNone）
+		"""
+		if uri in self.__literals:
+			return (self.__literals[uri], (), {})
+
+		if self.__combined != None:
+			# まとめた正規表現で照合
+			(regex, routes) = self.__combined
+			m = regex.match(uri)
+			if m == None:
+				return None
+
+			(index, offset, count, names) = routes[m.lastindex]
+			groups = m.groups()[offset:offset + count]
+			groupdict = dict((name, m.group(name)) for name in names)
+			return (index, groups, groupdict)
+
+		# まとめられなければ順に照合
+		for index, pattern_c in enumerate(self.__compiled):
+			m = pattern_c.match(uri)
+			if m != None:
+				return (index, m.groups(), m.groupdict())
+
+		return None
+
+
+	@staticmethod
+	def __combine(patterns, compiled):
+		""" 全パターンを1つの正規表現にまとめる
+
+		@param patterns: 正規表現のリスト
+		@param compiled: コンパイル済み正規表現のリスト
+		@return: (まとめた正規表現, {グループ番号: (インデックス, グループの開始位置, グループ数, グループ名一覧)})（まとめられなければNone）
+		"""
+		import re
+		if len(patterns) == 0:
+			return None
+
+		names = set()
+		pieces = []
+		routes = {}
+		group = 1
+		for index, pattern in enumerate(patterns):
+			pattern_c = compiled[index]
+			if _cre.unsafe.search(pattern) != None:
+				return None
+
+			# グループ名が重複していればまとめられない
+			groupnames = tuple(pattern_c.groupindex)
+			if len(names.intersection(groupnames)) > 0:
+				return None
+
+			names.update(groupnames)
+
+			# パターン全体を囲むグループの番号からどのパターンにマッチしたかを判定する
+			pieces.append("(" + pattern + ")")
+			routes[group] = (index, group, pattern_c.groups, groupnames)
+			group += 1 + pattern_c.groups
+
+		try:
+			return (re.compile("|".join(pieces)), routes)
+
+		except (re.error, AssertionError, OverflowError):
+			# グループ数の上限を超えた場合等
+			return None
+
+
+def _test():
+	""" テスト """
+	########################################
+	# 優先順位（まとめて照合しても、先に指定したパターンが優先される）
+	router = Router([r"^/$", r"^/hell$", r"^/a\.b$", r"^/(.*)$", r"^/hello$"])
+	assert router.match("/") == (0, (), {})
+	assert router.match("/hell") == (1, (), {})
+	assert router.match("/a.b") == (2, (), {})
+	assert router.match("/axb") == (3, ("axb", ), {})
+	assert router.match("/hello") == (3, ("hello", ), {})
+	assert router.match("") == None
+
+	# 正規表現のパターンより後にある、正規表現を含まないパターンは辞書で引かない
+	router = Router([r"^/(.*)$", r"^/hell$"])
+	assert router.match("/hell") == (0, ("hell", ), {})
+
+	########################################
+	# キャプチャパターン（他のパターンのグループが混ざらない）
+	router = Router([r"^/user/(\d+)$", r"^/item/(?P<id>\d+)/(\w+)$", r"^/(a)(b)?$"])
+	assert router.match("/user/12") == (0, ("12", ), {})
+	assert router.match("/item/5/x") == (1, ("5", "x"), {"id": "5"})
+	assert router.match("/a") == (2, ("a", None), {})
+	assert router.match("/ab") == (2, ("a", "b"), {})
+	assert router.match("/user/x") == None
+
+	# まとめられないパターン（後方参照・グループ名の重複）があれば順に照合する
+	router = Router([r"^/(\w)\1$", r"^/(\w+)$"])
+	assert router._Router__combined == None
+	assert router.match("/aa") == (0, ("a", ), {})
+	assert router.match("/ab") == (1, ("ab", ), {})
+	router = Router([r"^/(?P<id>\d)$", r"^/(\w+)$", r"^/x/(?P<id>\w+)$"])
+	assert router._Router__combined == None
+	assert router.match("/1") == (0, ("1", ), {"id": "1"})
+	assert router.match("/x/y") == (2, ("y", ), {"id": "y"})
+
+	########################################
+	# 照合結果はパスごとに記憶する（マッチしなかった結果も含む）
+	router = Router([r"^/$", r"^/(\d+)$"], 2)
+	cache = router._Router__cache
+	assert router.match("/1") == (1, ("1", ), {})
+	assert router.match("/x") == None
+	assert router.match("/1") == (1, ("1", ), {})
+	assert router.match("/x") == None
+	assert cache.stats() == {"hits": 2, "misses": 2, "size": 2, "maxsize": 2}
+
+	print("OK")
+
+
+if __name__ == "__main__":
+	_test()
@@ -0,0 +1,512 @@
+# -*- coding: utf-8 -*-
+""" 本番用のWSGIサーバ（標準ライブラリのみ使用; forkを使うのでUnix専用）
+
+マスタプロセスで待ち受けソケットを作成してからワーカプロセスをforkし、
+各ワーカは共有したソケットからacceptしてスレッドプールでリクエストを処理する。
+アプリケーションをfork前に作成しておけば（プリロード）、読み込み済みのハンドラモジュールや
+テンプレートの索引はコピーオンライトでワーカ間で共有される
+
+シグナル:
+* SIGHUP: 新しいワーカを起動し、古いワーカは処理中のリクエストを終えてから終了させる（グレースフルリロード）。
+  プリロードする場合はアプリケーションを作成し直すが、読み込み済みのモジュールは読み込み直さない
+  （コードの変更を反映させるならプリロードしないこと）
+* SIGTERM, SIGINT: 全ワーカを処理中のリクエストを終えてから終了させ、マスタも終了する
+
+@author: shimataro
+"""
+
+from wsgiref.simple_server import WSGIRequestHandler
+
+
+def serve(factory, host = "", port = 8080, workers = None, threads = 8, max_requests = 0, preload = True, backlog = 128, graceful_timeout = 30):
+	""" サーバを起動（SIGTERM or SIGINTを受け取るまで戻らない）
+
+	@param factory: WSGIアプリケーションを作成する関数（引数なし）
+	@param host: ホスト名
+	@param port: 待機ポート
+	@param workers: ワーカプロセス数（NoneならCPU数）
+	@param threads: ワーカごとのスレッド数
+	@param max_requests: ワーカがこの数のリクエストを処理したら起動し直す（メモリリーク対策; 0なら起動し直さない）
+	@param preload: fork前にアプリケーションを作成するならTrue, ワーカごとに作成するならFalse
+	@param backlog: 待ち受けキューの長さ
+	@param graceful_timeout: 終了を指示したワーカを強制終了するまでの時間[sec]
+	"""
+	if workers == None:
+		from multiprocessing import cpu_count
+		workers = cpu_count()
+
+	sock = _listen(host, port, backlog)
+	try:
+		_Master(factory, sock, workers, threads, max_requests, preload, graceful_timeout).run()
+
+	finally:
+		sock.close()
+
+
+class _Master(object):
+	""" マスタプロセス（ワーカの起動・監視） """
+
+	def __init__(self, factory, sock, workers, threads, max_requests, preload, graceful_timeout):
+		""" コンストラクタ
+
+		@param factory: WSGIアプリケーションを作成する関数
+		@param sock: 待ち受けソケット
+		@param workers: ワーカプロセス数
+		@param threads: ワーカごとのスレッド数
+		@param max_requests: ワーカを起動し直すまでのリクエスト数
+		@param preload: fork前にアプリケーションを作成するか？
+		@param graceful_timeout: 終了を指示したワーカを強制終了するまでの時間[sec]
+		"""
+		self.__factory = factory
+		self.__socket = sock
+		self.__num_workers = workers
+		self.__threads = threads
+		self.__max_requests = max_requests
+		self.__preload = preload
+		self.__graceful_timeout = graceful_timeout
+
+		self.__application = None
+		self.__generation = 0
+		self.__workers = {}
+		self.__reload = False
+		self.__stop = False
+
+
+	def run(self):
+		""" ワーカを起動して監視（終了を指示されるまで戻らない） """
+		import signal
+		from time import sleep
+		if self.__preload:
+			self.__application = self.__factory()
+
+		signal.signal(signal.SIGHUP , self.__on_reload)
+		signal.signal(signal.SIGTERM, self.__on_stop)
+		signal.signal(signal.SIGINT , self.__on_stop)
+		_log("master {pid} listening on {address}".format(pid = _getpid(), address = self.__socket.getsockname()))
+
+		while True:
+			self.__reap()
+			if self.__stop:
+				break
+
+			if self.__reload:
+				self.__reload = False
+				self.__reload_workers()
+
+			self.__spawn_workers()
+			sleep(0.5)
+
+		self.__stop_workers()
+
+
+	def __on_reload(self, signum, frame):
+		""" SIGHUPハンドラ """
+		self.__reload = True
+
+
+	def __on_stop(self, signum, frame):
+		""" SIGTERM, SIGINTハンドラ """
+		self.__stop = True
+
+
+	def __reload_workers(self):
+		""" ワーカを新しい世代に入れ替え（新しいワーカを起動してから古いワーカを終了させる） """
+		import signal
+		if self.__preload:
+			try:
+				application = self.__factory()
+
+			except Exception:
+				# 作成できなければ今のアプリケーションで動かし続ける
+				_log_exception("failed to reload application")
+				return
+
+			self.__application = application
+
+		old_workers = list(self.__workers)
+		self.__generation += 1
+		self.__spawn_workers()
+		for pid in old_workers:
+			_kill(pid, signal.SIGTERM)
+
+		_log("master {pid} reloaded".format(pid = _getpid()))
+
+
+	def __spawn_workers(self):
+		""" 現世代のワーカが足りなければ起動 """
+		generation = self.__generation
+		count = len([pid for pid in self.__workers if self.__workers[pid] == generation])
+		for i in range(self.__num_workers - count):
+			self.__spawn()
+
+
+	def __spawn(self):
+		""" ワーカを1つ起動 """
+		import os
+		import random
+
+		# 全ワーカが同時に起動し直さないよう、上限を少しずらす（乱数の状態はforkで複製されるのでマスタで決める）
+		max_requests = self.__max_requests
+		if max_requests > 0:
+			max_requests += random.randint(0, max_requests // 10)
+
+		pid = os.fork()
+		if pid != 0:
+			# マスタ
+			self.__workers[pid] = self.__generation
+			return
+
+		# ワーカ
+		status = 0
+		try:
+			application = self.__application
+			if application == None:
+				application = self.__factory()
+
+			_Worker(application, self.__socket, self.__threads, max_requests).run()
+
+		except BaseException:
+			_log_exception("worker {pid} failed".format(pid = _getpid()))
+			status = 1
+
+		finally:
+			os._exit(status)
+
+
+	def __reap(self):
+		""" 終了したワーカを回収 """
+		import os
+		import errno
+		while len(self.__workers) > 0:
+			try:
+				(pid, status) = os.waitpid(-1, os.WNOHANG)
+
+			except OSError as e:
+				if e.errno == errno.EINTR:
+					continue
+				if e.errno == errno.ECHILD:
+					self.__workers.clear()
+					break
+				raise
+
+			if pid == 0:
+				break
+
+			self.__workers.pop(pid, None)
+
+
+	def __stop_workers(self):
+		""" 全ワーカを終了させて回収（時間内に終了しなければ強制終了） """
+		import signal
+		from time import time, sleep
+		for pid in self.__workers:
+			_kill(pid, signal.SIGTERM)
+
+		deadline = time() + self.__graceful_timeout
+		while len(self.__workers) > 0 and time() < deadline:
+			sleep(0.1)
+			self.__reap()
+
+		for pid in self.__workers:
+			_kill(pid, signal.SIGKILL)
+
+		while len(self.__workers) > 0:
+			sleep(0.1)
+			self.__reap()
+
+		_log("master {pid} stopped".format(pid = _getpid()))
+
+
+class _Worker(object):
+	""" ワーカプロセス（accept→スレッドプールでリクエスト処理）
+	wsgiref.simple_server.WSGIRequestHandlerから参照されるサーバとしても振る舞う
+	"""
+
+	def __init__(self, application, sock, threads, max_requests):
+		""" コンストラクタ
+
+		@param application: WSGIアプリケーション
+		@param sock: 待ち受けソケット
+		@param threads: スレッド数
+		@param max_requests: 終了するまでのリクエスト数（0なら無制限）
+		"""
+		import os
+		import socket
+		(host, port) = sock.getsockname()[:2]
+		self.__application = application
+		self.__socket = sock
+		self.__threads = threads
+		self.__max_requests = max_requests
+		self.__parent = os.getppid()
+		self.__running = True
+
+		# WSGIServer.setup_environ()と同じ内容
+		self.base_environ = {
+			"SERVER_NAME"      : socket.getfqdn(host),
+			"GATEWAY_INTERFACE": "CGI/1.1",
+			"SERVER_PORT"      : str(port),
+			"REMOTE_HOST"      : "",
+			"CONTENT_LENGTH"   : "",
+			"SCRIPT_NAME"      : "",
+		}
+
+
+	def get_app(self):
+		""" WSGIアプリケーションを取得（WSGIRequestHandlerから呼ばれる）
+
+		@return: WSGIアプリケーション
+		"""
+		return self.__application
+
+
+	def run(self):
+		""" リクエストを処理（終了を指示されるか、処理数が上限に達するまで戻らない） """
+		import os
+		import signal
+		signal.signal(signal.SIGHUP , signal.SIG_IGN)
+		signal.signal(signal.SIGTERM, self.__on_stop)
+		signal.signal(signal.SIGINT , self.__on_stop)
+		_log("worker {pid} started".format(pid = _getpid()))
+
+		pool = _ThreadPool(self.__threads, self.__handle)
+		count = 0
+		while self.__running:
+			if self.__max_requests > 0 and count >= self.__max_requests:
+				break
+
+			if os.getppid() != self.__parent:
+				# マスタが死んでいたら終了
+				break
+
+			# 空きスレッドがなければacceptせず、他のワーカに任せる
+			pool.acquire()
+			accepted = self.__accept()
+			if accepted == None:
+				pool.release()
+				continue
+
+			pool.submit(*accepted)
+			count += 1
+
+		# 処理中のリクエストを終えてから終了
+		pool.join()
+		_log("worker {pid} exiting after {count} requests".format(pid = _getpid(), count = count))
+
+
+	def __on_stop(self, signum, frame):
+		""" SIGTERM, SIGINTハンドラ """
+		self.__running = False
+
+
+	def __accept(self):
+		""" 接続を受け付ける
+
+		@return: (ソケット, クライアントアドレス)（一定時間接続がない or 他のワーカが受け付けた場合はNone）
+		"""
+		import errno
+		import select
+		import socket
+		sock = self.__socket
+		try:
+			(readable, writable, exceptional) = select.select([sock], [], [], 1.0)
+			if len(readable) == 0:
+				return None
+
+			(conn, address) = sock.accept()
+
+		except (select.error, socket.error) as e:
+			if e.args[0] in (errno.EINTR, errno.EAGAIN, errno.EWOULDBLOCK):
+				return None
+			raise
+
+		# 待ち受けソケットはノンブロッキングなので、接続ソケットはブロッキングに戻す
+		conn.setblocking(True)
+		return (conn, address)
+
+
+	def __handle(self, conn, address):
+		""" 1接続を処理（スレッドプールから呼ばれる）
+
+		@param conn: ソケット
+		@param address: クライアントアドレス
+		"""
+		import socket
+		try:
+			_RequestHandler(conn, address, self)
+
+		except Exception:
+			_log_exception("error while handling request from {address}".format(address = address))
+
+		finally:
+			try:
+				conn.shutdown(socket.SHUT_WR)
+
+			except socket.error:
+				pass
+
+			conn.close()
+
+
+class _ThreadPool(object):
+	""" 固定数のスレッドプール（空きスレッド数をセマフォで管理） """
+
+	def __init__(self, size, handle):
+		""" コンストラクタ
+
+		@param size: スレッド数
+		@param handle: 処理関数
+		"""
+		from threading import Semaphore, Thread
+		try:
+			# >= Python 3.0
+			from queue import Queue
+		except ImportError:
+			# < Python 3.0
+			from Queue import Queue
+
+		self.__handle = handle
+		self.__queue = Queue()
+		self.__slots = Semaphore(size)
+		self.__threads = [Thread(target = self.__run) for i in range(size)]
+		for thread in self.__threads:
+			thread.daemon = True
+			thread.start()
+
+
+	def acquire(self):
+		""" 空きスレッドを確保（空くまで待つ） """
+		self.__slots.acquire()
+
+
+	def release(self):
+		""" 確保した空きスレッドを使わずに返す """
+		self.__slots.release()
+
+
+	def submit(self, *args):
+		""" 確保した空きスレッドで処理を実行
+
+		@param args: 処理関数の引数
+		"""
+		self.__queue.put(args)
+
+
+	def join(self):
+		""" 全ての処理を終えてからスレッドを終了させる """
+		for thread in self.__threads:
+			self.__queue.put(None)
+
+		for thread in self.__threads:
+			thread.join()
+
+
+	def __run(self):
+		""" スレッドの本体 """
+		while True:
+			args = self.__queue.get()
+			if args == None:
+				return
+
+			try:
+				self.__handle(*args)
+
+			finally:
+				self.__slots.release()
+
+
+class _RequestHandler(WSGIRequestHandler):
+	""" リクエストハンドラ """
+
+	# 遅いクライアントにスレッドを占有されないよう、ソケットにタイムアウトを設定
+	timeout = 60
+
+	def handle(self):
+		""" 1つのリクエストを処理
+		（WSGIRequestHandler.handleはwsgi.multithread=Falseで処理するが、ワーカはスレッドプール・複数プロセスで処理する）
+		"""
+		from wsgiref.simple_server import ServerHandler
+		self.raw_requestline = self.rfile.readline(65537)
+		if len(self.raw_requestline) > 65536:
+			self.requestline = ""
+			self.request_version = ""
+			self.command = ""
+			self.send_error(414)
+			return
+
+		if not self.parse_request():
+			# エラーは送信済み
+			return
+
+		handler = ServerHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(), multithread = True, multiprocess = True)
+		handler.request_handler = self
+		handler.run(self.server.get_app())
+
+
+	def address_string(self):
+		""" ログに出力するクライアントアドレス（逆引きしない） """
+		return self.client_address[0]
+
+
+def _listen(host, port, backlog):
+	""" 待ち受けソケットを作成
+
+	@param host: ホスト名
+	@param port: 待機ポート
+	@param backlog: 待ち受けキューの長さ
+	@return: ソケット
+	"""
+	import socket
+	family = socket.AF_INET
+	if ":" in host:
+		family = socket.AF_INET6
+
+	sock = socket.socket(family, socket.SOCK_STREAM)
+	sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+	sock.bind((host, port))
+	sock.listen(backlog)
+
+	# 複数のワーカがacceptを競うので、負けたワーカがブロックしないようにノンブロッキングにする
+	sock.setblocking(False)
+	return sock
+
+
+def _kill(pid, signum):
+	""" プロセスにシグナルを送る（既に終了していれば何もしない）
+
+	@param pid: プロセスID
+	@param signum: シグナル
+	"""
+	import os
+	try:
+		os.kill(pid, signum)
+
+	except OSError:
+		pass
+
+
+def _getpid():
+	""" プロセスIDを取得
+
+	@return: プロセスID
+	"""
+	import os
+	return os.getpid()
+
+
+def _log(message):
+	""" ログを出力
+
+	@param message: メッセージ
+	"""
+	import sys
+	sys.stderr.write("[brocadefw.server] {message}\n".format(message = message))
+	sys.stderr.flush()
+
+
+def _log_exception(message):
+	""" 例外情報つきのログを出力
+
+	@param message: メッセージ
+	"""
+	import traceback
+	_log(message + "\n" + traceback.format_exc())
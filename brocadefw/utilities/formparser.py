@@ -0,0 +1,603 @@
+# -*- coding: utf-8 -*-
+""" フォームデータ（multipart/form-data, application/x-www-form-urlencoded）の解析
+
+リクエストボディを一定サイズずつ使い回しのバッファに読み込みながら解析する。
+アップロードファイルは読み込んだそばから書き込み先（デフォルトは一時ファイル）に書き出すので、
+大きなファイルがアップロードされてもメモリ使用量は増えない。
+サイズ・項目数の上限は読み込みながらチェックし、超えた時点でLimitExceededを送出する
+
+@author: shimataro
+"""
+
+import re
+
+try:
+	# >= Python 3.0
+	from urllib.parse import unquote_to_bytes
+except ImportError:
+	# < Python 3.0
+	from urllib import unquote as unquote_to_bytes
+
+# 一度に読み込むサイズ[byte]
+CHUNK_SIZE = 64 * 1024
+
+# multipartの各パートのヘッダの最大サイズ[byte]
+MAX_HEADER_SIZE = 8 * 1024
+
+# multipartの解析状態
+_STATE_PREAMBLE  = 0
+_STATE_DELIMITER = 1
+_STATE_HEADERS   = 2
+_STATE_BODY      = 3
+_STATE_END       = 4
+
+
+class _cre(object):
+	""" コンパイル済み正規表現 """
+	# ヘッダのパラメータ（; name="value" or ; name=value）
+	header_param = re.compile(r';\s*([^\s=;]+)\s*(?:=\s*("(?:[^"\\]|\\.)*"|[^;]*))?')
+
+	# デコード不要なクエリ文字列の値（ASCIIで、"%"(\x25)も"+"(\x2b)も含まない）
+	# （\uXXXXはPython 2のバイト列のパターンでは使えないので、ASCIIの範囲で書く）
+	query_plain = re.compile(r"^[\x00-\x24\x26-\x2a\x2c-\x7f]*$")
+
+	# ASCII以外の文字
+	non_ascii = re.compile(r"[^\x00-\x7f]")
+
+
+class LimitExceeded(ValueError):
+	""" サイズ・項目数が上限を超えた """
+	pass
+
+
+class UploadedFile(object):
+	""" アップロードファイル """
+
+	def __init__(self, name, filename, type, file):
+		""" コンストラクタ
+
+		@param name: パラメータ名
+		@param filename: クライアントから送られてきたファイル名
+		@param type: Content-Type
+		@param file: 内容を書き込んだファイルオブジェクト（先頭にシーク済み）
+		"""
+		self.name     = name
+		self.filename = filename
+		self.type     = type
+		self.file     = file
+
+
+class FormData(object):
+	""" 解析結果 """
+
+	def __init__(self):
+		""" コンストラクタ """
+		# パラメータ名→値のリスト
+		self.fields = {}
+
+		# パラメータ名→アップロードファイルのリスト
+		self.files = {}
+
+
+	def add_field(self, name, value):
+		""" 値を追加
+
+		@param name: パラメータ名
+		@param value: 値
+		"""
+		self.fields.setdefault(name, []).append(value)
+
+
+	def add_file(self, name, uploaded_file):
+		""" アップロードファイルを追加
+
+		@param name: パラメータ名
+		@param uploaded_file: アップロードファイル
+		"""
+		self.files.setdefault(name, []).append(uploaded_file)
+
+
+def parse(fp, content_type, length = None, max_content_length = None, max_memory_size = None, max_parts = None, file_factory = None, encoding = "utf-8"):
+	""" フォームデータを解析
+
+	@param fp: 入力ストリーム
+	@param content_type: Content-Type（フォームデータ以外なら何も読み込まない）
+	@param length: リクエストボディのサイズ（Noneなら終端まで読み込む）
+	@param max_content_length: リクエストボディの最大サイズ[byte]
+	@param max_memory_size: ファイル以外の値の合計の最大サイズ[byte]
+	@param max_parts: 最大項目数
+	@param file_factory: アップロードファイルの書き込み先を作成する関数（引数はパラメータ名, ファイル名, Content-Type; Noneなら一時ファイル）
+	@param encoding: 値の文字コード
+	@return: FormData
+	"""
+	form = FormData()
+	(mime_type, params) = parse_header(content_type)
+	if mime_type == "multipart/form-data":
+		boundary = params.get("boundary", "")
+		if len(boundary) == 0:
+			return form
+
+		parse_body = lambda chunks: _parse_multipart(chunks, boundary.encode("latin-1"), form, max_memory_size, max_parts, file_factory, params.get("charset", encoding))
+
+	elif mime_type == "application/x-www-form-urlencoded":
+		parse_body = lambda chunks: _parse_urlencoded(chunks, form, max_memory_size, max_parts, params.get("charset", encoding))
+
+	else:
+		return form
+
+	if length != None and max_content_length != None and length > max_content_length:
+		# 読み込む前に拒否
+		raise LimitExceeded("request body is too large")
+
+	parse_body(_read_chunks(fp, length, max_content_length))
+	return form
+
+
+def read_body(fp, length = None, max_content_length = None):
+	""" リクエストボディを全て読み込む
+
+	@param fp: 入力ストリーム
+	@param length: リクエストボディのサイズ（Noneなら終端まで読み込む）
+	@param max_content_length: リクエストボディの最大サイズ[byte]
+	@return: バイト列
+	"""
+	if length != None and max_content_length != None and length > max_content_length:
+		raise LimitExceeded("request body is too large")
+
+	data = bytearray()
+	for chunk in _read_chunks(fp, length, max_content_length):
+		data += chunk
+
+	return bytes(data)
+
+
+def parse_header(value):
+	""" Content-Type, Content-Disposition形式のヘッダ値を解析
+
+	@param value: ヘッダ値
+	@return: (値（小文字）, パラメータ名（小文字）→パラメータ値)
+	"""
+	index = value.find(";")
+	if index < 0:
+		return (value.strip().lower(), {})
+
+	params = {}
+	for match in _cre.header_param.finditer(value, index):
+		(name, param) = match.groups()
+		param = (param or "").strip()
+		if len(param) >= 2 and param[0] == param[-1] == '"':
+			# Windowsのパスを送ってくるブラウザもあるので、エスケープされた \ と " 以外はそのまま
+			param = param[1:-1].replace('\\\\', '\\').replace('\\"', '"')
+
+		params[name.lower()] = param
+
+	return (value[:index].strip().lower(), params)
+
+
+def decode_urlencoded(data, encoding = "utf-8"):
+	""" URLエンコードされた値をデコード
+
+	@param data: 値（バイト列）
+	@param encoding: 文字コード
+	@return: デコード結果（文字列）
+	"""
+	return unquote_to_bytes(bytes(data).replace(b"+", b" ")).decode(encoding, "replace")
+
+
+def split_query(query_string, max_parts = None):
+	""" クエリ文字列を分割（値はデコードしない）
+	値が1つだけの名前は値をそのまま、複数ある名前は値のリストを格納する
+
+	@param query_string: クエリ文字列
+	@param max_parts: 最大項目数（超えた分は無視する）
+	@return: 名前（デコード済み）→値（デコード前） or 値のリスト
+	"""
+	result = {}
+	if len(query_string) == 0:
+		return result
+
+	if max_parts == None:
+		pairs = query_string.split("&")
+	else:
+		pairs = query_string.split("&", max_parts)[:max_parts]
+
+	# 名前のほとんどはASCIIの英数字なので、デコードが必要なものだけデコードする
+	non_ascii = _cre.non_ascii.search(query_string) != None
+	for pair in pairs:
+		if len(pair) == 0:
+			continue
+
+		(name, sep, value) = pair.partition("=")
+		if non_ascii or "%" in name or "+" in name:
+			name = decode_query(name)
+
+		entry = result.get(name)
+		if entry == None:
+			result[name] = value
+		elif isinstance(entry, list):
+			entry.append(value)
+		else:
+			result[name] = [entry, value]
+
+	return result
+
+
+def decode_query(value, encoding = "utf-8"):
+	""" クエリ文字列の名前・値をデコード
+
+	@param value: 名前・値（WSGIの環境変数の形式（latin-1でデコードされたもの））
+	@param encoding: 文字コード
+	@return: デコード結果
+	"""
+	if _cre.query_plain.match(value):
+		# デコード不要
+		return value
+
+	if not isinstance(value, bytes):
+		# Python 3の環境変数はlatin-1でデコードされている（Python 2ではバイト列のまま）
+		value = value.encode("latin-1")
+
+	return decode_urlencoded(value, encoding)
+
+
+def _read_chunks(fp, length, max_content_length):
+	""" 入力ストリームを一定サイズずつ読み込む
+	返すのは使い回しのバッファのビューなので、次を読み込む前に処理（コピー）すること
+
+	@param fp: 入力ストリーム
+	@param length: 読み込むサイズ（Noneなら終端まで）
+	@param max_content_length: 最大サイズ（Noneなら無制限）
+	@return: 読み込んだデータのジェネレータ
+	"""
+	if fp == None:
+		return
+
+	buf = bytearray(CHUNK_SIZE)
+	view = memoryview(buf)
+	readinto = getattr(fp, "readinto", None)
+	total = 0
+	while length == None or total < length:
+		size = CHUNK_SIZE
+		if length != None:
+			size = min(size, length - total)
+
+		if readinto != None:
+			count = readinto(view[:size])
+			data = view[:count]
+		else:
+			data = fp.read(size)
+			count = len(data)
+
+		if not count:
+			# クライアントが途中で切断した
+			break
+
+		total += count
+		if max_content_length != None and total > max_content_length:
+			raise LimitExceeded("request body is too large")
+
+		yield data
+
+
+def _parse_urlencoded(chunks, form, max_memory_size, max_parts, encoding):
+	""" application/x-www-form-urlencoded を解析
+
+	@param chunks: 読み込んだデータのイテレータ
+	@param form: 解析結果の格納先
+	@param max_memory_size: 最大サイズ
+	@param max_parts: 最大項目数
+	@param encoding: 文字コード
+	"""
+	data = bytearray()
+	for chunk in chunks:
+		data += chunk
+		if max_memory_size != None and len(data) > max_memory_size:
+			raise LimitExceeded("form data is too large")
+
+	if len(data) == 0:
+		return
+
+	if max_parts != None and data.count(b"&") >= max_parts:
+		raise LimitExceeded("too many form fields")
+
+	for pair in data.split(b"&"):
+		if len(pair) == 0:
+			continue
+
+		(name, sep, value) = pair.partition(b"=")
+		form.add_field(decode_urlencoded(name, encoding), decode_urlencoded(value, encoding))
+
+
+def _parse_multipart(chunks, boundary, form, max_memory_size, max_parts, file_factory, encoding):
+	""" multipart/form-data を解析
+
+	@param chunks: 読み込んだデータのイテレータ
+	@param boundary: 境界文字列（バイト列）
+	@param form: 解析結果の格納先
+	@param max_memory_size: ファイル以外の値の合計の最大サイズ
+	@param max_parts: 最大項目数
+	@param file_factory: アップロードファイルの書き込み先を作成する関数
+	@param encoding: 文字コード
+	"""
+	delimiter = b"--" + boundary
+	separator = b"\r\n" + delimiter
+	buf = bytearray()
+	state = _STATE_PREAMBLE
+	part = None
+	memory_size = 0
+	parts = 0
+	for chunk in chunks:
+		buf += chunk
+		while True:
+			if state == _STATE_PREAMBLE:
+				# 最初の区切りまでは読み飛ばす
+				index = buf.find(delimiter)
+				if index < 0:
+					del buf[:max(0, len(buf) - len(delimiter) + 1)]
+					break
+
+				del buf[:index + len(delimiter)]
+				state = _STATE_DELIMITER
+
+			elif state == _STATE_DELIMITER:
+				# 区切りの直後が "--" なら終端、そうでなければ行末までがパディング
+				if buf[:2] == b"--":
+					state = _STATE_END
+					continue
+
+				index = buf.find(b"\r\n")
+				if index < 0:
+					if len(buf) > MAX_HEADER_SIZE:
+						raise LimitExceeded("malformed multipart boundary")
+					break
+
+				del buf[:index + 2]
+				state = _STATE_HEADERS
+
+			elif state == _STATE_HEADERS:
+				if buf[:2] == b"\r\n":
+					# ヘッダなし
+					(index, size) = (0, 2)
+				else:
+					index = buf.find(b"\r\n\r\n")
+					if index < 0:
+						if len(buf) > MAX_HEADER_SIZE:
+							raise LimitExceeded("multipart headers are too large")
+						break
+
+					size = index + 4
+
+				parts += 1
+				if max_parts != None and parts > max_parts:
+					raise LimitExceeded("too many form fields")
+
+				part = _Part(bytes(buf[:index]).decode(encoding, "replace"), file_factory, encoding)
+				del buf[:size]
+				state = _STATE_BODY
+
+			elif state == _STATE_BODY:
+				index = buf.find(separator)
+				if index < 0:
+					# 区切りの途中かもしれない末尾を残して書き出す
+					count = len(buf) - len(separator) + 1
+					if count > 0:
+						memory_size += part.write(buf, count)
+						del buf[:count]
+				else:
+					memory_size += part.write(buf, index)
+					del buf[:index + len(separator)]
+					part.finish(form)
+					part = None
+					state = _STATE_DELIMITER
+
+				if max_memory_size != None and memory_size > max_memory_size:
+					raise LimitExceeded("form data is too large")
+
+				if index < 0:
+					break
+
+			else:
+				# 終端以降（エピローグ）は無視
+				del buf[:]
+				break
+
+		if state == _STATE_END:
+			break
+
+
+class _Part(object):
+	""" multipartの1パート """
+
+	def __init__(self, headers, file_factory, encoding):
+		""" コンストラクタ
+
+		@param headers: ヘッダ（文字列）
+		@param file_factory: アップロードファイルの書き込み先を作成する関数
+		@param encoding: 文字コード
+		"""
+		disposition = ""
+		content_type = None
+		for line in headers.split("\r\n"):
+			(name, sep, value) = line.partition(":")
+			name = name.strip().lower()
+			if name == "content-disposition":
+				disposition = value
+			elif name == "content-type":
+				content_type = value.strip()
+
+		(disposition_type, params) = parse_header(disposition)
+		self.__name = params.get("name")
+		self.__filename = params.get("filename")
+		self.__type = content_type
+		self.__encoding = encoding
+		if content_type != None:
+			self.__encoding = parse_header(content_type)[1].get("charset", encoding)
+
+		if self.__name == None:
+			# 名前がなければ捨てる
+			self.__sink = None
+		elif self.__filename != None:
+			self.__sink = _create_file(file_factory, self.__name, self.__filename, content_type)
+		else:
+			self.__sink = bytearray()
+
+
+	def write(self, buf, count):
+		""" 内容を書き込む
+
+		@param buf: バッファ
+		@param count: 先頭から書き込むサイズ
+		@return: メモリに保持したサイズ
+		"""
+		sink = self.__sink
+		if sink == None or count == 0:
+			return 0
+
+		# バッファはこの後サイズを変えるので、ビューはすぐ解放する
+		# （Python 2のmemoryviewはwith文に使えないし、release()もない）
+		data = memoryview(buf)[:count]
+		try:
+			if isinstance(sink, bytearray):
+				sink += data
+				return count
+
+			sink.write(data)
+			return 0
+
+		finally:
+			if hasattr(data, "release"):
+				data.release()
+
+
+	def finish(self, form):
+		""" 解析結果に追加
+
+		@param form: 解析結果の格納先
+		"""
+		sink = self.__sink
+		if sink == None:
+			return
+
+		if isinstance(sink, bytearray):
+			form.add_field(self.__name, sink.decode(self.__encoding, "replace"))
+			return
+
+		if hasattr(sink, "seek"):
+			sink.seek(0)
+
+		form.add_file(self.__name, UploadedFile(self.__name, self.__filename, self.__type, sink))
+
+
+def _create_file(file_factory, name, filename, content_type):
+	""" アップロードファイルの書き込み先を作成
+
+	@param file_factory: 作成する関数（Noneなら一時ファイル）
+	@param name: パラメータ名
+	@param filename: ファイル名
+	@param content_type: Content-Type
+	@return: ファイルオブジェクト
+	"""
+	if file_factory != None:
+		return file_factory(name, filename, content_type)
+
+	from tempfile import TemporaryFile
+	return TemporaryFile()
+
+
+def _test():
+	""" テスト """
+	from io import BytesIO
+
+	def _parse(body, content_type, **kwargs):
+		return parse(BytesIO(body), content_type, len(body), **kwargs)
+
+	# ヘッダ
+	assert parse_header("text/html") == ("text/html", {})
+	assert parse_header('form-data; name="a;b"; filename="C:\\dir\\x.txt"') == ("form-data", {"name": "a;b", "filename": "C:\\dir\\x.txt"})
+	assert parse_header("multipart/form-data; boundary=xyz") == ("multipart/form-data", {"boundary": "xyz"})
+
+	# URLエンコード
+	form = _parse(b"a=1&b=%E3%81%82&a=x+y&c&=d", "application/x-www-form-urlencoded")
+	assert form.fields == {"a": ["1", "x y"], "b": [u"\u3042"], "c": [""], "": ["d"]}
+	assert _parse(b"a=1", "text/plain").fields == {}
+
+	# クエリ文字列
+	assert split_query("") == {}
+	assert split_query("a=1&b=2&a=3&c&&d=") == {"a": ["1", "3"], "b": "2", "c": "", "d": ""}
+	assert split_query("a=1&b=2&c=3", 2) == {"a": "1", "b": "2"}
+	assert split_query("%E3%81%82=x+y") == {u"\u3042": "x+y"}
+	assert decode_query("x+y%21") == "x y!"
+	assert decode_query("\xe3\x81\x82") == u"\u3042"
+	assert decode_query("plain") == "plain"
+
+	# multipart（チャンクの境界がどこにあっても同じ結果になる）
+	body = (
+		b"preamble\r\n"
+		b"--XyZ\r\n"
+		b'Content-Disposition: form-data; name="text"\r\n'
+		b"\r\n"
+		b"hello\r\nworld\r\n"
+		b"--XyZ\r\n"
+		b'Content-Disposition: form-data; name="file"; filename="a.bin"\r\n'
+		b"Content-Type: application/octet-stream\r\n"
+		b"\r\n"
+		+ b"\x00\r\n--XyY-" * 1000 +
+		b"\r\n"
+		b"--XyZ\r\n"
+		b'Content-Disposition: form-data; name="empty"\r\n'
+		b"\r\n"
+		b"\r\n"
+		b"--XyZ--\r\n"
+		b"epilogue"
+	)
+	global CHUNK_SIZE
+	chunk_size = CHUNK_SIZE
+	try:
+		for CHUNK_SIZE in (1, 2, 3, 7, 64, 65536):
+			form = _parse(body, "multipart/form-data; boundary=XyZ")
+			assert form.fields == {"text": ["hello\r\nworld"], "empty": [""]}
+			uploaded = form.files["file"][0]
+			assert (uploaded.filename, uploaded.type) == ("a.bin", "application/octet-stream")
+			assert uploaded.file.read() == b"\x00\r\n--XyY-" * 1000
+
+	finally:
+		CHUNK_SIZE = chunk_size
+
+	# 上限
+	for (data, content_type, kwargs) in (
+		(body, "multipart/form-data; boundary=XyZ", {"max_content_length": 100}),
+		(body, "multipart/form-data; boundary=XyZ", {"max_parts": 2}),
+		(body, "multipart/form-data; boundary=XyZ", {"max_memory_size": 5}),
+		(b"a=1&b=2&c=3", "application/x-www-form-urlencoded", {"max_parts": 2}),
+		(b"a=1&b=2&c=3", "application/x-www-form-urlencoded", {"max_memory_size": 10}),
+	):
+		try:
+			_parse(data, content_type, **kwargs)
+			assert False, kwargs
+
+		except LimitExceeded:
+			pass
+
+	# 全体の読み込み
+	assert read_body(BytesIO(b"abcdef"), 4) == b"abcd"
+	assert read_body(BytesIO(b"abcdef")) == b"abcdef"
+	for (length, max_content_length) in ((None, 5), (6, 5)):
+		try:
+			read_body(BytesIO(b"abcdef"), length, max_content_length)
+			assert False
+
+		except LimitExceeded:
+			pass
+
+	# 書き込み先の指定
+	sinks = []
+	def _factory(name, filename, content_type):
+		sinks.append(BytesIO())
+		return sinks[-1]
+
+	form = _parse(body, "multipart/form-data; boundary=XyZ", file_factory = _factory)
+	assert form.files["file"][0].file is sinks[0]
+
+
+if __name__ == "__main__":
+	_test()
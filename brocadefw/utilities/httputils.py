@@ -76,6 +76,115 @@ def get_status_value(status):
 	return result
 
 
+def parse_accept_quality(accept):
+	""" Accept-XXXヘッダの値をq値つきで解析
+
+	@param accept: ヘッダの値（例: "gzip, deflate;q=0.5, *;q=0"）
+	@return: (値（小文字）, q値)のリスト（ヘッダ内の順）
+	"""
+	result = []
+	for piece in accept.split(","):
+		params = piece.split(";")
+		value = params[0].strip().lower()
+		if len(value) == 0:
+			continue
+
+		quality = 1.0
+		for param in params[1:]:
+			(name, sep, q) = param.partition("=")
+			if name.strip().lower() != "q":
+				continue
+
+			try:
+				quality = min(max(float(q), 0.0), 1.0)
+
+			except ValueError:
+				quality = 0.0
+
+		result.append((value, quality))
+
+	return result
+
+
+def make_etag(data, weak = True):
+	""" 内容からETagを生成（1回のハッシュ計算だけで済ませる）
+
+	@param data: 内容（バイト列）
+	@param weak: 弱いETagにするならTrue（圧縮方法によらず同じ値になる）
+	@return: ETag（例: 'W/"0123456789abcdef"'）
+	"""
+	from hashlib import md5
+	etag = '"{hash}"'.format(hash = md5(data).hexdigest()[:16])
+	if weak:
+		etag = "W/" + etag
+
+	return etag
+
+
+def match_etag(if_none_match, etag):
+	""" If-None-MatchヘッダとETagを弱い比較で照合
+
+	@param if_none_match: If-None-Matchヘッダの値
+	@param etag: ETag
+	@return: 一致するものがあればTrue
+	"""
+	if if_none_match.strip() == "*":
+		return True
+
+	def _opaque(tag):
+		tag = tag.strip()
+		if tag.startswith("W/"):
+			tag = tag[2:]
+		return tag
+
+	opaque = _opaque(etag)
+	for tag in if_none_match.split(","):
+		if _opaque(tag) == opaque:
+			return True
+
+	return False
+
+
+# Content-Encodingの別名
+_ENCODING_ALIASES = {
+	"x-gzip"    : "gzip",
+	"x-compress": "compress",
+}
+
+def select_encoding(accepted, available):
+	""" Accept-Encodingの解析結果から、使用するContent-Encodingを選択
+
+	@param accepted: parse_accept_qualityの結果（ヘッダがなければNone）
+	@param available: 使用可能なContent-Encodingのリスト（優先順）
+	@return: Content-Encoding（圧縮しない方がよければNone）
+	"""
+	if accepted == None:
+		# ヘッダがない＝何でも受け入れるが、圧縮形式を理解できるとは限らないので圧縮しない
+		return None
+
+	qualities = {}
+	for (value, quality) in accepted:
+		qualities[_ENCODING_ALIASES.get(value, value)] = quality
+
+	# 無圧縮のq値が明示されていれば、それより優先度が高い場合だけ圧縮する
+	wildcard = qualities.get("*")
+	identity = qualities.get("identity", 0.0)
+
+	selected = None
+	selected_quality = 0.0
+	for encoding in available:
+		quality = qualities.get(encoding, wildcard)
+		if quality != None and quality > selected_quality:
+			selected = encoding
+			selected_quality = quality
+
+	# 同じq値なら圧縮する方を選ぶ
+	if selected == None or selected_quality < identity:
+		return None
+
+	return selected
+
+
 class UserAgent:
 	""" UA解析 """
 
@@ -107,3 +216,172 @@ class UserAgent:
 					return name
 
 		return None
+
+
+class DeviceMatcher(object):
+	""" デバイス識別情報をコンパイルしたもの
+
+	全キーワードを1つの正規表現にまとめて1回の走査で探し、結果はUAごとにLRU方式で記憶する
+	"""
+
+	def __init__(self, device_info, maxsize = 1024):
+		""" コンストラクタ
+
+		@param device_info: デバイス識別情報（UserAgent.parse_deviceと同じ形式）
+		@param maxsize: 記憶しておくUAの最大数
+		"""
+		import re
+		from ..db import kvs
+
+		rules = []
+		keywords = set()
+		for name, keyword_list in device_info:
+			conditions = []
+			for elements in keyword_list:
+				if not isinstance(elements, tuple):
+					elements = (elements, )
+
+				# elements内の文字列が全て含まれていればOK
+				conditions.append(frozenset(elements))
+				keywords.update(elements)
+
+			rules.append((name, conditions))
+
+		self.__rules = rules
+		self.__memo = kvs.LRUCache(maxsize)
+		self.__regex = None
+		if len(keywords) > 0:
+			# 同じ位置から始まるキーワードは長いものを優先し、先読みで重なり合うキーワードも全て見つける
+			ordered = sorted(keywords, key = len, reverse = True)
+			self.__regex = re.compile("(?=(" + "|".join(re.escape(keyword) for keyword in ordered) + "))")
+
+		# あるキーワードが見つかれば、その部分文字列であるキーワードも見つかったことになる
+		self.__implied = dict((keyword, frozenset(other for other in keywords if other in keyword)) for keyword in keywords)
+
+
+	def parse(self, user_agent):
+		""" UA内のデバイス情報を解析
+
+		@param user_agent: UA
+		@return: デバイス情報（識別できなければNone）
+		"""
+		memo = self.__memo.get(user_agent)
+		if memo != None:
+			return memo[0]
+
+		device = self.__parse(user_agent)
+		self.__memo.set(user_agent, (device, ))
+		return device
+
+
+	def __parse(self, user_agent):
+		""" UA内のデバイス情報を解析（キャッシュ不使用版）
+
+		@param user_agent: UA
+		@return: デバイス情報（識別できなければNone）
+		"""
+		if self.__regex == None:
+			return None
+
+		found = set()
+		implied = self.__implied
+		for match in self.__regex.finditer(user_agent):
+			found.update(implied[match.group(1)])
+
+		for name, conditions in self.__rules:
+			for elements in conditions:
+				if elements <= found:
+					return name
+
+		return None
+
+
+def _test():
+	""" テスト """
+	########################################
+	# Accept-Encodingの解析
+	assert parse_accept_quality("gzip, deflate;q=0.5, *;q=0") == [("gzip", 1.0), ("deflate", 0.5), ("*", 0.0)]
+	assert parse_accept_quality("GZIP;Q=2, br;q=x, , identity ; q=0.1") == [("gzip", 1.0), ("br", 0.0), ("identity", 0.1)]
+
+	########################################
+	# Content-Encodingの選択
+	available = ("gzip", "deflate")
+	def _select(accept_encoding):
+		if accept_encoding == None:
+			return select_encoding(None, available)
+		return select_encoding(parse_accept_quality(accept_encoding), available)
+
+	# ヘッダがない・空なら圧縮しない
+	assert _select(None) == None
+	assert _select("") == None
+
+	# q値の高いもの、同じなら使用可能なリストで先のものを選ぶ
+	assert _select("gzip, deflate") == "gzip"
+	assert _select("deflate, gzip") == "gzip"
+	assert _select("gzip;q=0.5, deflate") == "deflate"
+	assert _select("x-gzip") == "gzip"
+	assert _select("br") == None
+
+	# q=0は受け入れない
+	assert _select("gzip;q=0") == None
+	assert _select("gzip;q=0, deflate;q=0") == None
+
+	# ワイルドカードは明示されていないものに適用する
+	assert _select("*") == "gzip"
+	assert _select("*, gzip;q=0") == "deflate"
+	assert _select("*;q=0") == None
+	assert _select("*;q=0, deflate") == "deflate"
+
+	# 無圧縮の方がq値が高ければ圧縮しない（同じなら圧縮する）
+	assert _select("gzip;q=0.5, identity") == None
+	assert _select("gzip;q=0.5, identity;q=0.5") == "gzip"
+	assert _select("*;q=0.5, identity;q=1") == None
+	assert _select("gzip, identity;q=0") == "gzip"
+
+	########################################
+	# デバイス識別
+	device_info = (
+		("smartphone"  , ("iPhone", "iPod", ("Android", "Mobile"), "dream", "CUPCAKE", "Windows Phone", "blackberry", "webOS", "incognito", "webmate")),
+		("tablet"      , ("iPad", "Android")),
+		("featurephone", ("DoCoMo", "KDDI", "DDIPOKET", "UP.Browser"," J-PHONE", "Vodafone", "SoftBank")),
+	)
+	user_agents = {
+		"Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)"             : "smartphone",
+		"Mozilla/5.0 (Linux; Android 14; Pixel 8) Mobile Safari/537.36"      : "smartphone",
+		"Mozilla/5.0 (Linux; Android 14; SM-X710) Safari/537.36"             : "tablet",
+		"Mozilla/5.0 (iPad; CPU OS 17_0 like Mac OS X)"                      : "tablet",
+		"DoCoMo/2.0 N905i(c100;TB;W24H16)"                                   : "featurephone",
+		"SoftBank/1.0/930SH/SHJ001 Browser/NetFront/3.4 Profile/MIDP-2.0"    : "featurephone",
+		"Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0 Safari/537.36": None,
+		""                                                                   : None,
+	}
+	matcher = DeviceMatcher(device_info)
+	for user_agent, device in user_agents.items():
+		# 線形探索版と同じ結果になる
+		assert UserAgent(user_agent).parse_device(device_info) == device
+		assert matcher.parse(user_agent) == device
+
+	# 重なり合うキーワード・他のキーワードの部分文字列になっているキーワードも見つかる（先に指定したものを優先）
+	assert DeviceMatcher((("a", (("ab", "bc"), )), )).parse("abc") == "a"
+	assert DeviceMatcher((("a", ("Phone", )), ("b", ("Phone X", )))).parse("Phone X") == "a"
+	assert DeviceMatcher(()).parse("iPhone") == None
+
+	# 識別結果はUAごとに記憶する（識別できなかった結果も含む）
+	matcher = DeviceMatcher(device_info, 2)
+	memo = matcher._DeviceMatcher__memo
+	assert matcher.parse("iPad") == "tablet"
+	assert matcher.parse("curl/8.0") == None
+	assert matcher.parse("iPad") == "tablet"
+	assert matcher.parse("curl/8.0") == None
+	assert memo.stats() == {"hits": 2, "misses": 2, "size": 2, "maxsize": 2}
+
+	# 上限を超えたら最も長い間使われていないUAが追い出される
+	assert matcher.parse("iPod") == "smartphone"
+	assert memo.stats()["size"] == 2
+	assert memo.get("iPad") == None
+
+	print("OK")
+
+
+if __name__ == "__main__":
+	_test()
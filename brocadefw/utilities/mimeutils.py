@@ -10,6 +10,19 @@ XHTML = "application/xhtml+xml"
 JSON  = "application/json"
 SVG   = "image/svg+xml"
 
+# 圧縮して効果があるMIMEタイプ
+COMPRESSIBLE = frozenset((TEXT, HTML, CSS, JS, XML, XHTML, JSON, SVG, "text/javascript", "text/xml", "text/csv", "image/x-icon", "image/vnd.microsoft.icon"))
+
 def needs_charset(mime_type):
 	""" charset指定が必要なMIMEタイプか？ """
 	return mime_type in (TEXT, HTML)
+
+
+def is_compressible(mime_type, types = COMPRESSIBLE):
+	""" 圧縮して効果があるMIMEタイプか？
+
+	@param mime_type: MIMEタイプ（パラメータつきでもよい）
+	@param types: 圧縮するMIMEタイプの一覧
+	@return: Yes/No
+	"""
+	return mime_type.split(";", 1)[0].strip().lower() in types
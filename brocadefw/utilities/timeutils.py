@@ -38,8 +38,42 @@ def format_unixtime(format = FORMAT_RFC2822, timestamp = None):
 	return datetime.fromtimestamp(timestamp, tz = pytz.utc).strftime(format)
 
 
+def format_http_date(timestamp = None):
+	""" UnixタイムスタンプをHTTPの日時形式（RFC 7231のIMF-fixdate）にフォーマッティング
+	（format_unixtimeと違ってpytzは不要）
+
+	@param timestamp: Unixタイムスタンプ; 省略時は現在時刻
+	@return: 日時文字列（例: "Sun, 06 Nov 1994 08:49:37 GMT"）
+	"""
+	from email.utils import formatdate
+	return formatdate(timestamp, usegmt = True)
+
+
+def parse_http_date(value):
+	""" HTTPの日時形式をUnixタイムスタンプに変換
+
+	@param value: 日時文字列
+	@return: Unixタイムスタンプ（解析できなければNone）
+	"""
+	from email.utils import parsedate_tz, mktime_tz
+	parsed = parsedate_tz(value)
+	if parsed == None:
+		return None
+
+	try:
+		return mktime_tz(parsed)
+
+	except (OverflowError, ValueError):
+		return None
+
+
 def _test():
 	""" テスト """
+	assert format_http_date(784111777) == "Sun, 06 Nov 1994 08:49:37 GMT"
+	assert parse_http_date("Sun, 06 Nov 1994 08:49:37 GMT") == 784111777
+	assert parse_http_date("Sunday, 06-Nov-94 08:49:37 GMT") == 784111777
+	assert parse_http_date("invalid") == None
+
 	print(format_unixtime())
 	print(format_unixtime(FORMAT_RFC822))
 	print(format_unixtime(FORMAT_RFC3339))
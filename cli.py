@@ -5,7 +5,84 @@
 @author: shimataro
 """
 
+import root
+
 def main():
+	import argparse
+	parser = argparse.ArgumentParser(description = "BrocadeFW command line interface")
+	subparsers = parser.add_subparsers(dest = "command")
+
+	# テンプレートの事前コンパイル
+	subparser = subparsers.add_parser("precompile-templates", help = "compile all templates into the on-disk cache")
+	subparser.add_argument("--driver", default = "mako", help = "template driver (default: mako)")
+	subparser.add_argument("--processes", type = int, default = None, help = "number of worker processes (default: number of CPUs)")
+	subparser.add_argument("--minify-source", action = "store_true", help = "minify HTML templates at compile time (for handlers with MINIFY_TEMPLATE_SOURCE)")
+	subparser.set_defaults(func = precompile_templates)
+
+	# 静的ファイルのビルド
+	subparser = subparsers.add_parser("build-static", help = "minify static files and write content-hashed, precompressed copies")
+	subparser.add_argument("--no-brotli", action = "store_true", help = "do not write brotli-compressed variants")
+	subparser.set_defaults(func = build_static)
+
+	args = parser.parse_args()
+	if not hasattr(args, "func"):
+		parser.print_help()
+		return 1
+
+	return args.func(args)
+
+
+def precompile_templates(args):
+	""" テンプレートを事前コンパイル
+
+	@param args: コマンドライン引数
+	@return: 終了ステータス
+	"""
+	from os.path import join, relpath
+	from brocadefw.output import template, precompile, minify
+
+	root_dir = root.get_root_dir()
+	base_dir = join(root_dir, "templates")
+	compile_dir = template.get_compile_dir(root_dir, args.driver)
+	if compile_dir == None:
+		print("cannot write compiled templates to tmp/")
+		return 1
+
+	filters_source = {}
+	if args.minify_source:
+		filters_source["html"] = minify.html
+
+	failures = 0
+	for (filename, elapsed, error) in precompile.precompile(base_dir, compile_dir, args.driver, args.processes, filters_source = filters_source):
+		name = relpath(filename, base_dir)
+		if error != None:
+			failures += 1
+			print("FAILED {name}: {error}".format(name = name, error = error))
+		else:
+			print("{elapsed:8.1f}ms {name}".format(elapsed = elapsed * 1000, name = name))
+
+	if failures > 0:
+		print("{failures} template(s) failed".format(failures = failures))
+		return 1
+
+	return 0
+
+
+def build_static(args):
+	""" 静的ファイルをビルド
+
+	@param args: コマンドライン引数
+	@return: 終了ステータス
+	"""
+	from os.path import join
+	from brocadefw.output import assets
+
+	root_dir = root.get_root_dir()
+	source_dir = join(root_dir, "static")
+	output_dir = assets.get_output_dir(root_dir)
+	for (name, hashed_name, size, output_size, encodings) in assets.build(source_dir, output_dir, not args.no_brotli):
+		print("{size:8d} -> {output_size:8d} {hashed_name} {encodings}".format(size = size, output_size = output_size, hashed_name = hashed_name, encodings = ",".join(encodings)))
+
 	return 0
 
 
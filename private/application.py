@@ -13,6 +13,7 @@ def create_application(root_dir):
 		("private.web.default", "Handler"),
 		(r"^/$", "private.web.index", "Handler"),
 		(r"^/hell$", "private.web.hell", "Handler"),
+		(r"^/static/(.+)$", "brocadefw.application_wsgi", "WSGI_StaticHandler"),
 	)
 
 
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+""" ベンチマーク: ハンドラの生成方法ごとのリクエスト処理速度・1リクエストあたりのメモリ確保量
+
+以前の方式（environのコピー・インスタンス辞書）、__slots__、__slots__+ハンドラプール（HANDLER_POOLING）を比較する。
+python tools/bench/handler_pool.py
+
+@author: shimataro
+"""
+
+import sys
+from os.path import abspath, dirname, join
+sys.path.insert(0, abspath(join(dirname(__file__), "..", "..")))
+
+from brocadefw import application_wsgi
+
+
+class BenchmarkHandler(application_wsgi.WSGI_Handler):
+	""" ベンチマーク用のハンドラ """
+
+	__slots__ = ()
+
+	def on_get(self):
+		""" リクエスト処理 """
+		return self.render_json({"message": "hello"})
+
+
+class BaselineHandler(application_wsgi.WSGI_Handler):
+	""" ベンチマーク用のハンドラ（比較用; 以前と同じくenvironをコピーし、インスタンス辞書を持つ） """
+
+	def __init__(self, root_dir, environ, start_response, default_language = "ja"):
+		environ = environ.copy()
+		super(BaselineHandler, self).__init__(root_dir, environ, start_response, default_language)
+		self.__environ = environ
+
+	def on_get(self):
+		""" リクエスト処理 """
+		return self.render_json({"message": "hello"})
+
+
+def main():
+	import shutil, tempfile
+	from timeit import repeat
+	from wsgiref.util import setup_testing_defaults
+
+	environ = {"PATH_INFO": "/", "HTTP_ACCEPT_ENCODING": "gzip", "HTTP_USER_AGENT": "Mozilla/5.0"}
+	setup_testing_defaults(environ)
+	def start_response(status, headers, exc_info = None):
+		pass
+
+	modes = (
+		("baseline", BaselineHandler, False),
+		("slots", BenchmarkHandler, False),
+		("slots+pool", BenchmarkHandler, True),
+	)
+	root_dir = tempfile.mkdtemp()
+	try:
+		for (name, handler, pooling) in modes:
+			class Application(application_wsgi.WSGI_Application):
+				WARM_ERROR_PAGES = False
+				HANDLER_POOLING = pooling
+
+			app = Application(root_dir, (__name__, handler.__name__))
+			request = lambda: b"".join(app(dict(environ), start_response))
+			request()
+
+			number = 10000
+			elapsed = min(repeat(request, number = number, repeat = 3))
+			print("{name:<10}: {rps:8.0f} req/s, {peak:>6}B/req, handler {size}B".format(name = name, rps = number / elapsed, peak = _measure_peak(request), size = _sizeof(handler(root_dir, environ, start_response))))
+
+	finally:
+		shutil.rmtree(root_dir)
+
+	return 0
+
+
+def _measure_peak(func):
+	""" 1回の呼び出し中に確保されるメモリのピーク（確保済みの量からの増分）を測定
+
+	@param func: 関数
+	@return: サイズ[byte]（tracemalloc.reset_peak()がない（Python 3.9より前の）場合は "-"）
+	"""
+	try:
+		import tracemalloc
+	except ImportError:
+		return "-"
+
+	if not hasattr(tracemalloc, "reset_peak"):
+		return "-"
+
+	tracemalloc.start()
+	try:
+		current = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		func()
+		return tracemalloc.get_traced_memory()[1] - current
+
+	finally:
+		tracemalloc.stop()
+
+
+def _sizeof(obj):
+	""" オブジェクトのサイズ（インスタンス辞書を含む）
+
+	@param obj: オブジェクト
+	@return: サイズ[byte]
+	"""
+	size = sys.getsizeof(obj)
+	if hasattr(obj, "__dict__"):
+		size += sys.getsizeof(obj.__dict__)
+
+	return size
+
+
+if __name__ == "__main__":
+	sys.exit(main())
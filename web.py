@@ -7,9 +7,60 @@
 
 import root
 from private.application import create_application
-application = create_application(root.get_root_dir())
+
+
+def main():
+	import argparse
+	parser = argparse.ArgumentParser(description = "BrocadeFW web server")
+	subparsers = parser.add_subparsers(dest = "command")
+
+	# テストサーバ（引数なしで実行した場合もこれ）
+	subparser = subparsers.add_parser("test", help = "run the single-threaded test server (do not use in production)")
+	subparser.add_argument("--host", default = "", help = "host to bind (default: all interfaces)")
+	subparser.add_argument("--port", type = int, default = 8080, help = "port to listen on (default: 8080)")
+	subparser.set_defaults(func = test)
+
+	# 本番用サーバ
+	subparser = subparsers.add_parser("serve", help = "run the pre-forking production server")
+	subparser.add_argument("--host", default = "", help = "host to bind (default: all interfaces)")
+	subparser.add_argument("--port", type = int, default = 8080, help = "port to listen on (default: 8080)")
+	subparser.add_argument("--workers", type = int, default = None, help = "number of worker processes (default: number of CPUs)")
+	subparser.add_argument("--threads", type = int, default = 8, help = "number of threads per worker (default: 8)")
+	subparser.add_argument("--max-requests", type = int, default = 0, help = "restart a worker after this many requests (default: 0 = never)")
+	subparser.add_argument("--no-preload", action = "store_true", help = "create the application in each worker instead of before fork (code changes are picked up on SIGHUP)")
+	subparser.set_defaults(func = serve)
+
+	args = parser.parse_args()
+	if not hasattr(args, "func"):
+		args = parser.parse_args(["test"])
+
+	return args.func(args)
+
+
+def test(args):
+	""" テストサーバを起動
+
+	@param args: コマンドライン引数
+	@return: 終了ステータス
+	"""
+	create_application(root.get_root_dir()).test_run(args.host, args.port)
+	return 0
+
+
+def serve(args):
+	""" 本番用サーバを起動（SIGHUPでグレースフルリロード、SIGTERMで終了）
+
+	@param args: コマンドライン引数
+	@return: 終了ステータス
+	"""
+	from brocadefw import server
+	server.serve(lambda: create_application(root.get_root_dir()), args.host, args.port, args.workers, args.threads, args.max_requests, not args.no_preload)
+	return 0
 
 
 if __name__ == "__main__":
-	# テストサーバ起動
-	application.test_run()
+	import sys
+	sys.exit(main())
+
+else:
+	application = create_application(root.get_root_dir())